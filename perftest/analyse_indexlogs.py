@@ -205,3 +205,57 @@ def parse_logfile(filename):
         else:
             times.append(newrow)
     return descline, times
+
+class profilerow(object):
+    __slots__ = ('field', 'name', 'calls', 'wall', 'cpu')
+    def __init__(self, field, name, calls, wall, cpu):
+        self.field = field
+        self.name = name
+        self.calls = int(calls)
+        self.wall = float(wall)
+        self.cpu = float(cpu)
+
+    def label(self):
+        if self.field:
+            return self.field + ':' + self.name
+        return self.name
+
+def parse_profile(filename):
+    """Parse a profile written by IndexingProfile.write_csv().
+
+    Returns a pair of lists of rows: the stages of indexing, and the field
+    actions.
+
+    """
+    fd = open(filename)
+    stages = []
+    actions = []
+    reader = csv.reader(fd)
+    headings = reader.next()
+    assert(','.join(headings) == 'Field,Stage/Action,Calls,Wall(seconds),CPU(seconds)')
+    for row in reader:
+        newrow = profilerow(*row)
+        if newrow.field:
+            actions.append(newrow)
+        else:
+            stages.append(newrow)
+    fd.close()
+    return stages, actions
+
+def generate_profile_figures(profile, outprefix, pretitle):
+    for rows, kind in zip(profile, ('stages', 'actions')):
+        if len(rows) == 0:
+            continue
+        pylab.figure()
+        positions = range(len(rows))
+        pylab.barh(positions, [row.wall for row in rows], height=0.4,
+                   color='b', label='Wall time')
+        pylab.barh([pos + 0.4 for pos in positions],
+                   [row.cpu for row in rows], height=0.4,
+                   color='g', label='CPU time')
+        pylab.yticks([pos + 0.4 for pos in positions],
+                     [row.label() for row in rows])
+        pylab.xlabel('Time (seconds)')
+        pylab.legend(loc="lower right")
+        pylab.title(pretitle + ': time spent in indexing %s' % kind)
+        pylab.savefig(outprefix + "profile_%s.png" % kind, format="png")
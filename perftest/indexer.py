@@ -131,9 +131,12 @@ def index_scriptindex_file(iconn, dbpath, dumpfd, logger, flushspeed, maxdocs,
     iconn.flush()
     log_entry(logger, dbpath, addcount, starttime, inputsize)
 
-def index_file(inputfile, dbpath, logpath, flushspeed, description, maxdocs, logspeed):
+def index_file(inputfile, dbpath, logpath, flushspeed, description, maxdocs, logspeed,
+               profilepath=None):
     create_index(dbpath)
     iconn = open_index(dbpath)
+    if profilepath is not None:
+        iconn.set_profiling()
     dumpfd = open(inputfile)
     logger = CsvLogger(logpath)
     descline = [description, "flushspeed=%d" % flushspeed]
@@ -144,4 +147,6 @@ def index_file(inputfile, dbpath, logpath, flushspeed, description, maxdocs, log
     logger.log(*descline)
     index_scriptindex_file(iconn, dbpath, dumpfd, logger, flushspeed, maxdocs,
                            logspeed)
+    if profilepath is not None:
+        iconn.get_profile().write_csv(profilepath)
 
@@ -110,6 +110,7 @@ def parse_argv(argv, **defaults):
 def do_index(config, testrun):
     dbpath = testrun.dbpath(config)
     indexlogpath = testrun.indexlogpath(config)
+    indexprofilepath = testrun.indexprofilepath(config)
 
     if not config.preserve or \
        not os.path.exists(dbpath) or \
@@ -119,6 +120,8 @@ def do_index(config, testrun):
             shutil.rmtree(dbpath)
         if os.path.exists(indexlogpath):
             os.unlink(indexlogpath)
+        if os.path.exists(indexprofilepath):
+            os.unlink(indexprofilepath)
 
         print "Starting index run (creating %s)" % dbpath
         indexer.index_file(inputfile=testrun.inputfile,
@@ -127,7 +130,8 @@ def do_index(config, testrun):
                            flushspeed=testrun.flushspeed,
                            description=testrun.description,
                            maxdocs=testrun.maxdocs,
-                           logspeed=testrun.logspeed)
+                           logspeed=testrun.logspeed,
+                           profilepath=indexprofilepath)
         print "Ending index run"
 
 def do_search(config, testrun):
@@ -165,6 +169,11 @@ def analyse_index(config):
         filenameprefix = testrun.filename_safe_description() + testrun.maxdocs_pathbit()
 
         analyse_indexlogs.generate_figures(times, outprefix, title_line)
+        indexprofilepath = testrun.indexprofilepath(config)
+        if os.path.exists(indexprofilepath):
+            profile = analyse_indexlogs.parse_profile(indexprofilepath)
+            analyse_indexlogs.generate_profile_figures(profile, outprefix,
+                                                       title_line)
         if filenameprefix not in alltimes:
             alltimes[filenameprefix] = (testrun.description, [])
         alltimes[filenameprefix][1].append(("flush=%d" % testrun.flushspeed, times))
@@ -255,6 +264,9 @@ class TestRun(object):
     def indexlogpath(self, config):
         return os.path.join(config.outdir, 'indexlog_%s.csv' % self._index_pathbit())
 
+    def indexprofilepath(self, config):
+        return os.path.join(config.outdir, 'indexprofile_%s.csv' % self._index_pathbit())
+
     def indexoutprefix(self, config):
         return os.path.join(config.outdir, 'index_%s_' % self._index_pathbit())
 
@@ -34,5 +34,11 @@ from errors import *
 from fieldactions import FieldActions
 from fields import Field, FieldGroup
 from indexerconnection import IndexerConnection
+from parallel import ProcessorPool
 from query import Query
 from searchconnection import SearchConnection, ExternalWeightSource
+from sharding import ShardedIndexerConnection, ShardedSearchConnection
+from multisearch import MultiSearchConnection
+from searchpool import SearchConnectionPool
+from asyncsearch import AsyncSearchConnection
+from bulkbuild import BulkBuilder
@@ -0,0 +1,460 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""asyncsearch.py: Run searches without blocking the calling thread.
+
+An AsyncSearchConnection performs searches and other calls on a bounded set of
+worker threads, each using a connection from a SearchConnectionPool, and
+returns a SearchFuture for each call.  Xapian releases the global interpreter
+lock while matching, so a slow search in one worker doesn't stop the calling
+thread (for example, an event loop) or the other workers from running.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import heapq
+import Queue
+import sys
+import threading
+import time
+
+import errors
+from searchpool import SearchConnectionPool
+
+class SearchFuture(object):
+    """The pending result of a call made by an AsyncSearchConnection.
+
+    """
+    _PENDING, _RUNNING, _FINISHED, _CANCELLED = range(4)
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._state = self._PENDING
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def _start(self):
+        """Mark the call as running.
+
+        Returns False if it has already finished or been cancelled, in which
+        case it shouldn't be run.
+
+        """
+        self._cond.acquire()
+        try:
+            if self._state != self._PENDING:
+                return False
+            self._state = self._RUNNING
+            return True
+        finally:
+            self._cond.release()
+
+    def _finish(self, state, result=None, exc_info=None):
+        """Set the outcome of the call, unless it already has one.
+
+        """
+        self._cond.acquire()
+        try:
+            if self._state in (self._FINISHED, self._CANCELLED):
+                return False
+            self._state = state
+            self._result = result
+            self._exc_info = exc_info
+            callbacks, self._callbacks = self._callbacks, []
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        for callback in callbacks:
+            callback(self)
+        return True
+
+    def _set_result(self, result):
+        return self._finish(self._FINISHED, result=result)
+
+    def _set_exc_info(self, exc_info):
+        return self._finish(self._FINISHED, exc_info=exc_info)
+
+    def cancel(self):
+        """Cancel the call, if it hasn't started running.
+
+        Returns True if the call was cancelled (or had already been
+        cancelled).  A call which is running can't be interrupted, so False is
+        returned for it, and for calls which have finished.
+
+        """
+        self._cond.acquire()
+        try:
+            if self._state == self._CANCELLED:
+                return True
+            if self._state != self._PENDING:
+                return False
+        finally:
+            self._cond.release()
+        return self._finish(self._CANCELLED)
+
+    def cancelled(self):
+        """Check if the call was cancelled.
+
+        """
+        return self._state == self._CANCELLED
+
+    def running(self):
+        """Check if the call is running.
+
+        """
+        return self._state == self._RUNNING
+
+    def done(self):
+        """Check if the call has finished, or was cancelled.
+
+        """
+        return self._state in (self._FINISHED, self._CANCELLED)
+
+    def add_done_callback(self, callback):
+        """Add a callback to be called when the call finishes.
+
+        The callback is passed the future.  It is called in the worker thread
+        which finished the call (or immediately, if the call has already
+        finished), so a callback which needs to resume an event loop should use
+        the loop's thread-safe method for scheduling a call.
+
+        """
+        self._cond.acquire()
+        try:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._cond.release()
+        callback(self)
+
+    def _wait(self, timeout):
+        self._cond.acquire()
+        try:
+            if timeout is None:
+                while not self.done():
+                    self._cond.wait()
+            else:
+                endtime = time.time() + timeout
+                while not self.done():
+                    remaining = endtime - time.time()
+                    if remaining <= 0:
+                        raise errors.SearchError("Timed out waiting for the "
+                                                 "result of a search call")
+                    self._cond.wait(remaining)
+        finally:
+            self._cond.release()
+        if self._state == self._CANCELLED:
+            raise errors.SearchError("Search call was cancelled")
+
+    def result(self, timeout=None):
+        """Get the result of the call, waiting for it if necessary.
+
+        If the call raised an exception, it is raised again here.  If the
+        call was cancelled, or `timeout` is not None and the call doesn't
+        finish within `timeout` seconds, a SearchError is raised.
+
+        """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """Get the exception raised by the call, or None if it succeeded.
+
+        Waits for the call as for `result()`.
+
+        """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+class _TimeoutWatcher(object):
+    """A thread which fails calls which haven't finished by their deadline.
+
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._count = 0
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def add(self, future, timeout):
+        self._cond.acquire()
+        try:
+            self._count += 1
+            heapq.heappush(self._heap,
+                           (time.time() + timeout, self._count, future))
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def _run(self):
+        while True:
+            self._cond.acquire()
+            try:
+                while not self._stopped:
+                    if self._heap:
+                        remaining = self._heap[0][0] - time.time()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._stopped:
+                    return
+                future = heapq.heappop(self._heap)[2]
+            finally:
+                self._cond.release()
+            if not future.done():
+                try:
+                    raise errors.SearchError("Search call timed out")
+                except errors.SearchError:
+                    future._set_exc_info(sys.exc_info())
+
+    def stop(self):
+        self._cond.acquire()
+        try:
+            self._stopped = True
+            self._heap = []
+            self._cond.notify()
+        finally:
+            self._cond.release()
+        self._thread.join()
+
+class AsyncSearchConnection(object):
+    """A connection for searching, whose calls return immediately.
+
+    Each method returns a SearchFuture, whose result can be waited for, or
+    which can call a callback when the call finishes.  For example::
+
+        conn = AsyncSearchConnection(indexpath, workers=4)
+        future = conn.search('hello world', 0, 10, timeout=2.0)
+        future.add_done_callback(on_results)
+
+    The calls are run in order by `workers` threads.  At most `max_pending`
+    calls may be waiting to be run; if more are made, a SearchError is raised
+    immediately, rather than the caller being blocked.
+
+    If a call is given a `timeout`, and it hasn't finished that many seconds
+    after it was made, its future fails with a SearchError.  A call which
+    hasn't started by then is not run at all; one which is running can't be
+    interrupted, so carries on in its worker but its result is discarded.
+
+    SearchConnections aren't thread-safe, so a result is only safe to use
+    after the call has finished if it doesn't refer to the connection it was
+    made with.  The search results and documents returned by the methods here
+    are detached from it in the worker: their stored data is read, and their
+    xapian documents are copied.  Other work which needs the connection (such
+    as highlighting search results) should be done in the worker, either by
+    passing a `process` function to `search()` or by using `submit()`.
+
+    """
+    _pool = None
+    _workers = ()
+
+    def __init__(self, indexpath, workers=4, max_pending=100, pool=None):
+        """Create an asynchronous connection to the index at `indexpath`.
+
+        If `pool` is None, a SearchConnectionPool with `workers` connections
+        is created for the workers to use, and closed with this connection.
+        Otherwise, `pool` is used (and must be closed separately); it should
+        allow at least `workers` connections, or workers will wait for each
+        other.
+
+        """
+        if workers < 1:
+            raise errors.SearchError("workers must be at least 1")
+        self._owns_pool = (pool is None)
+        if pool is None:
+            pool = SearchConnectionPool(indexpath, max_size=workers,
+                                        min_size=workers)
+        self._pool = pool
+        self._queue = Queue.Queue(max_pending)
+        self._closed = False
+        self._timeouts = _TimeoutWatcher()
+        self._workers = []
+        for i in xrange(workers):
+            thread = threading.Thread(target=self._run)
+            thread.setDaemon(True)
+            thread.start()
+            self._workers.append(thread)
+
+    def __del__(self):
+        self.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, func, args, kwargs = item
+            if not future._start():
+                continue
+            try:
+                conn = self._pool.checkout()
+            except:
+                future._set_exc_info(sys.exc_info())
+                continue
+            discard = False
+            try:
+                try:
+                    result = func(conn, *args, **kwargs)
+                except errors.XapianDatabaseError:
+                    # Don't reuse a connection which may be in a bad state.
+                    discard = True
+                    future._set_exc_info(sys.exc_info())
+                except:
+                    future._set_exc_info(sys.exc_info())
+                else:
+                    future._set_result(result)
+            finally:
+                self._pool.checkin(conn, discard=discard)
+
+    def submit(self, func, args=(), kwargs=None, timeout=None):
+        """Call `func` in a worker, with a SearchConnection.
+
+        `func` is called with the connection as its first argument, followed
+        by `args` and `kwargs`.  Its return value is the result of the
+        returned SearchFuture.  It shouldn't return anything which needs to
+        read from the database after it has returned (such as a SearchResults
+        object whose documents haven't been loaded).
+
+        """
+        if self._closed:
+            raise errors.SearchError("AsyncSearchConnection has been closed")
+        if kwargs is None:
+            kwargs = {}
+        future = SearchFuture()
+        try:
+            self._queue.put_nowait((future, func, args, kwargs))
+        except Queue.Full:
+            raise errors.SearchError("Too many search calls pending")
+        if timeout is not None:
+            self._timeouts.add(future, timeout)
+        return future
+
+    def search(self, query, startrank, endrank, process=None, timeout=None,
+               **kwargs):
+        """Perform a search.
+
+        `query` is either a Query object, or a query string, which will be
+        parsed with `SearchConnection.query_parse()` using the default
+        settings.  The remaining keyword arguments are passed to
+        `SearchConnection.search()`.
+
+        If `process` is None, the result of the future is a copy of the
+        SearchResults which is detached from the connection (see
+        `SearchResults._detach()`): the stored data of each result is read
+        (for the fields asked for), and anything which needs a connection,
+        such as `SearchResult.summarise()`, raises SearchError.  Otherwise,
+        `process` is called in the worker with the SearchResults, and its
+        return value is the result of the future: this can be used, for
+        example, to get suggested facets, or to highlight the results.
+
+        """
+        return self.submit(_search, (query, startrank, endrank, process,
+                                     kwargs), timeout=timeout)
+
+    def get_suggested_facets(self, query, maxfacets=5, required_facets=None,
+                             timeout=None, **kwargs):
+        """Get the suggested facets for the documents matching a query.
+
+        This performs a search with `getfacets` set, and returns a future for
+        the result of `SearchResults.get_suggested_facets()` on it.  The
+        remaining keyword arguments are passed to `SearchConnection.search()`;
+        `checkatleast` should usually be set, so that enough matching
+        documents are examined to find the facet values.
+
+        """
+        def process(results):
+            return results.get_suggested_facets(
+                maxfacets=maxfacets, required_facets=required_facets)
+        kwargs['getfacets'] = True
+        return self.search(query, 0, 0, process=process, timeout=timeout,
+                           **kwargs)
+
+    def get_document(self, docid=None, xapid=None, fields=None, timeout=None):
+        """Get a document, as `SearchConnection.get_document()` does.
+
+        The document is detached from the connection in the worker (see
+        `ProcessedDocument._detach()`), so fields stored out-of-line which
+        weren't asked for with `fields` can't be read from it.
+
+        """
+        return self.submit(_get_document, (docid, xapid, fields),
+                           timeout=timeout)
+
+    def spell_correct(self, querystr, timeout=None, **kwargs):
+        """Correct the spelling of a query string.
+
+        The keyword arguments are passed to
+        `SearchConnection.spell_correct()`.
+
+        """
+        return self.submit(_spell_correct, (querystr, kwargs),
+                           timeout=timeout)
+
+    def close(self):
+        """Close the connection.
+
+        Calls which haven't started are cancelled; this waits for calls which
+        are running to finish.  If the pool was created by this connection, it
+        is closed too.
+
+        """
+        if self._pool is None or self._closed:
+            return
+        self._closed = True
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if item is not None:
+                item[0].cancel()
+        for thread in self._workers:
+            self._queue.put(None)
+        for thread in self._workers:
+            thread.join()
+        self._timeouts.stop()
+        if self._owns_pool:
+            self._pool.close()
+
+def _search(conn, query, startrank, endrank, process, kwargs):
+    if isinstance(query, basestring):
+        query = conn.query_parse(query)
+    results = conn.search(query, startrank, endrank, **kwargs)
+    if process is not None:
+        return process(results)
+    return results._detach()
+
+def _get_document(conn, docid, xapid, fields):
+    doc = conn.get_document(docid=docid, xapid=xapid, fields=fields)
+    doc._detach()
+    return doc
+
+def _spell_correct(conn, querystr, kwargs):
+    return conn.spell_correct(querystr, **kwargs)
@@ -0,0 +1,402 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""bulkbuild.py: Building a complete index in parallel.
+
+The BulkBuilder class builds a new index from scratch.  Documents are divided
+between a number of processes, each of which builds a separate temporary
+database.  When all the documents have been added, the temporary databases
+are merged and compacted into the final index.
+
+This is much faster than adding the documents with a single IndexerConnection
+on a multi-core machine, but the index isn't available until the build is
+finished, and the order of the documents in the final index isn't the order
+in which they were supplied.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import Queue
+import shutil
+import tempfile
+try:
+    import multiprocessing
+except ImportError:
+    # multiprocessing is only in 2.6 onwards
+    multiprocessing = None
+
+import xapian
+
+import errors
+import flushpolicy
+from indexerconnection import IndexerConnection
+from sharding import _picklable_error
+
+def _segment_worker(path, dbtype, config_str, max_mem, documents, results):
+    """The main loop of a process building a temporary database.
+
+    Lists of (document, store_only) pairs are read from the `documents` queue
+    until None is read.  A single (success, result) pair is put on the
+    `results` queue when the database has been closed, giving the number of
+    documents added, or the first error which occurred.
+
+    """
+    count = 0
+    try:
+        conn = IndexerConnection(path, dbtype)
+        try:
+            # Use the configuration from the parent.
+            conn._index.set_metadata('_xappy_config', config_str)
+            conn._load_config()
+            if max_mem is not None:
+                conn.set_flush_policy(flushpolicy.MemoryFlushPolicy(max_mem))
+            while True:
+                chunk = documents.get()
+                if chunk is None:
+                    break
+                for document, store_only in chunk:
+                    conn.add(document, store_only)
+                    count += 1
+        finally:
+            conn.close()
+    except Exception, e:
+        # Keep reading until the end of the input, so the parent doesn't block.
+        while documents.get() is not None:
+            pass
+        results.put((False, _picklable_error(e)))
+        return
+    results.put((True, count))
+
+class BulkBuilder(object):
+    """Build a new index, using several processes.
+
+    The configuration of the index is set up by calling add_field_action(),
+    add_synonym() and similar methods, as for an IndexerConnection, before any
+    documents are added.  Documents are then added with add() or add_many(),
+    and the index is completed by calling finish().
+
+    Any documents with explicitly set IDs must have unique IDs.  Documents
+    without IDs are given IDs in the same way as IndexerConnection.add().
+
+    """
+    _conn = None
+    _procs = None
+    _tmpdir = None
+
+    def __init__(self, path, processes=None, tmpdir=None, dbtype=None,
+                 chunksize=100, max_pending=8, max_mem=None):
+        """Prepare to build an index at `path`.
+
+         - `path` is the path of the index to build.  This must not already
+           exist (or must be an empty directory).
+         - `processes` is the number of processes to build temporary databases
+           with.  If None, the number of CPUs in the system is used.
+         - `tmpdir` is the directory to make the temporary databases in.  By
+           default, this is a directory next to `path`, since the temporary
+           databases need about as much space as the final index.
+         - `dbtype` is the database type to use (see IndexerConnection).
+         - `chunksize` is the number of documents sent to a process at once.
+         - `max_pending` is the maximum number of chunks waiting to be
+           indexed by each process.
+         - `max_mem` if not None, is passed to a MemoryFlushPolicy for each
+           temporary database.
+
+        """
+        if multiprocessing is None:
+            raise errors.IndexerError("Bulk building requires the "
+                                      "multiprocessing module")
+        if not hasattr(xapian, 'Compactor'):
+            raise errors.IndexerError("Bulk building requires a version of "
+                                      "xapian with the Compactor class")
+        if os.path.exists(path) and (not os.path.isdir(path) or
+                                     len(os.listdir(path)) != 0):
+            raise errors.IndexerError("Path %r for bulk build already "
+                                      "exists" % path)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if processes < 1:
+            raise errors.IndexerError("Number of processes must be at least 1")
+        if tmpdir is None:
+            tmpdir = os.path.dirname(os.path.abspath(path))
+
+        self._path = path
+        self._dbtype = dbtype
+        self._processes = processes
+        self._chunksize = chunksize
+        self._max_pending = max_pending
+        self._max_mem = max_mem
+        self._tmpdir = tempfile.mkdtemp(prefix='xappy_bulk', dir=tmpdir)
+        self._conn = IndexerConnection(os.path.join(self._tmpdir, 'config'),
+                                       dbtype)
+        # The IDs of all the documents added, to detect duplicates.
+        self._ids = set()
+        self._procs = None
+        self._queues = None
+        self._results = None
+        self._chunks = None
+        self._next_proc = 0
+        self.doccount = 0
+
+    def __del__(self):
+        self.abort()
+
+    def _check_open(self):
+        if self._conn is None:
+            raise errors.IndexerError("BulkBuilder has been finished")
+
+    def _check_config(self):
+        self._check_open()
+        if self._procs is not None:
+            raise errors.IndexerError("The configuration can't be changed "
+                                      "after documents have been added")
+        return self._conn
+
+    def add_field_action(self, fieldname, fieldtype, **kwargs):
+        """Add an action to be performed on a field.
+
+        See IndexerConnection.add_field_action().
+
+        """
+        self._check_config().add_field_action(fieldname, fieldtype, **kwargs)
+
+    def clear_field_actions(self, fieldname):
+        """Clear all actions for the specified field.
+
+        """
+        self._check_config().clear_field_actions(fieldname)
+
+    def add_synonym(self, original, synonym, field=None,
+                    original_field=None, synonym_field=None):
+        """Add a synonym to the index (see IndexerConnection.add_synonym()).
+
+        """
+        self._check_open()
+        self._conn.add_synonym(original, synonym, field, original_field,
+                               synonym_field)
+
+    def remove_synonym(self, original, synonym, field=None):
+        """Remove a synonym from the index.
+
+        """
+        self._check_open()
+        self._conn.remove_synonym(original, synonym, field)
+
+    def clear_synonyms(self, original, field=None):
+        """Remove all synonyms for a word or phrase.
+
+        """
+        self._check_open()
+        self._conn.clear_synonyms(original, field)
+
+    def add_subfacet(self, subfacet, facet):
+        """Add a subfacet-facet relationship to the facet hierarchy.
+
+        """
+        self._check_config().add_subfacet(subfacet, facet)
+
+    def remove_subfacet(self, subfacet):
+        """Remove any existing facet hierarchy relationship for a subfacet.
+
+        """
+        self._check_config().remove_subfacet(subfacet)
+
+    def set_facet_for_query_type(self, query_type, facet, association):
+        """Set the association between a query type and a facet.
+
+        """
+        self._check_config().set_facet_for_query_type(query_type, facet,
+                                                      association)
+
+    def set_metadata(self, key, value):
+        """Set an item of metadata to store in the index.
+
+        """
+        self._check_open()
+        self._conn.set_metadata(key, value)
+
+    def _start(self):
+        """Start the processes which build the temporary databases.
+
+        """
+        # Store the configuration, so it can be passed to the processes.
+        self._conn.flush()
+        config_str = self._conn._index.get_metadata('_xappy_config')
+
+        self._procs = []
+        self._queues = []
+        self._results = []
+        self._chunks = []
+        for num in xrange(self._processes):
+            queue = multiprocessing.Queue(self._max_pending)
+            results = multiprocessing.Queue()
+            proc = multiprocessing.Process(target=_segment_worker,
+                args=(os.path.join(self._tmpdir, 'seg%d' % num),
+                      self._dbtype, config_str, self._max_mem,
+                      queue, results))
+            proc.daemon = True
+            proc.start()
+            self._procs.append(proc)
+            self._queues.append(queue)
+            self._results.append(results)
+            self._chunks.append([])
+
+    def _put(self, num, item):
+        """Send an item to a process, checking that it's still running.
+
+        """
+        while True:
+            try:
+                self._queues[num].put(item, True, 1)
+                return
+            except Queue.Full:
+                if not self._procs[num].is_alive():
+                    raise errors.IndexerError("Bulk build process %d has "
+                                              "died" % num)
+
+    def add(self, document, store_only=False):
+        """Add a document to the index.
+
+        The document must be an UnprocessedDocument.  Returns the ID of the
+        document.
+
+        """
+        self._check_open()
+        if hasattr(document, '_doc'):
+            raise errors.IndexerError("BulkBuilder only accepts unprocessed "
+                                      "documents")
+        if self._procs is None:
+            self._start()
+
+        id = document.id
+        if id is None:
+            # The allocator only checks the configuration database for IDs
+            # in use, and the documents are never added to that, so skip IDs
+            # which have already been used.
+            id = self._conn._id_allocator.allocate()
+            while id in self._ids:
+                id = self._conn._id_allocator.allocate()
+        else:
+            if id in self._ids:
+                raise errors.DuplicatedIdError("Document ID of document "
+                                               "supplied to add() is not "
+                                               "unique.")
+            self._conn._id_allocator.note_id(id)
+        self._ids.add(id)
+
+        # Send a copy of the document, since it's pickled in the background.
+        document = document.__class__(id, list(document.fields))
+        chunk = self._chunks[self._next_proc]
+        chunk.append((document, store_only))
+        if len(chunk) >= self._chunksize:
+            self._put(self._next_proc, chunk)
+            self._chunks[self._next_proc] = []
+            self._next_proc = (self._next_proc + 1) % self._processes
+        self.doccount += 1
+        return id
+
+    def add_many(self, documents, store_only=False):
+        """Add a sequence of documents to the index.
+
+        Returns a list of the IDs of the documents.
+
+        """
+        return [self.add(document, store_only) for document in documents]
+
+    def finish(self, compaction_level=None):
+        """Finish building the index.
+
+        This waits for all the documents to be indexed, and then merges the
+        temporary databases into the final index, and removes them.
+
+        `compaction_level` may be set to one of the xapian.Compactor
+        constants (eg, xapian.Compactor.FULLER) to control how much the index
+        is compacted.
+
+        Returns the number of documents in the index.
+
+        """
+        self._check_open()
+        try:
+            if self._procs is None:
+                self._start()
+            for num, chunk in enumerate(self._chunks):
+                if chunk:
+                    self._put(num, chunk)
+                self._put(num, None)
+
+            error = None
+            segments = []
+            for num, proc in enumerate(self._procs):
+                while True:
+                    try:
+                        success, result = self._results[num].get(True, 1)
+                        break
+                    except Queue.Empty:
+                        if not proc.is_alive():
+                            success = False
+                            result = errors.IndexerError(
+                                "Bulk build process %d has died" % num)
+                            break
+                proc.join()
+                if not success:
+                    if error is None:
+                        error = result
+                elif result > 0:
+                    segments.append(os.path.join(self._tmpdir, 'seg%d' % num))
+            self._procs = None
+            if error is not None:
+                raise error
+
+            # Store the final configuration and ID allocation state in the
+            # config database, which is the first source for the compaction,
+            # so its metadata takes precedence over that in the segments.
+            configpath = self._conn._indexpath
+            self._conn._config_modified = True
+            self._conn.close()
+            self._conn = None
+
+            compactor = xapian.Compactor()
+            compactor.set_destdir(self._path)
+            if compaction_level is not None:
+                compactor.set_compaction_level(compaction_level)
+            compactor.add_source(configpath)
+            for segment in segments:
+                compactor.add_source(segment)
+            compactor.compact()
+        finally:
+            self.abort()
+        return self.doccount
+
+    def abort(self):
+        """Abandon the build, and remove the temporary databases.
+
+        """
+        if self._procs is not None:
+            for proc in self._procs:
+                if proc.is_alive():
+                    proc.terminate()
+                proc.join()
+            self._procs = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, True)
+            self._tmpdir = None
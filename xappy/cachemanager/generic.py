@@ -284,6 +284,17 @@ class CacheManager(object):
         """
         raise NotImplementedError
 
+    def remove_cached_items_many(self, iconn, docs):
+        """Remove all cache info related to several documents.
+
+        `docs` is an iterable of (doc, xapid) pairs.  By default, this calls
+        remove_cached_items() for each document, but subclasses may override
+        it to remove the hits for each query in a single operation.
+
+        """
+        for doc, xapid in docs:
+            self.remove_cached_items(iconn, doc, xapid)
+
     def replace(self, olddoc, newdoc):
         """If there are cache info stored in the xapian doc, give a chance for
         the cache manager to do something useful with it
@@ -110,17 +110,21 @@ class XapianCacheManager(generic.KeyValueStoreCacheManager):
         self.db = None
         
     def remove_cached_items(self, iconn, doc, xapid):
-        #print "Removing docid=%d" % xapid
-        for value in doc.values():
-            base_slot = cache_manager_slot_start(iconn, self.id)
-            upper_slot = base_slot + self.num_cached_queries()
-            if not (base_slot <= value.num < upper_slot):
-                continue
-            rank = int(CACHE_MANAGER_MAX_HITS -
-                       xapian.sortable_unserialise(value.value))
-            self.remove_hits(
-                value.num - base_slot,
-                ((rank, xapid),))
+        self.remove_cached_items_many(iconn, ((doc, xapid),))
+
+    def remove_cached_items_many(self, iconn, docs):
+        base_slot = cache_manager_slot_start(iconn, self.id)
+        upper_slot = base_slot + self.num_cached_queries()
+        hits = {}
+        for doc, xapid in docs:
+            for value in doc.values():
+                if not (base_slot <= value.num < upper_slot):
+                    continue
+                rank = int(CACHE_MANAGER_MAX_HITS -
+                           xapian.sortable_unserialise(value.value))
+                hits.setdefault(value.num - base_slot, []).append((rank, xapid))
+        for queryid, ranks_and_docids in hits.iteritems():
+            self.remove_hits(queryid, ranks_and_docids)
 
     def replace(self, olddoc, newdoc):
         # Copy any cached query items over to the new document.
@@ -212,26 +216,35 @@ class XapianMultipleCachesManager(object):
             newdoc.add_value(value.num, value.value)
 
     def remove_cached_items(self, iconn, doc, xapid):
+        self.remove_cached_items_many(iconn, ((doc, xapid),))
+
+    def remove_cached_items_many(self, iconn, docs):
         slots_info = self._get_slots_info(iconn)
         if not slots_info:
             return
-        index = 0
-        base_slot, upper_slot, cm = slots_info[index]
-        for value in doc.values():
-            slot_number = value.num
-            if slot_number >= upper_slot:
-                index += 1
+        # Hits to remove, keyed by (index in slots_info, queryid).
+        hits = {}
+        for doc, xapid in docs:
+            index = 0
+            base_slot, upper_slot, cm = slots_info[index]
+            for value in doc.values():
+                slot_number = value.num
+                while slot_number >= upper_slot:
+                    index += 1
+                    if index == len(slots_info):
+                        break
+                    base_slot, upper_slot, cm = slots_info[index]
                 if index == len(slots_info):
-                    return
-                base_slot, upper_slot, cm = slots_info[index]
-                
-            if not (base_slot <= slot_number < upper_slot):
-                continue
-            rank = int(CACHE_MANAGER_MAX_HITS -
-                       xapian.sortable_unserialise(value.value))
-            cm.remove_hits(
-            slot_number - base_slot,
-            ((rank, xapid),))
+                    break
+
+                if not (base_slot <= slot_number < upper_slot):
+                    continue
+                rank = int(CACHE_MANAGER_MAX_HITS -
+                           xapian.sortable_unserialise(value.value))
+                hits.setdefault((index, slot_number - base_slot),
+                                []).append((rank, xapid))
+        for (index, queryid), ranks_and_docids in hits.iteritems():
+            slots_info[index][2].remove_hits(queryid, ranks_and_docids)
 
     def close(self):
         if not self.caches:
@@ -119,6 +119,361 @@ class UnprocessedDocument(object):
             else:
                 self.fields.append(FieldGroup(field))
 
+# Document data is stored in a binary format, which starts with _DATA_MAGIC
+# followed by a version number.  Data which doesn't start with _DATA_MAGIC was
+# stored by older versions of xappy, as a pickle of the whole data.
+#
+# After the version number, the format is:
+#
+#  - the number of fields with stored data.
+#  - for each field, the length of the fieldname, the fieldname, and the
+#    length of the section holding the data for the field.
+#  - the lengths of the sections holding the field associations and the field
+#    groups.
+#  - the sections for each field, in the same order as the fieldnames, then
+#    the field associations section, and the field groups section.
+#
+# All numbers are stored using _pack_uint().  A field section holds either
+# 'S' followed by the number of strings, and each string (preceded by its
+# length), or 'P' followed by a pickle of the list of values, if any of the
+# values aren't strings.  For fields which are stored out-of-line, the section
+# holds 'B', followed by the 20 byte SHA1 hash of the blob holding the field
+# data (which is packed in the same way as a field section), followed by the
+# key of the blob.  The field association and group sections hold
+# pickles, or are empty if there are no associations or groups.
+#
+# This allows a single field to be decoded by reading only the table of
+# sections at the start of the data.
+_DATA_MAGIC = '\x00XD'
+_DATA_VERSION = 1
+
+def _pack_uint(value):
+    """Pack an unsigned integer into a variable length string.
+
+    """
+    result = []
+    while value >= 128:
+        result.append(chr((value & 127) | 128))
+        value >>= 7
+    result.append(chr(value))
+    return ''.join(result)
+
+def _unpack_uint(data, pos):
+    """Unpack an integer packed by _pack_uint(), starting at `pos`.
+
+    Returns the integer, and the position after the packed integer.
+
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        value |= (byte & 127) << shift
+        if byte < 128:
+            return value, pos
+        shift += 7
+
+def _pack_names(data):
+    """Get the fieldnames in a dictionary of data, packed for storage.
+
+    Returns a list of (packed name, fieldname) pairs, or None if any of the
+    fieldnames can't be stored in the binary format.
+
+    """
+    result = []
+    for name in data:
+        if isinstance(name, str):
+            packed = name
+        elif isinstance(name, unicode):
+            try:
+                packed = name.encode('ascii')
+            except UnicodeError:
+                return None
+        else:
+            return None
+        result.append((packed, name))
+    return result
+
+def _pack_field_data(values):
+    """Pack the list of values stored for a field into a section.
+
+    """
+    for value in values:
+        if not isinstance(value, str):
+            return 'P' + cPickle.dumps(values, 2)
+    result = ['S', _pack_uint(len(values))]
+    for value in values:
+        result.append(_pack_uint(len(value)))
+        result.append(value)
+    return ''.join(result)
+
+def _unpack_field_data(data, start, end):
+    """Unpack the list of values in a field section held in data[start:end].
+
+    """
+    if data[start] == 'P':
+        return cPickle.loads(data[start + 1:end])
+    count, pos = _unpack_uint(data, start + 1)
+    values = []
+    for i in xrange(count):
+        size, pos = _unpack_uint(data, pos)
+        values.append(data[pos:pos + size])
+        pos += size
+    return values
+
+def _blob_key(fieldname, id):
+    """Get the key of the blob holding a field of a document out-of-line.
+
+    The document ID is hashed, so that the key stays within Xapian's limit on
+    the length of metadata keys however long the ID is.
+
+    """
+    if isinstance(id, unicode):
+        id = id.encode('utf-8')
+    return '_xappy_blob:%d:%s%s' % (len(fieldname), fieldname,
+                                    hashlib_sha1(id).hexdigest())
+
+def _pack_blob_ref(key, contents):
+    """Make the section for a field stored out-of-line.
+
+    The section holds a hash of the contents of the blob, so that the stored
+    document changes (and ProcessedDocument.calc_hash() changes) when the
+    contents of the field change.
+
+    """
+    return 'B' + hashlib_sha1(contents).digest() + key
+
+def _pack_object(obj):
+    """Pack the field associations or groups into a section.
+
+    """
+    if len(obj) == 0:
+        return ''
+    return cPickle.dumps(obj, 2)
+
+def _pack_data(fields, assocs, groups):
+    """Pack the document data.
+
+    `fields` is a list of (fieldname, section) pairs, and `assocs` and
+    `groups` are sections.
+
+    """
+    result = [_DATA_MAGIC, chr(_DATA_VERSION), _pack_uint(len(fields))]
+    for name, section in fields:
+        result.append(_pack_uint(len(name)))
+        result.append(name)
+        result.append(_pack_uint(len(section)))
+    result.append(_pack_uint(len(assocs)))
+    result.append(_pack_uint(len(groups)))
+    for name, section in fields:
+        result.append(section)
+    result.append(assocs)
+    result.append(groups)
+    return ''.join(result)
+
+class _DataLayout(object):
+    """The layout of the data stored in a xapian document.
+
+    For data in the binary format, only the table of sections is read when
+    this is created, and sections are decoded when they're asked for.  Data in
+    the old pickled format is unpickled immediately.
+
+    """
+    __slots__ = ('raw', 'binary', 'fields', 'assocs', 'groups', 'unpacked',
+                 '_decoded')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.binary = raw.startswith(_DATA_MAGIC)
+        self._decoded = {}
+        if self.binary:
+            self.unpacked = None
+            self._parse()
+        else:
+            self.fields = self.assocs = self.groups = None
+            self.unpacked = self._unpickle(raw)
+
+    def _parse(self):
+        raw = self.raw
+        pos = len(_DATA_MAGIC)
+        version = ord(raw[pos])
+        if version != _DATA_VERSION:
+            raise errors.SearchEngineError("Stored document data has unknown "
+                                           "format version %d" % version)
+        count, pos = _unpack_uint(raw, pos + 1)
+        sizes = []
+        for i in xrange(count):
+            size, pos = _unpack_uint(raw, pos)
+            name = raw[pos:pos + size]
+            size, pos = _unpack_uint(raw, pos + size)
+            sizes.append((name, size))
+        assocs_size, pos = _unpack_uint(raw, pos)
+        groups_size, pos = _unpack_uint(raw, pos)
+
+        # Map from fieldname to the (start, end) span of its section.
+        self.fields = {}
+        for name, size in sizes:
+            self.fields[name] = (pos, pos + size)
+            pos += size
+        self.assocs = (pos, pos + assocs_size)
+        pos += assocs_size
+        self.groups = (pos, pos + groups_size)
+
+    @staticmethod
+    def _unpickle(raw):
+        if raw == '':
+            return ({}, {}, [])
+        unpacked = cPickle.loads(raw)
+        if isinstance(unpacked, dict):
+            # Backwards compatibility
+            return unpacked, {}, []
+        else:
+            # Backwards compatibility
+            if len(unpacked) == 2:
+                return unpacked[0], unpacked[1], []
+            assert len(unpacked) == 3
+            return unpacked
+
+    def get_section(self, span):
+        """Get the raw contents of a section, given its (start, end) span.
+
+        """
+        start, end = span
+        return self.raw[start:end]
+
+    def get_fieldnames(self):
+        if not self.binary:
+            return self.unpacked[0].keys()
+        return self.fields.keys()
+
+    def is_out_of_line(self, fieldname):
+        """Check if a field is stored out-of-line.
+
+        """
+        if not self.binary:
+            return False
+        span = self.fields.get(fieldname)
+        return span is not None and self.raw[span[0]] == 'B'
+
+    def is_visible(self, fieldname, projection):
+        """Check if a field is returned by get_all_data(projection).
+
+        """
+        if projection is None:
+            return not self.is_out_of_line(fieldname)
+        return fieldname in projection
+
+    def get_blob_keys(self):
+        """Get the keys of the blobs holding the fields stored out-of-line.
+
+        """
+        if not self.binary:
+            return []
+        raw = self.raw
+        return [raw[start + 21:end]
+                for start, end in self.fields.itervalues()
+                if raw[start] == 'B']
+
+    def get_field(self, fieldname, get_blob=None):
+        """Get the list of values stored for a field.
+
+        `get_blob` is a function used to read the contents of a blob, for
+        fields stored out-of-line.
+
+        Raises KeyError if there are no values stored for the field.
+
+        """
+        if not self.binary:
+            return self.unpacked[0][fieldname]
+        try:
+            return self._decoded[fieldname]
+        except KeyError:
+            pass
+        start, end = self.fields[fieldname]
+        if self.raw[start] == 'B':
+            if get_blob is None:
+                raise errors.SearchEngineError("Field %r is stored "
+                                               "out-of-line, and no blob "
+                                               "store is available to read "
+                                               "it from" % fieldname)
+            key = self.raw[start + 21:end]
+            blob = get_blob(key)
+            if len(blob) == 0:
+                # A stored blob is never empty, even if the field has no
+                # values, so the blob has been lost.
+                raise errors.SearchEngineError("The blob holding field %r, "
+                                               "which is stored out-of-line, "
+                                               "is missing (key %r)" %
+                                               (fieldname, key))
+            values = _unpack_field_data(blob, 0, len(blob))
+        else:
+            values = _unpack_field_data(self.raw, start, end)
+        self._decoded[fieldname] = values
+        return values
+
+    def get_all_data(self, projection=None, get_blob=None):
+        """Get a dictionary of the values stored for several fields.
+
+        If `projection` is None, all the fields which aren't stored
+        out-of-line are returned.  Otherwise, only the fields in `projection`
+        are returned (including any which are stored out-of-line).
+
+        """
+        if not self.binary:
+            data = self.unpacked[0]
+            if projection is None:
+                return data
+            return dict((name, values) for name, values in data.iteritems()
+                        if name in projection)
+        return dict((name, self.get_field(name, get_blob))
+                    for name in self.fields
+                    if self.is_visible(name, projection))
+
+    def get_field_sections(self, fieldnames=None):
+        """Get a list of (fieldname, section) pairs.
+
+        If `fieldnames` is None, all fields are returned, otherwise only the
+        named fields are returned.
+
+        """
+        if fieldnames is None:
+            fieldnames = self.fields.iterkeys()
+        return [(name, self.get_section(self.fields[name]))
+                for name in fieldnames]
+
+    def get_assocs(self):
+        if not self.binary:
+            return self.unpacked[1]
+        section = self.get_section(self.assocs)
+        if len(section) == 0:
+            return {}
+        return cPickle.loads(section)
+
+    def get_groups(self):
+        if not self.binary:
+            return self.unpacked[2]
+        section = self.get_section(self.groups)
+        if len(section) == 0:
+            return []
+        return cPickle.loads(section)
+
+def _copy_xapian_document(xapdoc):
+    """Copy a xapian document, so that the copy doesn't refer to a database.
+
+    """
+    if hasattr(xapdoc, 'serialise'):
+        return xapian.Document.unserialise(xapdoc.serialise())
+    result = xapian.Document()
+    result.set_data(xapdoc.get_data())
+    for item in xapdoc.termlist():
+        result.add_term(item.term, item.wdf)
+        for pos in item.positer:
+            result.add_posting(item.term, pos, 0)
+    for item in xapdoc.values():
+        result.add_value(item.num, item.value)
+    return result
+
 class ProcessedDocument(object):
     """A processed document, as stored in the index.
 
@@ -132,7 +487,12 @@ class ProcessedDocument(object):
                  '_data',
                  '_assocs',
                  '_groups',
-                 '_grouped_data')
+                 '_grouped_data',
+                 '_layout',
+                 '_projection',
+                 '_blob_loader',
+                 '_blobs',
+                 '_multivalues')
     def __init__(self, fieldmappings, xapdoc=None):
         """Create a ProcessedDocument.
 
@@ -158,6 +518,23 @@ class ProcessedDocument(object):
         # Cache of data, in grouped form.
         self._grouped_data = None
 
+        # Layout of the stored data in _doc, parsed when first needed.
+        self._layout = None
+
+        # Set of fieldnames to return data for (None to return all fields
+        # except those stored out-of-line), and function used to read blobs
+        # holding fields stored out-of-line.
+        self._projection = None
+        self._blob_loader = None
+
+        # Dictionary, keyed by fieldname, of the sections referring to blobs
+        # for fields to store out-of-line.
+        self._blobs = None
+
+        # Dictionary, keyed by slot number, of (combine function, list of
+        # items) for multi-valued slots which haven't been serialised yet.
+        self._multivalues = None
+
     def add_term(self, field, term, wdfinc=1, positions=None):
         """Add a term to the document.
 
@@ -285,6 +662,7 @@ class ProcessedDocument(object):
         the last value added will be stored.
 
         """
+        self._store_multivalues()
         slot = self._fieldmappings.get_slot(field, purpose)
         self._doc.add_value(slot, value)
 
@@ -292,9 +670,41 @@ class ProcessedDocument(object):
         """Get a value from the document.
 
         """
+        self._store_multivalues()
         slot = self._fieldmappings.get_slot(field, purpose)
         return self._doc.get_value(slot)
 
+    def _append_value(self, field, purpose, item, combine):
+        """Append an item to a slot holding a list of items.
+
+        This is intended for internal xappy use.
+
+        The items appended to each slot are kept in a list, and are only
+        serialised when the document is next prepared (or a value is read or
+        set), by calling `combine(value, items)`, where `value` is the
+        existing value in the slot.  This avoids unserialising and
+        reserialising the slot for each item.
+
+        """
+        slot = self._fieldmappings.get_slot(field, purpose)
+        if self._multivalues is None:
+            self._multivalues = {}
+        try:
+            self._multivalues[slot][1].append(item)
+        except KeyError:
+            self._multivalues[slot] = (combine, [item])
+
+    def _store_multivalues(self):
+        """Serialise the items appended to slots by _append_value().
+
+        """
+        if self._multivalues is None:
+            return
+        multivalues = self._multivalues
+        self._multivalues = None
+        for slot, (combine, items) in multivalues.iteritems():
+            self._doc.add_value(slot, combine(self._doc.get_value(slot), items))
+
     def prepare(self):
         """Prepare the document for adding to a xapian database.
 
@@ -302,56 +712,179 @@ class ProcessedDocument(object):
         been made, and then returns it.
 
         """
+        self._store_multivalues()
         if self._data is not None or \
            self._assocs is not None or \
            self._groups is not None:
-            unpacked = list(self._unpack_data())
-            if self._data is not None:
-                unpacked[0] = self._data
-            if self._assocs is not None:
-                unpacked[1] = self._assocs
-            if self._groups is not None:
-                unpacked[2] = self._groups
-            self._doc.set_data(cPickle.dumps(tuple(unpacked), 2))
+            layout = self._get_layout()
+            data, assocs, groups = self._data, self._assocs, self._groups
+
+            # Fields which weren't read (because they're outside the
+            # projection, or are stored out-of-line) are kept unchanged.
+            sections = []
+            if data is not None:
+                hidden = [name for name in layout.get_fieldnames()
+                          if name not in data and
+                          not layout.is_visible(name, self._projection)]
+                if layout.binary:
+                    sections = layout.get_field_sections(hidden)
+                elif hidden:
+                    data = dict(data)
+                    for name in hidden:
+                        data[name] = layout.get_field(name)
+            elif layout.binary:
+                sections = layout.get_field_sections()
+            else:
+                data = layout.get_all_data()
+            if not layout.binary:
+                if assocs is None:
+                    assocs = layout.get_assocs()
+                if groups is None:
+                    groups = layout.get_groups()
+
+            names = None
+            if data is not None:
+                names = _pack_names(data)
+            if data is not None and names is None:
+                # The binary format can only hold fieldnames which are
+                # strings, so fall back to the old format.
+                data = dict(data)
+                for name, section in sections:
+                    data[name] = layout.get_field(name, self._blob_loader)
+                if assocs is None:
+                    assocs = layout.get_assocs()
+                if groups is None:
+                    groups = layout.get_groups()
+                self._doc.set_data(cPickle.dumps((data, assocs, groups), 2))
+            else:
+                if data is not None:
+                    blobs = self._blobs or {}
+                    for packed, name in names:
+                        section = blobs.get(name)
+                        if section is None:
+                            section = _pack_field_data(data[name])
+                        sections.append((packed, section))
+                sections.sort()
+                if assocs is None:
+                    assocs = layout.get_section(layout.assocs)
+                else:
+                    assocs = _pack_object(assocs)
+                if groups is None:
+                    groups = layout.get_section(layout.groups)
+                else:
+                    groups = _pack_object(groups)
+                self._doc.set_data(_pack_data(sections, assocs, groups))
+            self._layout = None
             self._data = None
             self._assocs = None
             self._groups = None
             self._grouped_data = None
+            self._blobs = None
         return self._doc
 
-    def _unpack_data(self):
-        rawdata = self._doc.get_data()
-        if rawdata == '':
-            return ({}, {}, [])
-        unpacked = cPickle.loads(rawdata)
-        if isinstance(unpacked, dict):
-            # Backwards compatibility
-            return unpacked, {}, []
-        else:
-            # Backwards compatibility
-            if len(unpacked) == 2:
-                return unpacked[0], unpacked[1], []
-            assert len(unpacked) == 3
-            return unpacked
+    def _take_blobs(self, fields, id):
+        """Prepare to store the data for some fields out-of-line.
 
-    def _set_from_unpacked_data(self):
-        if self._data is not None and \
-           self._assocs is not None and \
-           self._groups is not None:
-            return
+        This is intended for internal xappy use.
+
+        When the document is next prepared, the data for each field in
+        `fields` which has been set will be replaced by a reference to a blob,
+        keyed by the field name and the document ID `id`.  Returns a
+        dictionary from blob key to blob contents, which must be stored by the
+        caller.
 
-        data, assocs, groups = self._unpack_data()
+        """
         if self._data is None:
-            self._data = data
-            self._grouped_data = None
-        if self._assocs is None:
-            self._assocs = assocs
-        if self._groups is None:
-            self._groups = groups
-            self._grouped_data = None
+            # Check if the fields are stored in-line in the existing data (eg,
+            # if the document was processed in another process).
+            layout = self._get_layout()
+            for name in layout.get_fieldnames():
+                if name in fields and not layout.is_out_of_line(name):
+                    break
+            else:
+                return {}
+        data = self.data
+        result = {}
+        self._blobs = {}
+        for name in fields:
+            values = data.get(name)
+            if values is None:
+                continue
+            contents = _pack_field_data(values)
+            key = _blob_key(name, id)
+            result[key] = contents
+            self._blobs[name] = _pack_blob_ref(key, contents)
+        return result
+
+    def _remove_fields(self, fieldnames):
+        """Remove the stored data, associations and groupings for some fields.
+
+        This is intended for internal xappy use.  The terms and values for
+        the fields are not changed.
+
+        """
+        layout = self._get_layout()
+        data = self.data
+        assocs = self._get_assocs()
+        groups = self._get_groups()
+
+        # Make the removed fields part of the projection, so that prepare()
+        # doesn't keep them if they weren't read.
+        self._projection = frozenset(
+            [name for name in layout.get_fieldnames()
+             if layout.is_visible(name, self._projection)] +
+            list(fieldnames))
+
+        for fieldname in fieldnames:
+            data.pop(fieldname, None)
+            assocs.pop(fieldname, None)
+        newgroups = []
+        for group in groups:
+            group = tuple(item for item in group if item[0] not in fieldnames)
+            if len(group) != 0:
+                newgroups.append(group)
+        self._groups = newgroups
+        self._grouped_data = None
+
+    def _get_blob_keys(self):
+        """Get the keys of the blobs holding fields stored out-of-line.
+
+        This is intended for internal xappy use.
+
+        """
+        return self._get_layout().get_blob_keys()
+
+    def _set_projection(self, fields, get_blob=None):
+        """Set the fields to read, and how to read fields stored out-of-line.
+
+        This is intended for internal xappy use.
+
+        If `fields` is not None, it is a sequence of fieldnames, and only the
+        data for these fields will be returned by the `data` property.
+        `get_blob` is a function to read the contents of a blob, given its
+        key.
+
+        """
+        if fields is not None:
+            if isinstance(fields, basestring):
+                fields = (fields,)
+            fields = frozenset(fields)
+        self._projection = fields
+        self._blob_loader = get_blob
+
+    def _get_layout(self):
+        """Get the layout of the stored data in the xapian document.
+
+        """
+        if self._layout is None:
+            self._layout = _DataLayout(self._doc.get_data())
+        return self._layout
 
     def _get_data(self):
-        self._set_from_unpacked_data()
+        if self._data is None:
+            self._data = self._get_layout().get_all_data(self._projection,
+                                                         self._blob_loader)
+            self._grouped_data = None
         return self._data
     def _set_data(self, data):
         if not isinstance(data, dict):
@@ -363,8 +896,35 @@ class ProcessedDocument(object):
     This data is a dictionary of entries, where the key is a fieldname, and the
     value is a list of strings.
 
+    If the document was read with a list of fields to return (eg, using the
+    `fields` parameter of SearchConnection.search()), only those fields are
+    included.  Otherwise, fields which are stored out-of-line (see the
+    `out_of_line` parameter of the STORE_CONTENT action) are not included.
+    Fields which aren't included are kept unchanged if the document is
+    written back to the index.
+
     """)
 
+    def get_data(self, field):
+        """Get the data stored in this document for a single field.
+
+        Returns a list of strings.  Raises KeyError if no data is stored for
+        the field.
+
+        Unlike accessing the `data` property, this only decodes the data for
+        the requested field, so is cheaper when only a few fields are needed.
+        It can also be used to read fields which aren't included in `data`
+        (ie, fields stored out-of-line, or outside the list of fields the
+        document was read with).
+
+        """
+        layout = self._get_layout()
+        if self._data is not None and (field in self._data or
+                                       layout.is_visible(field,
+                                                         self._projection)):
+            return self._data[field]
+        return layout.get_field(field, self._blob_loader)
+
     def _calc_group_lookup(self):
         """Calculate a lookup for the group data, if not already done.
 
@@ -454,13 +1014,68 @@ class ProcessedDocument(object):
             sha1.update("\0".join("%d\0%s" % (v.num, v.value) for v in self._doc.values()))
         return sha1.hexdigest()
 
+    def _detach(self):
+        """Make this document independent of the database it was read from.
+
+        This is intended for internal xappy use.  The stored data is read (for
+        the fields being returned), and the xapian document is copied, so that
+        the document can still be used once the connection it was read with
+        has been closed, or is being used by another thread.  Fields stored
+        out-of-line which weren't read can't be read afterwards.
+
+        """
+        self._get_data()
+        self._doc = _copy_xapian_document(self._doc)
+        self._blob_loader = None
+
+    def _get_transport_state(self):
+        """Get a picklable representation of this document.
+
+        This is intended for internal xappy use, to pass processed documents
+        between processes.  The document can be recreated by passing the
+        result to `_from_transport_state()`.
+
+        """
+        xapdoc = self.prepare()
+        if hasattr(xapdoc, 'serialise'):
+            return (True, xapdoc.serialise())
+        terms = []
+        for item in xapdoc.termlist():
+            positions = [pos for pos in item.positer]
+            terms.append((item.term, item.wdf, positions))
+        values = [(item.num, item.value) for item in xapdoc.values()]
+        return (False, (xapdoc.get_data(), terms, values))
+
+    @staticmethod
+    def _from_transport_state(fieldmappings, state):
+        """Make a ProcessedDocument from the result of `_get_transport_state()`.
+
+        This is intended for internal xappy use.
+
+        """
+        serialised, state = state
+        if serialised:
+            return ProcessedDocument(fieldmappings,
+                                     xapian.Document.unserialise(state))
+        data, terms, values = state
+        xapdoc = xapian.Document()
+        xapdoc.set_data(data)
+        for term, wdf, positions in terms:
+            xapdoc.add_term(term, wdf)
+            for pos in positions:
+                xapdoc.add_posting(term, pos, 0)
+        for slot, value in values:
+            xapdoc.add_value(slot, value)
+        return ProcessedDocument(fieldmappings, xapdoc)
+
     def _get_assocs(self):
         """Get the field associations for this document.
         
         This is intended for internal xappy use.
 
         """
-        self._set_from_unpacked_data()
+        if self._assocs is None:
+            self._assocs = self._get_layout().get_assocs()
         return self._assocs
 
 #    def _set_assocs(self, assocs):
@@ -484,7 +1099,9 @@ class ProcessedDocument(object):
         This is intended for internal xappy use.
 
         """
-        self._set_from_unpacked_data()
+        if self._groups is None:
+            self._groups = self._get_layout().get_groups()
+            self._grouped_data = None
         return self._groups
 
     def get_distance(self, field, location):
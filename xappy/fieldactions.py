@@ -34,8 +34,10 @@ try:
 except ImportError:
     pass
 import parsedate
+import profiling
 
-def _act_store_content(fieldname, doc, field, context, link_associations=True):
+def _act_store_content(fieldname, doc, field, context, link_associations=True,
+                       out_of_line=False):
     """Perform the STORE_CONTENT action.
 
     If link_associations is True, and the field has an associated value, store
@@ -44,6 +46,9 @@ def _act_store_content(fieldname, doc, field, context, link_associations=True):
     based on the terms which are indexed, rather than on the associated value
     which is stored.
 
+    `out_of_line` is handled by the IndexerConnection when the document is
+    written, so isn't used here.
+
     """
     try:
         fielddata = doc.data[fieldname]
@@ -133,29 +138,47 @@ def _act_facet(fieldname, doc, field, context, type=None, ranges=None, _range_ac
 
     """
     if type is None or type == 'string':
-        value = field.value.lower()
-        # FIXME - why is the term lowercased here?  This generates different
-        # terms from INDEX_EXACT, which is probably a bug.  It needs to be
-        # lowercase to match the value stored in the value slot, though.
-        doc.add_term(fieldname, value, 0)
-        if context.currfield_assoc is not None:
-            add_field_assoc(doc, fieldname, context.currfield_assoc,
-                            term=value, weight=field.weight)
-        serialiser = xapian.StringListSerialiser(
-            doc.get_value(fieldname, 'facet'))
-        serialiser.append(value)
-        doc.add_value(fieldname, serialiser.get(), 'facet')
+        _facet_string(fieldname, doc, field, context)
     else:
-        marshaller = SortableMarshaller()
-        fn = marshaller.get_marshall_function(fieldname, type)
-        marshalled_value = fn(fieldname, field.value)
-        doc.add_value(fieldname, marshalled_value, 'facet')
-        if context.currfield_assoc is not None:
-            add_field_assoc(doc, fieldname, context.currfield_assoc,
-                            value=(marshalled_value, 'facet'),
-                            weight=field.weight)
-        _range_accel_act(doc, field.value, ranges, _range_accel_prefix)
+        fn = SortableMarshaller().get_marshall_function(fieldname, type)
+        _facet_marshalled(fn, fieldname, doc, field, context, ranges,
+                          _range_accel_prefix)
+
+def _facet_string(fieldname, doc, field, context):
+    """Perform the FACET action for a field of type 'string'.
+
+    """
+    value = field.value.lower()
+    # FIXME - why is the term lowercased here?  This generates different
+    # terms from INDEX_EXACT, which is probably a bug.  It needs to be
+    # lowercase to match the value stored in the value slot, though.
+    doc.add_term(fieldname, value, 0)
+    if context.currfield_assoc is not None:
+        add_field_assoc(doc, fieldname, context.currfield_assoc,
+                        term=value, weight=field.weight)
+    doc._append_value(fieldname, 'facet', value, _combine_string_list)
 
+def _combine_string_list(value, items):
+    """Add a list of strings to a slot value holding a list of strings.
+
+    """
+    serialiser = xapian.StringListSerialiser(value)
+    for item in items:
+        serialiser.append(item)
+    return serialiser.get()
+
+def _facet_marshalled(fn, fieldname, doc, field, context, ranges,
+                      _range_accel_prefix):
+    """Perform the FACET action, using the marshall function `fn`.
+
+    """
+    marshalled_value = fn(fieldname, field.value)
+    doc.add_value(fieldname, marshalled_value, 'facet')
+    if context.currfield_assoc is not None:
+        add_field_assoc(doc, fieldname, context.currfield_assoc,
+                        value=(marshalled_value, 'facet'),
+                        weight=field.weight)
+    _range_accel_act(doc, field.value, ranges, _range_accel_prefix)
 
 def _act_weight(fieldname, doc, field, context, type=None):
     """Perform the WEIGHT action.
@@ -170,11 +193,17 @@ def _act_geolocation(fieldname, doc, field, context):
 
     """
     if field.value != '':
-        # FIXME - this is O(N*N) in the number of entries in the field.
-        coords = xapian.LatLongCoords.unserialise(doc.get_value(fieldname, 'loc'))
         coord = xapian.LatLongCoord.parse_latlong(field.value)
+        doc._append_value(fieldname, 'loc', coord, _combine_latlong)
+
+def _combine_latlong(value, items):
+    """Add a list of coordinates to a slot value holding coordinates.
+
+    """
+    coords = xapian.LatLongCoords.unserialise(value)
+    for coord in items:
         coords.insert(coord)
-        doc.add_value(fieldname, coords.serialise(), 'loc')
+    return coords.serialise()
 
 def _get_imgterms(conn, fieldname):
     """Get an ImgTerms object for a given field.
@@ -203,85 +232,148 @@ def _act_imgseek(fieldname, doc, field, context, terms=True, buckets=None):
 
     """
     if field.value:
-        import xapian.imgseek
-        imgsig = xapian.imgseek.ImgSig.register_Image(field.value)
+        imgsigs = getattr(context.conn, '_imgsigs', None)
+        if imgsigs is None:
+            import xapian.imgseek
+            imgsig = xapian.imgseek.ImgSig.register_Image(field.value)
+        else:
+            # An imgsigs.ImgSigCache or ImgSigPrefetcher.
+            imgsig = imgsigs.get_signature(field.value)
         if terms:
             imgterms = _get_imgterms(context.conn, fieldname)
             imgterms.AddTerms(doc._doc, imgsig)
         else:
-            imgsigs = xapian.imgseek.ImgSigs.unserialise(
-                doc.get_value(fieldname, 'imgseek'))
-            imgsigs.insert(imgsig)
-            doc.add_value(fieldname, imgsigs.serialise(), 'imgseek')
-
-def _act_index_freetext(fieldname, doc, field, context, weight=1,
-                        language=None, stop=None, spell=False,
-                        nopos=False,
-                        allow_field_specific=True,
-                        search_by_default=True):
-    """Perform the INDEX_FREETEXT action.
+            doc._append_value(fieldname, 'imgseek', imgsig, _combine_imgsigs)
+
+def _combine_imgsigs(value, items):
+    """Add a list of image signatures to a slot value holding signatures.
 
     """
-    termgen = xapian.TermGenerator()
-    if language is not None:
-        termgen.set_stemmer(xapian.Stem(language))
+    imgsigs = xapian.imgseek.ImgSigs.unserialise(value)
+    for imgsig in items:
+        imgsigs.insert(imgsig)
+    return imgsigs.serialise()
 
-    if stop is not None:
-        stopper = xapian.SimpleStopper()
-        for term in stop:
-            stopper.add(term)
-        termgen.set_stopper(stopper)
+class _FreetextIndexer(object):
+    """Implementation of the INDEX_FREETEXT action.
 
-    if spell and not context.readonly:
-        termgen.set_database(context.index)
-        termgen.set_flags(termgen.FLAG_SPELLING)
+    The term generator, stemmer and stopper are created once, when the object
+    is created, and reused for each field which is indexed.
 
-    if context.currfield_assoc is not None:
-        # We'll populate a document with the terms generated, so we can then
-        # store them as assocations.
-        tmpdoc = xapian.Document()
-    else:
-        tmpdoc = None
+    """
+    def __init__(self, fieldname, weight=1, language=None, stop=None,
+                 spell=False, nopos=False, allow_field_specific=True,
+                 search_by_default=True):
+        self.fieldname = fieldname
+        self.weight = weight
+        self.spell = spell
+        self.nopos = nopos
+        self.allow_field_specific = allow_field_specific
+        self.search_by_default = search_by_default
+
+        # The stemmer and stopper must be kept referenced for as long as the
+        # term generator which uses them.
+        self.termgen = xapian.TermGenerator()
+        self.stemmer = None
+        if language is not None:
+            self.stemmer = xapian.Stem(language)
+            self.termgen.set_stemmer(self.stemmer)
+
+        self.stopper = None
+        if stop is not None:
+            self.stopper = xapian.SimpleStopper()
+            for term in stop:
+                self.stopper.add(term)
+            self.termgen.set_stopper(self.stopper)
+
+        self.spellgen = None
+
+    def _collect_spellings(self, field, context):
+        """Collect the words to add to the spelling table for a field.
 
-    if search_by_default:
-        termgen.set_document(doc._doc)
-        termgen.set_termpos(context.current_position)
-        # Store a copy of the field without a prefix, for non-field-specific
-        # searches.
-        if nopos:
-            termgen.index_text_without_positions(field.value, weight, '')
+        """
+        if self.spellgen is None:
+            self.spellgen = xapian.TermGenerator()
+            if self.stopper is not None:
+                self.spellgen.set_stopper(self.stopper)
+        spelldoc = xapian.Document()
+        self.spellgen.set_document(spelldoc)
+        self.spellgen.index_text_without_positions(field.value)
+        for item in spelldoc.termlist():
+            context.spellings.append((item.term, item.wdf))
+
+    def __call__(self, doc, field, context):
+        termgen = self.termgen
+        weight = self.weight
+        spell = self.spell and not context.defer_spelling
+
+        if spell and not context.readonly:
+            termgen.set_database(context.index)
+            termgen.set_flags(termgen.FLAG_SPELLING)
         else:
-            termgen.index_text(field.value, weight, '')
+            termgen.set_flags(0)
+            if spell and context.spellings is not None:
+                # The spelling data can't be written here (probably because
+                # we're processing in a separate process to the one holding
+                # the database), so collect the words which the term generator
+                # would have added, so that they can be added to the database
+                # later.
+                self._collect_spellings(field, context)
 
-        if tmpdoc is not None:
-            termgen.set_document(tmpdoc)
-            termgen.index_text_without_positions(field.value, weight, '')
+        if context.currfield_assoc is not None:
+            # We'll populate a document with the terms generated, so we can
+            # then store them as assocations.
+            tmpdoc = xapian.Document()
+        else:
+            tmpdoc = None
 
-    if allow_field_specific:
-        # Store a second copy of the term with a prefix, for field-specific
-        # searches.
-        prefix = doc._fieldmappings.get_prefix(fieldname)
-        if len(prefix) != 0:
+        if self.search_by_default:
             termgen.set_document(doc._doc)
             termgen.set_termpos(context.current_position)
-            if nopos:
-                termgen.index_text_without_positions(field.value, weight, prefix)
+            # Store a copy of the field without a prefix, for non-field-specific
+            # searches.
+            if self.nopos:
+                termgen.index_text_without_positions(field.value, weight, '')
             else:
-                termgen.index_text(field.value, weight, prefix)
+                termgen.index_text(field.value, weight, '')
 
             if tmpdoc is not None:
                 termgen.set_document(tmpdoc)
-                termgen.index_text_without_positions(field.value, weight, prefix)
+                termgen.index_text_without_positions(field.value, weight, '')
+
+        if self.allow_field_specific:
+            # Store a second copy of the term with a prefix, for field-specific
+            # searches.
+            prefix = doc._fieldmappings.get_prefix(self.fieldname)
+            if len(prefix) != 0:
+                termgen.set_document(doc._doc)
+                termgen.set_termpos(context.current_position)
+                if self.nopos:
+                    termgen.index_text_without_positions(field.value, weight,
+                                                         prefix)
+                else:
+                    termgen.index_text(field.value, weight, prefix)
 
-    if context.currfield_assoc is not None:
-        for item in tmpdoc.termlist():
-            add_field_assoc(doc, fieldname, context.currfield_assoc,
-                            rawterm=item.term, weight=field.weight)
+                if tmpdoc is not None:
+                    termgen.set_document(tmpdoc)
+                    termgen.index_text_without_positions(field.value, weight,
+                                                         prefix)
+
+        if context.currfield_assoc is not None:
+            for item in tmpdoc.termlist():
+                add_field_assoc(doc, self.fieldname, context.currfield_assoc,
+                                rawterm=item.term, weight=field.weight)
 
-    # Add a gap between each field instance, so that phrase searches don't
-    # match across instances.
-    termgen.increase_termpos(10)
-    context.current_position = termgen.get_termpos()
+        # Add a gap between each field instance, so that phrase searches don't
+        # match across instances.
+        termgen.increase_termpos(10)
+        context.current_position = termgen.get_termpos()
+
+def _act_index_freetext(fieldname, doc, field, context, **kwargs):
+    """Perform the INDEX_FREETEXT action.
+
+    """
+    _FreetextIndexer(fieldname, **kwargs)(doc, field, context)
 
 class SortableMarshaller(object):
     """Implementation of marshalling for sortable values.
@@ -347,8 +439,15 @@ def _act_sort_and_collapse(fieldname, doc, field, context, type=None, ranges=Non
     """Perform the SORTABLE action.
 
     """
-    marshaller = SortableMarshaller()
-    fn = marshaller.get_marshall_function(fieldname, type)
+    fn = SortableMarshaller().get_marshall_function(fieldname, type)
+    _sort_and_collapse(fn, fieldname, doc, field, context, ranges,
+                       _range_accel_prefix)
+
+def _sort_and_collapse(fn, fieldname, doc, field, context, ranges,
+                       _range_accel_prefix):
+    """Perform the SORTABLE action, using the marshall function `fn`.
+
+    """
     marshalled_value = fn(fieldname, field.value)
     if context.currfield_assoc is not None:
         add_field_assoc(doc, fieldname, context.currfield_assoc,
@@ -370,17 +469,31 @@ class ActionContext(object):
     `index` is the index which documents are being added to.
     `readonly` is True if the index is read-only (used by the
     SearchConnection.process() method).
+    `spellings` is None, or a list to which (word, frequency) pairs will be
+    appended for fields which should be used for spelling correction, but for
+    which the spelling data can't be written directly to the index (because it
+    is read-only).
+    `defer_spelling` is True if no spelling data should be generated, because
+    it will be built later (see IndexerConnection.set_deferred_spelling()).
 
     """
-    def __init__(self, conn, readonly=False):
+    def __init__(self, conn, readonly=False, spellings=None,
+                 defer_spelling=False):
         self.conn = conn
-        self.index = conn._index
         self.readonly = readonly
+        self.spellings = spellings
+        self.defer_spelling = defer_spelling
         self.current_language = None
         self.current_position = 0
         self.currfield_assoc = None
         self.currfield_group = None
 
+    @property
+    def index(self):
+        # Only read when needed, since an IndexerConnection may have to wait
+        # for a background commit to finish before returning its database.
+        return self.conn._index
+
 class FieldActions(object):
     """An object describing the actions to be performed on a field.
 
@@ -388,7 +501,16 @@ class FieldActions(object):
 
     - `STORE_CONTENT`: store the unprocessed content of the field in the search
       engine database.  All fields which need to be displayed or used when
-      displaying the search results need to be given this action.
+      displaying the search results need to be given this action.  One
+      optional parameter may be supplied:
+
+      - 'out_of_line' is a boolean flag - if True, the content is stored in a
+        separate blob (in the index metadata), rather than with the rest of
+        the stored content of the document.  It is then only read when asked
+        for explicitly (with ProcessedDocument.get_data(), or by including the
+        field in the `fields` parameter of SearchConnection.search() or
+        get_document()), so this is useful for large fields which are rarely
+        displayed.  Defaults to False.
 
     - `INDEX_EXACT`: index the exact content of the field as a single search
       term.  Fields whose contents need to be searchable as an "exact match"
@@ -507,11 +629,22 @@ class FieldActions(object):
     if 'imgseek' in _checkxapian.missing_features:
         _unsupported_actions.append(IMGSEEK)
 
+    # The compiled form of the actions, used by perform().  This is a class
+    # attribute so that FieldActions objects unpickled from old configurations
+    # have it.
+    _compiled = None
+
     def __init__(self, fieldname):
         # Dictionary of actions, keyed by type.
         self._actions = {}
         self._fieldname = fieldname
 
+    def __getstate__(self):
+        # The compiled actions hold closures, which can't be pickled.
+        state = self.__dict__.copy()
+        state.pop('_compiled', None)
+        return state
+
     def add(self, field_mappings, action, **kwargs):
         """Add an action to perform on a field.
 
@@ -647,6 +780,7 @@ class FieldActions(object):
 
         # Append the action to the list of actions
         self._actions[action].append(kwargs)
+        self._compiled = None
 
     def perform(self, doc, field, context, store_only=False):
         """Perform the actions on the field.
@@ -658,30 +792,44 @@ class FieldActions(object):
            Otherwise, all actions will be performed.
 
         """
-        context.currfield_assoc = None
-        # First, store the content, if we're going to, so it can be referred to
-        # in the "associations" table.
-        for actiontype, actionlist in self._actions.iteritems():
-            if actiontype != FieldActions.STORE_CONTENT:
-                continue
-            info = self._action_info[actiontype]
-            for kwargs in actionlist:
-                info[2](self._fieldname, doc, field, context, **kwargs)
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self._compiled = _CompiledFieldActions(self)
+        compiled.perform(doc, field, context, store_only)
 
-        if store_only:
-            return
+    def _get_term_prefixes(self, field_mappings):
+        """Get the prefixes of all the terms generated by the actions.
 
-        # Then do all the other actions.
-        for actiontype, actionlist in self._actions.iteritems():
-            if actiontype == FieldActions.STORE_CONTENT:
-                continue
-            info = self._action_info[actiontype]
-            for kwargs in actionlist:
-                info[2](self._fieldname, doc, field, context, **kwargs)
+        Returns None if some of the terms generated can't be told apart from
+        terms generated for other fields (eg, unprefixed free text terms), in
+        which case the field can't be reindexed without reprocessing the
+        whole document.
+
+        """
+        prefixes = []
+        for action, kwargslist in self._actions.iteritems():
+            for kwargs in kwargslist:
+                if action == FieldActions.INDEX_FREETEXT:
+                    if kwargs.get('search_by_default', True):
+                        return None
+                elif action == FieldActions.IMGSEEK:
+                    if kwargs.get('terms', True):
+                        return None
+                accel_prefix = kwargs.get('_range_accel_prefix')
+                if accel_prefix is not None:
+                    prefixes.append(accel_prefix)
+        try:
+            prefix = field_mappings.get_prefix(self._fieldname)
+        except KeyError:
+            pass
+        else:
+            # Stemmed free text terms have a 'Z' before the prefix.
+            prefixes.extend((prefix, 'Z' + prefix))
+        return prefixes
 
     _action_info = {
         COLOUR: ('COLOUR', ('step_count',), _act_colour, {'prefix': True}, ),
-        STORE_CONTENT: ('STORE_CONTENT', ('link_associations', ), _act_store_content, {}, ),
+        STORE_CONTENT: ('STORE_CONTENT', ('link_associations', 'out_of_line', ), _act_store_content, {}, ),
         INDEX_EXACT: ('INDEX_EXACT', (), _act_index_exact, {'prefix': True}, ),
         INDEX_FREETEXT: ('INDEX_FREETEXT', ('weight', 'language', 'stop', 'spell', 'nopos', 'allow_field_specific', 'search_by_default', ),
             _act_index_freetext, {'prefix': True, }, ),
@@ -694,6 +842,94 @@ class FieldActions(object):
         SORT_AND_COLLAPSE: ('SORT_AND_COLLAPSE', ('type', ), _act_sort_and_collapse, {'slot': 'collsort',}, ),
     }
 
+class _CompiledFieldActions(object):
+    """The actions for a field, prepared for repeated use.
+
+    Each action is turned into a callable taking (doc, field, context), with
+    any objects which don't depend on the field contents (term generators,
+    stemmers, stoppers, marshall functions) created once, here, rather than
+    for each field which is processed.
+
+    If `profile` is an IndexingProfile, each action records the time it
+    takes in the profile.
+
+    """
+    def __init__(self, fieldactions, profile=None):
+        fieldname = fieldactions._fieldname
+        self.store = []
+        self.others = []
+        for actiontype, actionlist in fieldactions._actions.iteritems():
+            for kwargs in actionlist:
+                fn = self._compile_action(fieldname, actiontype, kwargs)
+                if profile is not None:
+                    fn = profiling.profile_action(profile, fieldname,
+                        FieldActions._action_info[actiontype][0], fn)
+                if actiontype == FieldActions.STORE_CONTENT:
+                    self.store.append(fn)
+                else:
+                    self.others.append(fn)
+
+    @staticmethod
+    def _compile_action(fieldname, actiontype, kwargs):
+        """Make a callable which performs a single action.
+
+        """
+        if actiontype == FieldActions.INDEX_FREETEXT:
+            return _FreetextIndexer(fieldname, **kwargs)
+
+        if actiontype == FieldActions.SORT_AND_COLLAPSE:
+            fn = SortableMarshaller().get_marshall_function(
+                fieldname, kwargs.get('type'))
+            ranges = kwargs.get('ranges')
+            accel_prefix = kwargs.get('_range_accel_prefix')
+            def sort_and_collapse(doc, field, context):
+                _sort_and_collapse(fn, fieldname, doc, field, context,
+                                   ranges, accel_prefix)
+            return sort_and_collapse
+
+        if actiontype == FieldActions.FACET:
+            facettype = kwargs.get('type')
+            if facettype is None or facettype == 'string':
+                def facet(doc, field, context):
+                    _facet_string(fieldname, doc, field, context)
+                return facet
+            fn = SortableMarshaller().get_marshall_function(fieldname,
+                                                            facettype)
+            ranges = kwargs.get('ranges')
+            accel_prefix = kwargs.get('_range_accel_prefix')
+            def facet(doc, field, context):
+                _facet_marshalled(fn, fieldname, doc, field, context,
+                                  ranges, accel_prefix)
+            return facet
+
+        actfn = FieldActions._action_info[actiontype][2]
+        if len(kwargs) == 0:
+            def action(doc, field, context):
+                actfn(fieldname, doc, field, context)
+        else:
+            def action(doc, field, context):
+                actfn(fieldname, doc, field, context, **kwargs)
+        return action
+
+    def perform(self, doc, field, context, store_only=False):
+        """Perform the actions on the field.
+
+        See FieldActions.perform() for the meaning of the parameters.
+
+        """
+        context.currfield_assoc = None
+        # First, store the content, if we're going to, so it can be referred to
+        # in the "associations" table.
+        for fn in self.store:
+            fn(doc, field, context)
+
+        if store_only:
+            return
+
+        # Then do all the other actions.
+        for fn in self.others:
+            fn(doc, field, context)
+
 class ActionSet(object):
     """A set of actions, to be performed on various fields.
 
@@ -702,29 +938,114 @@ class ActionSet(object):
 
     """
     def __init__(self):
-        self.actions = {}
+        self._actions = {}
+        self._compiled = {}
+        self._colour_fields = None
+        self._out_of_line_fields = None
+        self._profile = None
+
+    def _get_actions(self):
+        return self._actions
+    def _set_actions(self, actions):
+        self._actions = actions
+        self.invalidate()
+    actions = property(_get_actions, _set_actions, doc=
+        """The dictionary of FieldActions objects, keyed by field name.
+
+        """)
 
     def __getitem__(self, key):
-        return self.actions[key]
+        return self._actions[key]
 
     def __setitem__(self, key, value):
-        self.actions[key] = value
+        self._actions[key] = value
+        self.invalidate(key)
 
     def __delitem__(self, key):
-        del self.actions[key]
+        del self._actions[key]
+        self.invalidate(key)
 
     def __contains__(self, key):
-        return key in self.actions
+        return key in self._actions
 
     def __iter__(self):
-        return iter(self.actions)
+        return iter(self._actions)
+
+    def keys(self):
+        return self._actions.keys()
+
+    def invalidate(self, fieldname=None):
+        """Discard the compiled form of the actions.
+
+        This must be called whenever the FieldActions object for a field is
+        modified.  If `fieldname` is None, the compiled actions for all fields
+        are discarded.
+
+        """
+        if fieldname is None:
+            self._compiled = {}
+        else:
+            self._compiled.pop(fieldname, None)
+        self._colour_fields = None
+        self._out_of_line_fields = None
 
+    def _set_profile(self, profile):
+        """Set the IndexingProfile to record the time taken by actions in.
+
+        If `profile` is None, the time taken isn't recorded.
+
+        """
+        self._profile = profile
+        self.invalidate()
+
+    def _get_compiled(self, fieldname):
+        """Get the compiled actions for a field.
+
+        Returns None if there are no actions for the field.
+
+        """
+        try:
+            return self._compiled[fieldname]
+        except KeyError:
+            pass
+        try:
+            actions = self._actions[fieldname]
+        except KeyError:
+            return None
+        compiled = _CompiledFieldActions(actions, self._profile)
+        self._compiled[fieldname] = compiled
+        return compiled
+
+    def _get_colour_fields(self):
+        """Get the set of names of fields which have the COLOUR action.
+
+        """
+        if self._colour_fields is None:
+            self._colour_fields = frozenset(
+                fieldname for fieldname, actions in self._actions.iteritems()
+                if FieldActions.COLOUR in actions._actions)
+        return self._colour_fields
+
+    def _get_out_of_line_fields(self):
+        """Get the set of names of fields which are stored out-of-line.
+
+        """
+        if self._out_of_line_fields is None:
+            fields = []
+            for fieldname, actions in self._actions.iteritems():
+                for kwargs in actions._actions.get(FieldActions.STORE_CONTENT,
+                                                   ()):
+                    if kwargs.get('out_of_line'):
+                        fields.append(fieldname)
+            self._out_of_line_fields = frozenset(fields)
+        return self._out_of_line_fields
 
     def normalise_colour_frequencies(self, fields_or_groups):
         """Modify all the weights specified for a field with the
         COLOUR action so that they sum to 1000.
 
         """
+        colour_fields = self._get_colour_fields()
         colour_vals = {}
         
         def get_fields(field_or_group):
@@ -737,11 +1058,7 @@ class ActionSet(object):
         for field_or_group in fields_or_groups:
             fs = get_fields(field_or_group)
             for field in fs:
-                try:
-                    actions = self.actions[field.name]
-                except KeyError:
-                    continue
-                if FieldActions.COLOUR in actions._actions:
+                if field.name in colour_fields:
                     colour_vals[field.name] = \
                         colour_vals.get(field.name, 0) + field.weight
 
@@ -758,14 +1075,15 @@ class ActionSet(object):
     def perform(self, result, document, context, store_only=False):
         if not isinstance(document.fields, list):
             document.fields = tuple(document.fields)
-        self.normalise_colour_frequencies(document.fields)
+        if len(self._get_colour_fields()) != 0:
+            self.normalise_colour_frequencies(document.fields)
+        get_compiled = self._get_compiled
         for field_or_group in document.fields:
             if isinstance(field_or_group, fields.FieldGroup):
                 context.currfield_group = []
                 for field in field_or_group.fields:
-                    try:
-                        actions = self.actions[field.name]
-                    except KeyError:
+                    actions = get_compiled(field.name)
+                    if actions is None:
                         # If no actions are defined, just ignore the field.
                         continue
                     actions.perform(result, field, context, store_only)
@@ -776,9 +1094,8 @@ class ActionSet(object):
                 context.currfield_group = None
                 continue
 
-            try:
-                actions = self.actions[field_or_group.name]
-            except KeyError:
+            actions = get_compiled(field_or_group.name)
+            if actions is None:
                 # If no actions are defined, just ignore the field.
                 continue
             actions.perform(result, field_or_group, context, store_only)
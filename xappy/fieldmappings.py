@@ -108,6 +108,13 @@ class FieldMappings(object):
         """
         return self._slots[(fieldname, purpose)]
 
+    def get_slots(self, fieldname):
+        """Get the slot numbers used for a given field name, for any purpose.
+
+        """
+        return set(slot for (name, purpose), slot in self._slots.iteritems()
+                   if name == fieldname)
+
     def add_prefix(self, fieldname):
         """Allocate a prefix for the given field.
 
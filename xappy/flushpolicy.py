@@ -0,0 +1,335 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""flushpolicy.py: Policies for deciding when to flush changes.
+
+An IndexerConnection buffers changes in memory until they are flushed.  A
+flush policy, set with `IndexerConnection.set_flush_policy()`, decides when
+the connection should flush automatically.  The policy is consulted after each
+document is written, and told when each flush has happened.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import time
+
+import errors
+import memutils
+
+class IndexingStats(object):
+    """Statistics about the documents written by an IndexerConnection.
+
+    The following attributes are available:
+
+     - `docs_written`: the number of documents added or replaced.
+     - `docs_skipped`: the number of documents passed to replace() which
+       weren't written because they were unchanged (see
+       `IndexerConnection.set_skip_unchanged()`).
+     - `docs_since_flush`: the number of documents added or replaced since the
+       last flush.
+     - `flush_count`: the number of flushes performed.
+     - `flush_time`: the total time spent flushing, in seconds.
+     - `last_flush_duration`: the time taken by the most recent flush, in
+       seconds (or None if there hasn't been one).
+     - `last_flush_docs`: the number of documents written in the batch
+       committed by the most recent flush.
+     - `start_time`: the time at which the statistics started being collected.
+     - `last_flush_time`: the time at which the last flush finished (or the
+       start time, if there hasn't been a flush).
+     - `bytes_per_doc`: an estimate of the memory used to buffer each
+       document, measured from the size of the process just before the most
+       recent flush (or None if this isn't known).  Memory freed by a flush
+       is not always returned to the operating system, so the growth is
+       measured from the size of the process when the statistics started
+       being collected, rather than from the size after the previous flush.
+       This may overestimate if the process has grown for other reasons.
+
+    """
+    def __init__(self):
+        self.docs_written = 0
+        self.docs_skipped = 0
+        self.docs_since_flush = 0
+        self.flush_count = 0
+        self.flush_time = 0.0
+        self.last_flush_duration = None
+        self.last_flush_docs = 0
+        self.start_time = time.time()
+        self.last_flush_time = self.start_time
+        self.bytes_per_doc = None
+        self._rss_at_start = memutils.get_rss()
+
+    def _note_flush(self, started, finished, rss_before):
+        """Update the statistics after a flush.
+
+        `rss_before` is the size of the process immediately before the flush
+        started (or None if not known).
+
+        """
+        if (rss_before is not None and self._rss_at_start is not None and
+            self.docs_since_flush > 0):
+            used = rss_before - self._rss_at_start
+            if used > 0:
+                self.bytes_per_doc = float(used) / self.docs_since_flush
+        self.flush_count += 1
+        self.last_flush_duration = finished - started
+        self.flush_time += self.last_flush_duration
+        self.last_flush_docs = self.docs_since_flush
+        self.last_flush_time = finished
+        self.docs_since_flush = 0
+
+    @property
+    def docs_per_second(self):
+        """The average number of documents written per second, including the
+        time spent flushing.
+
+        """
+        elapsed = time.time() - self.start_time
+        if elapsed <= 0:
+            return None
+        return self.docs_written / elapsed
+
+    @property
+    def mean_flush_time(self):
+        """The average time taken by each flush, in seconds.
+
+        """
+        if self.flush_count == 0:
+            return None
+        return self.flush_time / self.flush_count
+
+    def __repr__(self):
+        return ('<IndexingStats(docs_written=%d, docs_skipped=%d, '
+                'flush_count=%d, flush_time=%.3f, docs_per_second=%s, '
+                'bytes_per_doc=%s)>' %
+                (self.docs_written, self.docs_skipped, self.flush_count,
+                 self.flush_time, self.docs_per_second, self.bytes_per_doc))
+
+class FlushPolicy(object):
+    """Base class of flush policies.
+
+    Subclasses should implement `should_flush()`, and may implement `reset()`.
+
+    """
+    def reset(self, stats):
+        """Called when the policy is installed, and after each flush.
+
+        `stats` is the IndexingStats object for the connection.
+
+        """
+        pass
+
+    def should_flush(self, stats, xapdoc):
+        """Check if the connection should be flushed.
+
+        This is called after each document is written, with `xapdoc` the
+        xapian Document which was written, and should return True if a flush
+        should be performed.
+
+        """
+        raise NotImplementedError
+
+def estimate_doc_bytes(xapdoc):
+    """Get an estimate of the bytes used to buffer the terms in a document.
+
+    (This is a very rough estimate.)
+
+    """
+    count = 0
+    for item in xapdoc.termlist():
+        # The term may also be stored in the spelling correction table, so
+        # double the amount used.
+        count += len(item.term) * 2
+
+        # Add a few more bytes for holding the wdf, and other bits and
+        # pieces.
+        count += 8
+
+    # Empirical observations indicate that about 5 times as much memory as
+    # the above calculation predicts is used for buffering in practice.
+    return count * 5
+
+class TermEstimateFlushPolicy(FlushPolicy):
+    """Flush when the estimated size of the buffered terms exceeds a limit.
+
+    The size is estimated by `estimate_doc_bytes()`, which reads the termlist
+    of every document written, so this is fairly expensive, and not very
+    accurate.  `MemoryFlushPolicy` should usually be preferred.
+
+    """
+    def __init__(self, max_mem):
+        self.max_mem = max_mem
+        self._buffered = 0
+
+    def reset(self, stats):
+        self._buffered = 0
+
+    def should_flush(self, stats, xapdoc):
+        self._buffered += estimate_doc_bytes(xapdoc)
+        return self._buffered > self.max_mem
+
+class MemoryFlushPolicy(FlushPolicy):
+    """Flush when the process has grown by more than a given amount.
+
+    The resident set size of the process is checked every `check_interval`
+    documents, so very little work is done for each document, and a flush is
+    made once it is more than `max_mem` larger than when the policy was
+    installed.  Where the resident set size can't be measured, the estimate
+    used by `TermEstimateFlushPolicy` is used instead.
+
+    Memory freed by a flush is not always returned to the operating system,
+    so the process may still be over the limit after a flush, although the
+    memory will be reused for the next batch.  The memory used by such a
+    batch can't be measured, so it is limited to the number of documents in
+    the last batch which was flushed for reaching the limit, or to `max_mem`
+    of further growth of the process, whichever comes first.
+
+    """
+    def __init__(self, max_mem, check_interval=100):
+        if check_interval < 1:
+            raise errors.IndexerError("check_interval must be at least 1")
+        self.max_mem = max_mem
+        self.check_interval = check_interval
+        self._reference = None
+        self._limit = None
+        self._measured = False
+        self._hit_limit = False
+        self._batch_docs = None
+        self._fallback = None
+
+    def reset(self, stats):
+        rss = memutils.get_rss()
+        if rss is None:
+            self._limit = None
+            if self._fallback is None:
+                self._fallback = TermEstimateFlushPolicy(self.max_mem)
+            self._fallback.reset(stats)
+            return
+        if self._reference is None:
+            self._reference = rss
+        if self._measured and self._hit_limit:
+            self._batch_docs = stats.last_flush_docs
+        self._hit_limit = False
+        self._limit = self._reference + self.max_mem
+        self._measured = (rss < self._limit)
+        if not self._measured and self._batch_docs is not None:
+            self._limit = rss + self.max_mem
+
+    def should_flush(self, stats, xapdoc):
+        if self._limit is None:
+            return self._fallback.should_flush(stats, xapdoc)
+        if (not self._measured and self._batch_docs is not None and
+            stats.docs_since_flush >= self._batch_docs):
+            return True
+        if stats.docs_since_flush % self.check_interval != 0:
+            return False
+        rss = memutils.get_rss()
+        if rss is None:
+            return False
+        if rss > self._limit:
+            self._hit_limit = True
+            return True
+        return False
+
+class DocCountFlushPolicy(FlushPolicy):
+    """Flush after a fixed number of documents have been written.
+
+    """
+    def __init__(self, max_docs):
+        if max_docs < 1:
+            raise errors.IndexerError("max_docs must be at least 1")
+        self.max_docs = max_docs
+
+    def should_flush(self, stats, xapdoc):
+        return stats.docs_since_flush >= self.max_docs
+
+class TimeFlushPolicy(FlushPolicy):
+    """Flush when a given number of seconds have passed since the last flush.
+
+    This is useful to bound the delay before changes become visible to
+    searchers.
+
+    """
+    def __init__(self, max_seconds):
+        self.max_seconds = max_seconds
+
+    def should_flush(self, stats, xapdoc):
+        return time.time() - stats.last_flush_time >= self.max_seconds
+
+class AdaptiveFlushPolicy(FlushPolicy):
+    """Flush after a number of documents which is tuned as indexing proceeds.
+
+    Flushing has a fixed overhead, so larger batches are more efficient, but
+    they use more memory, and make changes visible less often.  This policy
+    aims to keep the time spent flushing at around `target_overhead` (a
+    proportion between 0 and 1) of the total indexing time.  After each flush,
+    the batch size is doubled if the proportion of time spent flushing was too
+    high, or halved if it was less than a quarter of the target, keeping it
+    between `min_docs` and `max_docs`.
+
+    To bound the memory used as well, combine this with a MemoryFlushPolicy
+    using `AnyFlushPolicy`.
+
+    """
+    def __init__(self, target_overhead=0.1, initial_docs=1000, min_docs=100,
+                 max_docs=100000):
+        if not 0 < target_overhead < 1:
+            raise errors.IndexerError("target_overhead must be between 0 and 1")
+        if not 1 <= min_docs <= max_docs:
+            raise errors.IndexerError("min_docs must be at least 1, and no "
+                                      "more than max_docs")
+        self.target_overhead = target_overhead
+        self.min_docs = min_docs
+        self.max_docs = max_docs
+        self.batch_docs = min(max(initial_docs, min_docs), max_docs)
+        self._batch_start = None
+
+    def reset(self, stats):
+        if (self._batch_start is not None and
+            stats.last_flush_duration is not None and
+            stats.last_flush_docs > 0):
+            total = stats.last_flush_time - self._batch_start
+            if total > 0:
+                overhead = stats.last_flush_duration / total
+                if overhead > self.target_overhead:
+                    self.batch_docs = min(self.batch_docs * 2, self.max_docs)
+                elif overhead < self.target_overhead / 4:
+                    self.batch_docs = max(self.batch_docs // 2, self.min_docs)
+        self._batch_start = time.time()
+
+    def should_flush(self, stats, xapdoc):
+        return stats.docs_since_flush >= self.batch_docs
+
+class AnyFlushPolicy(FlushPolicy):
+    """Flush when any of a set of policies says a flush is needed.
+
+    """
+    def __init__(self, *policies):
+        self.policies = policies
+
+    def reset(self, stats):
+        for policy in self.policies:
+            policy.reset(stats)
+
+    def should_flush(self, stats, xapdoc):
+        result = False
+        for policy in self.policies:
+            # Consult every policy, since some keep a running total.
+            if policy.should_flush(stats, xapdoc):
+                result = True
+        return result
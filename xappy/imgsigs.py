@@ -0,0 +1,330 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""imgsigs.py: Computing image signatures for the IMGSEEK action.
+
+Computing the signature of an image requires the image file to be read and
+decoded, which is much more expensive than the rest of the work done to index
+a document.  This module provides a cache of signatures on disk, keyed by the
+contents of the image files (so an unchanged image is never decoded twice,
+whatever its filename), and a pool of processes which compute the signatures
+for the images in upcoming documents ahead of the process writing them.
+
+See `IndexerConnection.set_image_signatures()`.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import collections
+import cPickle
+import errno
+import os
+try:
+    from hashlib import sha1
+except ImportError:
+    # hashlib is only in 2.5 onwards
+    from sha import new as sha1
+import tempfile
+try:
+    import multiprocessing
+except ImportError:
+    # multiprocessing is only in 2.6 onwards
+    multiprocessing = None
+import xapian
+
+import errors
+
+def _register_image(filename):
+    """Compute the signature of an image file, returning it serialised.
+
+    """
+    import xapian.imgseek
+    return xapian.imgseek.ImgSig.register_Image(filename).serialise()
+
+def _unserialise(data):
+    import xapian.imgseek
+    return xapian.imgseek.ImgSig.unserialise(data)
+
+class ImgSigCache(object):
+    """A cache of image signatures, stored in a directory.
+
+    Signatures are stored in a file named by the SHA1 hash of the contents of
+    the image file, so the cache may be shared by several indexes, and by
+    several processes at once.  Entries are never removed, except by removing
+    the directory.
+
+    """
+    def __init__(self, path):
+        """Open (creating if necessary) a cache in the directory `path`.
+
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+
+    def key(self, filename):
+        """Get the key for the signature of the image in a file.
+
+        """
+        hasher = sha1()
+        fd = open(filename, 'rb')
+        try:
+            while True:
+                data = fd.read(65536)
+                if not data:
+                    break
+                hasher.update(data)
+        finally:
+            fd.close()
+        return hasher.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key):
+        """Get the serialised signature stored with a key.
+
+        Returns None if there is no signature stored with the key.
+
+        """
+        try:
+            fd = open(self._entry_path(key), 'rb')
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        try:
+            return fd.read()
+        finally:
+            fd.close()
+
+    def set(self, key, data):
+        """Store a serialised signature with a key.
+
+        The entry is written to a temporary file and renamed into place, so
+        readers never see a partially written entry.
+
+        """
+        entrypath = self._entry_path(key)
+        dirpath = os.path.dirname(entrypath)
+        if not os.path.isdir(dirpath):
+            try:
+                os.mkdir(dirpath)
+            except OSError, e:
+                # Another process may have made it.
+                if e.errno != errno.EEXIST:
+                    raise
+        fd, tmppath = tempfile.mkstemp(dir=dirpath, prefix='.tmp')
+        try:
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            os.rename(tmppath, entrypath)
+        except:
+            os.unlink(tmppath)
+            raise
+
+    def get_serialised(self, filename):
+        """Get the serialised signature of an image file.
+
+        The signature is computed, and stored in the cache, if it isn't
+        already in the cache.
+
+        """
+        key = self.key(filename)
+        data = self.get(key)
+        if data is None:
+            data = _register_image(filename)
+            self.set(key, data)
+        return data
+
+    def get_signature(self, filename):
+        """Get the signature (an xapian.imgseek.ImgSig) of an image file.
+
+        """
+        return _unserialise(self.get_serialised(filename))
+
+# The cache used by the current worker process.
+_worker_cache = None
+
+def _init_worker(cachepath):
+    global _worker_cache
+    if cachepath is not None:
+        _worker_cache = ImgSigCache(cachepath)
+
+def _compute(filename):
+    """Compute a serialised signature in a worker process.
+
+    Returns a (success, result) pair, where result is the serialised
+    signature, or the error which occurred (or its type name and message, if
+    it can't be pickled).
+
+    """
+    try:
+        if _worker_cache is None:
+            return True, _register_image(filename)
+        return True, _worker_cache.get_serialised(filename)
+    except Exception, e:
+        try:
+            cPickle.dumps(e, 2)
+        except Exception:
+            # The xapian exceptions can't be pickled, so send their type and
+            # message back instead.
+            return False, (e.__class__.__name__, str(e))
+        return False, e
+
+class ImgSigPrefetcher(object):
+    """Computes image signatures in a pool of worker processes.
+
+    Filenames passed to prefetch() are sent to the worker processes, and
+    the signatures are collected by get_signature().  Images which haven't
+    been prefetched are handled in the calling process.  If `cachepath` is
+    not None, it is the path of an ImgSigCache which is used by all the
+    processes.
+
+    """
+    def __init__(self, cachepath=None, processes=None, max_pending=None):
+        """Create a prefetcher.
+
+         - `processes` is the number of worker processes (by default, the
+           number of CPUs).  The processes are started when the first image
+           is prefetched.  If 0, or if the multiprocessing module is not
+           available, no processes are started, and signatures are only
+           computed when they're needed (and looked up in the cache, if any).
+         - `max_pending` is the number of documents which lookahead() reads
+           ahead (by default, 8 per process).
+
+        """
+        if processes is None:
+            if multiprocessing is None:
+                processes = 0
+            else:
+                processes = multiprocessing.cpu_count()
+        if processes < 0:
+            raise errors.IndexerError("Number of processes must not be "
+                                      "negative")
+        if max_pending is None:
+            max_pending = processes * 8
+        self.processes = processes
+        self.max_pending = max_pending
+        self.cache = None
+        if cachepath is not None:
+            self.cache = ImgSigCache(cachepath)
+        self._cachepath = cachepath
+        self._pool = None
+        self._closed = False
+        # AsyncResults for the images being prefetched, keyed by filename.
+        self._pending = {}
+
+    def _can_prefetch(self):
+        return (self.processes > 0 and multiprocessing is not None and
+                not self._closed)
+
+    def prefetch(self, filename):
+        """Start computing the signature of an image file.
+
+        The result is held until get_signature() or discard() is called for
+        the file.
+
+        """
+        if not self._can_prefetch() or filename in self._pending:
+            return
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes, _init_worker,
+                                              (self._cachepath,))
+        self._pending[filename] = self._pool.apply_async(_compute,
+                                                         (filename,))
+
+    def discard(self, filename):
+        """Discard the result of prefetching an image file, if any.
+
+        """
+        self._pending.pop(filename, None)
+
+    def lookahead(self, documents, fieldnames):
+        """Prefetch the images in upcoming documents.
+
+        Returns an iterator over `documents`, which reads up to `max_pending`
+        documents ahead of the document last returned, and prefetches the
+        images in the fields of them listed in `fieldnames`.
+
+        """
+        if not self._can_prefetch() or not fieldnames:
+            for document in documents:
+                yield document
+            return
+
+        ahead = collections.deque()
+        for document in documents:
+            filenames = ()
+            if not hasattr(document, '_doc'):
+                if not isinstance(document.fields, list):
+                    document.fields = list(document.fields)
+                filenames = [field.value for field in document.fields
+                             if field.name in fieldnames and field.value]
+                for filename in filenames:
+                    self.prefetch(filename)
+            ahead.append((document, filenames))
+            if len(ahead) > self.max_pending:
+                document, filenames = ahead.popleft()
+                yield document
+                # Don't hold on to signatures which weren't used (for
+                # example, if the document was stored but not indexed).
+                for filename in filenames:
+                    self.discard(filename)
+        while ahead:
+            document, filenames = ahead.popleft()
+            yield document
+            for filename in filenames:
+                self.discard(filename)
+
+    def get_signature(self, filename):
+        """Get the signature (an xapian.imgseek.ImgSig) of an image file.
+
+        """
+        result = self._pending.pop(filename, None)
+        if result is None:
+            if self.cache is not None:
+                return self.cache.get_signature(filename)
+            return _unserialise(_register_image(filename))
+        success, data = result.get()
+        if not success:
+            if isinstance(data, Exception):
+                raise data
+            errtype = getattr(xapian, data[0], None)
+            if not (isinstance(errtype, type) and
+                    issubclass(errtype, xapian.Error)):
+                errtype = errors.IndexerError
+            raise errtype(data[1])
+        return _unserialise(data)
+
+    def close(self):
+        """Shut down the worker processes.
+
+        Any images still being prefetched are discarded, and no more are
+        prefetched.
+
+        """
+        self._closed = True
+        self._pending = {}
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
@@ -0,0 +1,554 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""importer.py: Streaming import of documents from JSONL or CSV files.
+
+This module reads records from a file incrementally, maps them to documents
+using a `FieldMapping`, and writes them to an index in batches, processing
+them in parallel with a `ProcessorPool`.  After each batch, the offset in the
+file just after the last record of the batch is stored in the metadata of the
+index, and committed by the same flush as the documents, so an import which is
+interrupted can be restarted from the last committed batch.
+
+It can also be run as a script::
+
+    python -m xappy.importer [options] INDEXPATH MAPPINGFILE DATAFILE
+
+where MAPPINGFILE is a JSON file describing the mapping (see `FieldMapping`).
+
+Note that documents may also be committed by the flush policy of the
+connection part way through a batch; if the import is restarted, any such
+documents will be written again.  To avoid duplicate documents, the mapping
+should give each document an ID, or the import should use replace mode.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import csv
+import itertools
+import optparse
+import os
+import sys
+import time
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import errors
+from datastructures import UnprocessedDocument
+from fieldactions import FieldActions
+from fields import Field, FieldGroup
+from indexerconnection import IndexerConnection
+from parallel import ProcessorPool
+
+def read_jsonl(fileobj, offset=0):
+    """Read records from a file containing one JSON object per line.
+
+    Reading starts at byte `offset` in the file.  Returns an iterator over
+    (offset, record) pairs, where the offset is the position just after the
+    record.  Blank lines are skipped.  If a line can't be parsed, the record
+    returned is the exception raised by the parser.
+
+    """
+    fileobj.seek(offset)
+    while True:
+        line = fileobj.readline()
+        if not line:
+            return
+        offset += len(line)
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("Record is not a JSON object")
+        except ValueError, e:
+            record = e
+        yield offset, record
+
+def read_csv(fileobj, offset=0, **fmtparams):
+    """Read records from a CSV file with a header row.
+
+    Reading starts at byte `offset` in the file (or just after the header row,
+    if that is later).  Returns an iterator over (offset, record) pairs, as for
+    `read_jsonl()`, where each record is a dict keyed by the column names from
+    the header row.  Any extra keyword arguments are passed to `csv.reader()`.
+
+    """
+    position = [0]
+    def lines():
+        while True:
+            line = fileobj.readline()
+            if not line:
+                return
+            position[0] += len(line)
+            yield line
+
+    fileobj.seek(0)
+    reader = csv.reader(lines(), **fmtparams)
+    try:
+        header = reader.next()
+    except StopIteration:
+        return
+    if offset > position[0]:
+        fileobj.seek(offset)
+        position[0] = offset
+        reader = csv.reader(lines(), **fmtparams)
+
+    for row in reader:
+        if not row:
+            continue
+        if len(row) > len(header):
+            record = ValueError("Row has %d columns, but header has %d" %
+                                (len(row), len(header)))
+        else:
+            record = dict(zip(header, row))
+        yield position[0], record
+
+_readers = {
+    'jsonl': read_jsonl,
+    'csv': read_csv,
+}
+
+def _values(value, separator):
+    """Get a list of field values from a value in a record.
+
+    """
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        result = []
+        for item in value:
+            result.extend(_values(item, None))
+        return result
+    if isinstance(value, dict):
+        raise ValueError("Nested objects can't be used as field values")
+    if isinstance(value, (int, long, float)):
+        value = unicode(value)
+    if separator is not None:
+        return [item for item in value.split(separator) if item]
+    if value == '':
+        return []
+    return [value]
+
+def _str_keys(mapping):
+    """Copy a dict, converting its keys (which may be unicode, if read from
+    JSON) to str.
+
+    """
+    return dict((str(key), value) for key, value in mapping.iteritems())
+
+class FieldMapping(object):
+    """A mapping from the records in an input file to documents.
+
+    The mapping has the following attributes, each of which may be supplied
+    to the constructor:
+
+     - `id`: the name of the column holding the document ID, or None to let
+       the index allocate IDs.
+     - `fields`: a dict mapping field names to the names of the columns
+       holding their values.
+     - `groups`: a list of dicts mapping field names to column names.  For
+       each group, the values of the columns are lists (or are split by a
+       separator), and a FieldGroup is made from the first value of each
+       column, another from the second value of each column, and so on.
+     - `split`: a dict mapping column names to a separator, which is used to
+       split the values of the column into several field values.  Columns
+       with list values (in JSON input) don't need to be split.
+     - `actions`: a dict mapping field names to a list of [action name,
+       keyword arguments] pairs (eg, ["INDEX_FREETEXT", {"language": "en"}]).
+       These are added to the index by `apply_actions()` for any fields which
+       don't already have actions.
+
+    A mapping can be read from a JSON object with the same keys, using
+    `from_json()`.
+
+    """
+    def __init__(self, id=None, fields=None, groups=None, split=None,
+                 actions=None):
+        self.id = id
+        self.fields = _str_keys(fields or {})
+        self.groups = [_str_keys(group) for group in (groups or ())]
+        self.split = dict(split or {})
+        self.actions = _str_keys(actions or {})
+
+    @classmethod
+    def from_json(cls, text):
+        """Make a mapping from a string holding a JSON object.
+
+        """
+        spec = json.loads(text)
+        if not isinstance(spec, dict):
+            raise errors.IndexerError("Field mapping must be a JSON object")
+        unknown = set(spec.keys()) - set(('id', 'fields', 'groups', 'split',
+                                          'actions'))
+        if unknown:
+            raise errors.IndexerError("Unknown keys in field mapping: %s" %
+                                      ', '.join(sorted(unknown)))
+        return cls(**_str_keys(spec))
+
+    def apply_actions(self, conn):
+        """Add the field actions in the mapping to a connection.
+
+        Actions are only added for fields which don't already have any
+        actions, so that the configuration of an existing index isn't changed.
+
+        """
+        existing = set(conn.get_fields_with_actions())
+        for fieldname, actions in self.actions.iteritems():
+            if fieldname in existing:
+                continue
+            for action, kwargs in actions:
+                fieldtype = getattr(FieldActions, str(action), None)
+                if not isinstance(fieldtype, int):
+                    raise errors.IndexerError("Unknown field action %r" %
+                                              action)
+                conn.add_field_action(fieldname, fieldtype,
+                                      **_str_keys(kwargs or {}))
+
+    def make_document(self, record):
+        """Make an UnprocessedDocument from a record.
+
+        Raises ValueError if the record can't be mapped.
+
+        """
+        doc = UnprocessedDocument()
+        if self.id is not None:
+            ids = _values(record.get(self.id), None)
+            if len(ids) != 1:
+                raise ValueError("Record has no value for ID column %r" %
+                                 self.id)
+            doc.id = ids[0]
+        for fieldname, column in self.fields.iteritems():
+            for value in _values(record.get(column), self.split.get(column)):
+                doc.fields.append(Field(fieldname, value))
+        for group in self.groups:
+            columns = [(fieldname, _values(record.get(column),
+                                           self.split.get(column)))
+                       for fieldname, column in group.iteritems()]
+            count = max([len(values) for fieldname, values in columns] or [0])
+            for i in xrange(count):
+                doc.fields.append(FieldGroup([
+                    Field(fieldname, values[i])
+                    for fieldname, values in columns if i < len(values)
+                ]))
+        return doc
+
+class ImportStats(object):
+    """Statistics about an import.
+
+    The following attributes are available:
+
+     - `records`: the number of records read.
+     - `docs_written`: the number of documents written.
+     - `errors`: the number of records which couldn't be read, mapped or
+       indexed.
+     - `start_offset`: the offset in the input file at which the import
+       started.
+     - `committed_offset`: the offset in the input file just after the last
+       record which has been committed.
+     - `start_time`: the time at which the import started.
+
+    """
+    def __init__(self, start_offset=0):
+        self.records = 0
+        self.docs_written = 0
+        self.errors = 0
+        self.start_offset = start_offset
+        self.committed_offset = start_offset
+        self.start_time = time.time()
+
+    @property
+    def docs_per_second(self):
+        """The average number of documents written per second.
+
+        """
+        elapsed = time.time() - self.start_time
+        if elapsed <= 0:
+            return None
+        return self.docs_written / elapsed
+
+    def __repr__(self):
+        return ('<ImportStats(records=%d, docs_written=%d, errors=%d, '
+                'committed_offset=%d, docs_per_second=%s)>' %
+                (self.records, self.docs_written, self.errors,
+                 self.committed_offset, self.docs_per_second))
+
+class Importer(object):
+    """Import documents from a file into an index.
+
+    """
+    def __init__(self, conn, mapping, replace=False, batch_size=1000,
+                 processes=None, error_cb=None, progress_cb=None):
+        """Prepare to import documents.
+
+         - `conn` is the IndexerConnection to write to.  Its configuration
+           must not be changed while the import is running.
+         - `mapping` is the FieldMapping to make documents with.
+         - `replace` is True to replace existing documents with the same IDs,
+           rather than adding new documents.
+         - `batch_size` is the number of records in each batch; a checkpoint
+           is committed after each batch.
+         - `processes` is the number of processes to use for processing
+           documents (see ProcessorPool).
+         - `error_cb`, if not None, is called with (offset, message) for each
+           record which fails, where the offset is the position just after the
+           record.
+         - `progress_cb`, if not None, is called with the ImportStats after
+           each batch is committed.
+
+        """
+        if batch_size < 1:
+            raise errors.IndexerError("batch_size must be at least 1")
+        self._conn = conn
+        self._mapping = mapping
+        self._replace = replace
+        self._batch_size = batch_size
+        self._processes = processes
+        self._error_cb = error_cb
+        self._progress_cb = progress_cb
+        self.stats = None
+
+    @staticmethod
+    def checkpoint_key(name):
+        """Get the metadata key holding the checkpoint for an import.
+
+        """
+        return '_xappy_import:' + name
+
+    def get_checkpoint(self, name):
+        """Get the committed offset for the import with the given name.
+
+        Returns 0 if there is no checkpoint.
+
+        """
+        value = self._conn.get_metadata(self.checkpoint_key(name))
+        if not value:
+            return 0
+        return int(value)
+
+    def clear_checkpoint(self, name):
+        """Remove the checkpoint for the import with the given name.
+
+        The change is committed by the next flush.
+
+        """
+        self._conn.set_metadata(self.checkpoint_key(name), '')
+
+    def _error(self, offset, message):
+        self.stats.errors += 1
+        if self._error_cb is not None:
+            self._error_cb(offset, message)
+
+    def _write(self, offset, document, spellings):
+        """Write a single document, recording any error.
+
+        """
+        try:
+            self._conn._add_spellings(spellings)
+            if self._replace:
+                self._conn.replace(document)
+            else:
+                self._conn.add(document)
+        except Exception, e:
+            self._error(offset, str(e))
+            return
+        self.stats.docs_written += 1
+
+    def _write_batch(self, pool, batch):
+        """Process and write a batch of (offset, document) pairs.
+
+        If processing fails for a document, the rest of the batch is processed
+        one document at a time, so that the failing document can be skipped.
+
+        """
+        written = 0
+        try:
+            results = pool.imap([document for offset, document in batch])
+            for document, spellings in results:
+                self._write(batch[written][0], document, spellings)
+                written += 1
+        except Exception:
+            for offset, document in batch[written:]:
+                self._write(offset, document, ())
+
+    def import_file(self, fileobj, format='jsonl', name=None, restart=False,
+                    **fmtparams):
+        """Import the records from a file.
+
+         - `fileobj` is the file to read; it must be opened in binary mode,
+           and must be seekable.
+         - `format` is 'jsonl' or 'csv'.
+         - `name` is the name to store the checkpoint under.  If None, no
+           checkpoint is stored, and the import starts at the beginning of
+           the file.
+         - `restart` is True to ignore any existing checkpoint, and start at
+           the beginning of the file.
+
+        Any extra keyword arguments are passed to the reader (see
+        `read_csv()`).  Returns the ImportStats for the import.
+
+        """
+        try:
+            reader = _readers[format]
+        except KeyError:
+            raise errors.IndexerError("Unknown import format %r" % format)
+        offset = 0
+        if name is not None and not restart:
+            offset = self.get_checkpoint(name)
+        self.stats = stats = ImportStats(offset)
+
+        pool = ProcessorPool(self._conn, self._processes)
+        try:
+            records = reader(fileobj, offset, **fmtparams)
+            while True:
+                batch = []
+                for offset, record in itertools.islice(records,
+                                                       self._batch_size):
+                    stats.records += 1
+                    if isinstance(record, Exception):
+                        self._error(offset, str(record))
+                        continue
+                    try:
+                        batch.append((offset,
+                                      self._mapping.make_document(record)))
+                    except ValueError, e:
+                        self._error(offset, str(e))
+                if offset == stats.committed_offset:
+                    break
+                self._write_batch(pool, batch)
+                if name is not None:
+                    self._conn.set_metadata(self.checkpoint_key(name),
+                                            str(offset))
+                self._conn.flush()
+                stats.committed_offset = offset
+                if self._progress_cb is not None:
+                    self._progress_cb(stats)
+        finally:
+            pool.terminate()
+        return stats
+
+def main(argv=None):
+    """Run an import from the command line.
+
+    Returns the exit status.
+
+    """
+    parser = optparse.OptionParser(
+        usage="%prog [options] INDEXPATH MAPPINGFILE DATAFILE",
+        description="Import documents from a JSONL or CSV file into an "
+                    "index.  The import is committed in batches, and can be "
+                    "resumed from the last committed batch if it is "
+                    "interrupted.")
+    parser.add_option('-f', '--format', choices=sorted(_readers.keys()),
+                      help="Format of the data file (by default, guessed "
+                      "from the file extension)")
+    parser.add_option('-r', '--replace', action='store_true', default=False,
+                      help="Replace existing documents with the same IDs")
+    parser.add_option('-b', '--batch-size', type='int', default=1000,
+                      help="Number of records to commit in each batch")
+    parser.add_option('-p', '--processes', type='int',
+                      help="Number of processes to use (default: the number "
+                      "of CPUs)")
+    parser.add_option('-n', '--name',
+                      help="Name to store the checkpoint under (default: the "
+                      "name of the data file)")
+    parser.add_option('--restart', action='store_true', default=False,
+                      help="Ignore any checkpoint, and start from the "
+                      "beginning of the data file")
+    parser.add_option('-d', '--delimiter',
+                      help="Delimiter for CSV files")
+    parser.add_option('--defer-spelling', action='store_true', default=False,
+                      help="Don't add spelling data while importing; build "
+                      "the spelling table from the index afterwards")
+    parser.add_option('-q', '--quiet', action='store_true', default=False,
+                      help="Don't report progress")
+    options, args = parser.parse_args(argv)
+    if len(args) != 3:
+        parser.error("Wrong number of arguments")
+    indexpath, mappingpath, datapath = args
+
+    format = options.format
+    if format is None:
+        format = os.path.splitext(datapath)[1][1:].lower()
+        if format not in _readers:
+            parser.error("Can't guess format of %r: use --format" % datapath)
+    fmtparams = {}
+    if options.delimiter is not None:
+        if format != 'csv':
+            parser.error("--delimiter is only valid for CSV files")
+        fmtparams['delimiter'] = options.delimiter
+    name = options.name
+    if name is None:
+        name = os.path.basename(datapath)
+
+    fd = open(mappingpath)
+    try:
+        mapping = FieldMapping.from_json(fd.read())
+    finally:
+        fd.close()
+
+    def error_cb(offset, message):
+        sys.stderr.write("Error in record ending at offset %d: %s\n" %
+                         (offset, message))
+    def progress_cb(stats):
+        sys.stderr.write("Committed to offset %d: %d records, %d documents, "
+                         "%d errors, %.1f documents/second\n" %
+                         (stats.committed_offset, stats.records,
+                          stats.docs_written, stats.errors,
+                          stats.docs_per_second or 0.0))
+    if options.quiet:
+        progress_cb = None
+
+    conn = IndexerConnection(indexpath)
+    try:
+        mapping.apply_actions(conn)
+        if options.defer_spelling:
+            conn.set_deferred_spelling()
+        importer = Importer(conn, mapping, options.replace,
+                            options.batch_size, options.processes,
+                            error_cb, progress_cb)
+        fd = open(datapath, 'rb')
+        try:
+            stats = importer.import_file(fd, format, name, options.restart,
+                                         **fmtparams)
+        finally:
+            fd.close()
+        if options.defer_spelling:
+            words = conn.build_spelling()
+            conn.flush()
+            if not options.quiet:
+                sys.stderr.write("Built spelling table with %d words\n" %
+                                 words)
+    finally:
+        conn.close()
+
+    if not options.quiet:
+        sys.stderr.write("Imported %d documents from %d records, with %d "
+                         "errors, in %.1f seconds\n" %
+                         (stats.docs_written, stats.records, stats.errors,
+                          time.time() - stats.start_time))
+    if stats.errors:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -34,8 +34,16 @@ from datastructures import *
 import errors
 from fieldactions import ActionContext, FieldActions, ActionSet
 import fieldmappings
+from fields import Field
+import flushpolicy
+import imgsigs
 import memutils
 import os
+import profiling
+import re
+import sys
+import threading
+import time
 
 def _allocate_id(index, next_docid):
     """Allocate a new ID.
@@ -53,12 +61,184 @@ def _allocate_id(index, next_docid):
             break
     return idstr, next_docid
 
+def _term_prefix(term):
+    """Get the prefix of a term (ie, the leading capital letters).
+
+    """
+    pos = 0
+    while pos < len(term) and 'A' <= term[pos] <= 'Z':
+        pos += 1
+    return term[:pos]
+
+class _IdAllocator(object):
+    """Allocator for automatically generated document IDs.
+
+    IDs are allocated from blocks, which are reserved `block_size` at a time.
+    The end of the current block is stored in the database metadata when the
+    connection is flushed, so a new connection to the database will start
+    allocating after the end of the last block reserved (IDs left over at the
+    end of a block are never used).  This avoids having to store the
+    configuration every time an ID is allocated.
+
+    The allocator also keeps a "watermark", which is greater than the numeric
+    value of every ID in the database which has the form of an automatically
+    allocated ID (ie, lowercase hex with no leading zeros).  IDs at or above
+    the watermark are known not to be in use, so can be allocated without
+    checking the database.  IDs below the watermark are checked, as before.
+
+    For databases created before the watermark was stored, it is calculated
+    by scanning the ID terms in the database, the first time it is needed.
+    Note that connections made with older versions of xappy don't update the
+    watermark, so shouldn't be used to add documents with explicit IDs of
+    this form to a database which is also being modified by this version.
+
+    """
+    _metadata_key = '_xappy_idblock'
+    _hexid_re = re.compile('^(0|[1-9a-f][0-9a-f]*)$')
+
+    def __init__(self, index, next_docid, block_size=1000):
+        self._index = index
+        self.block_size = block_size
+        self._watermark = None
+        stored = index.get_metadata(self._metadata_key)
+        if stored:
+            end, watermark = (int(item) for item in stored.split())
+            self._next = max(end, next_docid)
+            self._watermark = watermark
+        else:
+            self._next = next_docid
+        self._end = self._next
+        self._modified = False
+
+    def _get_watermark(self):
+        """Get the watermark, calculating it if it's not yet known.
+
+        """
+        if self._watermark is None:
+            watermark = 0
+            if self._index.get_doccount() != 0:
+                for item in self._index.allterms('Q'):
+                    idstr = item.term[1:]
+                    if self._hexid_re.match(idstr):
+                        watermark = max(watermark, int(idstr, 16) + 1)
+            self._watermark = watermark
+            self._modified = True
+        return self._watermark
+
+    @property
+    def next_docid(self):
+        """The value to store for the next docid in the configuration.
+
+        Older versions of xappy allocate from this value, so the end of the
+        current block is used, to ensure they don't reuse IDs.
+
+        """
+        return self._end
+
+    def allocate(self):
+        """Allocate a new ID.
+
+        """
+        watermark = self._get_watermark()
+        while True:
+            if self._next >= self._end:
+                self._end = self._next + self.block_size
+                self._modified = True
+            docid = self._next
+            self._next += 1
+            idstr = "%x" % docid
+            if docid >= watermark:
+                # Known not to be in use.
+                self._watermark = docid + 1
+                return idstr
+            if not self._index.term_exists('Q' + idstr):
+                return idstr
+
+    def note_id(self, idstr):
+        """Note that a document with an explicitly specified ID was written.
+
+        """
+        if self._hexid_re.match(idstr):
+            watermark = self._get_watermark()
+            docid = int(idstr, 16)
+            if docid >= watermark:
+                self._watermark = docid + 1
+                self._modified = True
+
+    def allocate_without_index(self):
+        """Allocate a new ID, if this can be done without reading the database.
+
+        Returns None if the database would need to be checked.
+
+        """
+        if self._watermark is None or self._next < self._watermark:
+            return None
+        return self.allocate()
+
+    def save(self):
+        """Store the state of the allocator in the database metadata.
+
+        This is done whenever the connection is flushed, so that the state is
+        committed together with the documents which use it.
+
+        """
+        if self._modified:
+            self._index.set_metadata(self._metadata_key, '%d %d' % (
+                                     self._end, self._get_watermark()))
+            self._modified = False
+
+class _BackgroundCommit(object):
+    """A commit of a database, performed in a separate thread.
+
+    """
+    def __init__(self, index, rss_before):
+        self.rss_before = rss_before
+        self.started = time.time()
+        self.finished = None
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run, args=(index,))
+        self._thread.start()
+
+    def _run(self, index):
+        try:
+            index.flush()
+        except:
+            self._exc_info = sys.exc_info()
+        self.finished = time.time()
+
+    def done(self):
+        """Check if the commit has finished.
+
+        """
+        return not self._thread.isAlive()
+
+    def wait(self):
+        """Wait for the commit to finish, raising any error which occurred.
+
+        """
+        self._thread.join()
+        if self._exc_info is not None:
+            exc_info, self._exc_info = self._exc_info, None
+            raise exc_info[0], exc_info[1], exc_info[2]
+
 class IndexerConnection(object):
     """A connection to the search engine for indexing.
 
     """
 
-    _index = None
+    _db = None
+    _committer = None
+    _queued = ()
+
+    def _get_index(self):
+        # Any background commit must finish, and the changes queued while it
+        # was in progress must be written, before the database is used.
+        if self._committer is not None or self._queued:
+            self.wait_for_commit()
+        return self._db
+    def _set_index(self, index):
+        self._db = index
+    _index = property(_get_index, _set_index)
 
     def __init__(self, indexpath, dbtype=None):
         """Create a new connection to the index.
@@ -102,8 +282,10 @@ class IndexerConnection(object):
         self._next_docid = 0
         self._imgterms_cache = {}
         self._config_modified = False
+        self._profile = None
         try:
             self._load_config()
+            self._id_allocator = _IdAllocator(self._index, self._next_docid)
         except:
             if hasattr(self._index, 'close'):
                 self._index.close()
@@ -112,9 +294,24 @@ class IndexerConnection(object):
 
         # Set management of the memory used.
         # This can be removed once Xapian implements this itself.
-        self._mem_buffered = 0
+        self._indexing_stats = flushpolicy.IndexingStats()
+        self._flush_policy = None
         self.set_max_mem_use()
 
+        # Slot holding document hashes, if skipping unchanged documents.
+        self._hash_slot = None
+
+        # Whether spelling data is left to be built by build_spelling().
+        self._defer_spelling = False
+
+        # The imgsigs.ImgSigPrefetcher used for IMGSEEK fields, if any.
+        self._imgsigs = None
+
+        # Whether to commit in a background thread, and the operations queued
+        # while a background commit is in progress.
+        self._background_commit = False
+        self._queued = []
+
     def __del__(self):
         self.close()
 
@@ -126,7 +323,9 @@ class IndexerConnection(object):
         other changes to the indexing.
 
         Note: this is an approximate measure - the actual amount of memory used
-        max exceed the specified amount.  Also, note that future versions of
+        max exceed the specified amount.  This is implemented by setting a
+        `flushpolicy.MemoryFlushPolicy` (see set_flush_policy()), which
+        replaces any previously set flush policy.  Also, note that future versions of
         xapian are likely to implement this differently, so this setting may be
         entirely ignored.
 
@@ -151,14 +350,275 @@ class IndexerConnection(object):
                                        "max_mem_proportion may be specified")
 
         if max_mem is None and max_mem_proportion is None:
-            self._max_mem = None
+            self.set_flush_policy(None)
+            return
 
         if max_mem_proportion is not None:
             physmem = memutils.get_physical_memory()
             if physmem is not None:
                 max_mem = int(physmem * max_mem_proportion)
 
-        self._max_mem = max_mem
+        if max_mem is None:
+            self.set_flush_policy(None)
+        else:
+            self.set_flush_policy(flushpolicy.MemoryFlushPolicy(max_mem))
+
+    def set_flush_policy(self, policy):
+        """Set the policy used to decide when to flush automatically.
+
+        `policy` should be an instance of a subclass of
+        `flushpolicy.FlushPolicy`, or None to disable automatic flushing (in
+        which case changes are only flushed by explicit calls to flush() or
+        close()).  Policies may be combined using `flushpolicy.AnyFlushPolicy`.
+
+        Note that a policy object keeps state about the connection it is used
+        with, so shouldn't be shared between connections.
+
+        """
+        if self._index is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+        if policy is not None:
+            policy.reset(self._indexing_stats)
+        self._flush_policy = policy
+
+    def get_indexing_stats(self):
+        """Get statistics about the documents written by this connection.
+
+        Returns a `flushpolicy.IndexingStats` object, which gives the number of
+        documents written, the number of documents written per second, the
+        time spent flushing, and an estimate of the memory used per buffered
+        document.
+
+        """
+        if self._db is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+        return self._indexing_stats
+
+    def set_profiling(self, enabled=True):
+        """Set whether to record the time spent in each stage of indexing.
+
+        When profiling is enabled, the number of calls, and the wall-clock and
+        processor time spent, are recorded for each field action performed
+        on each field, and for each stage of writing a document (processing,
+        ID allocation, preparation, updating cached results, writing to the
+        database and flushing).  The timings are available from
+        get_profile().  Enabling profiling when it is already enabled
+        discards the timings recorded so far.
+
+        Profiling is disabled by default, and the setting isn't stored in the
+        index.  Field actions performed in other processes, by add_many() or
+        replace_many() with a ProcessorPool, aren't timed.
+
+        """
+        if self._index is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+        if enabled:
+            self._profile = profiling.IndexingProfile()
+        else:
+            self._profile = None
+        self._field_actions._set_profile(self._profile)
+
+    def get_profile(self):
+        """Get the timings recorded since profiling was enabled.
+
+        Returns a `profiling.IndexingProfile` object, or None if profiling
+        isn't enabled (see set_profiling()).
+
+        """
+        if self._db is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+        return self._profile
+
+    def set_skip_unchanged(self, skip=True):
+        """Set whether replace() should skip documents which are unchanged.
+
+        When this is enabled, a hash of the contents of each document added
+        or replaced (see ProcessedDocument.calc_hash()) is stored in a
+        reserved slot in the document.  When a document is replaced, the hash
+        of the new document is compared with the hash stored in the existing
+        document, and if they are the same the document isn't written.  This
+        avoids rewriting the postings for documents which are resent
+        unchanged.
+
+        The slot used is recorded in the index configuration, but the setting
+        itself isn't, so it must be enabled on each new connection.
+        Documents written while the setting is disabled have no stored hash,
+        so are always written the next time they're replaced.
+
+        The number of documents skipped is available as the `docs_skipped`
+        attribute of the statistics returned by get_indexing_stats().
+
+        """
+        if self._index is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+        if not skip:
+            self._hash_slot = None
+            return
+        try:
+            self._hash_slot = self._field_mappings.get_slot('_xappy', 'hash')
+        except KeyError:
+            self._hash_slot = self._field_mappings.add_slot('_xappy', 'hash')
+            self._config_modified = True
+
+    def set_deferred_spelling(self, deferred=True):
+        """Set whether spelling data is added as documents are indexed.
+
+        Fields indexed with INDEX_FREETEXT with the `spell` parameter set
+        normally add each word to the spelling table of the index as they are
+        indexed, which slows indexing considerably.  When spelling is
+        deferred, no spelling data is written for documents added or replaced
+        by this connection; instead, build_spelling() should be called when
+        indexing has finished, to build the spelling table from the terms in
+        the index in a single pass.
+
+        This setting isn't stored in the index, so must be enabled on each new
+        connection.
+
+        """
+        if self._index is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+        self._defer_spelling = bool(deferred)
+
+    def set_image_signatures(self, cachepath=None, processes=None):
+        """Set how the image signatures for IMGSEEK fields are computed.
+
+        By default, the image for each IMGSEEK field is read and decoded when
+        the field is processed.  This allows the signatures to be computed in
+        a pool of processes instead, ahead of the documents being written,
+        and to be kept in a cache.
+
+         - `cachepath` is the path of a directory to keep a cache of
+           signatures in (see `imgsigs.ImgSigCache`).  The cache is keyed by
+           the contents of the image files, so reindexing an unchanged image
+           doesn't decode it again, even if its filename has changed.  If
+           None, no cache is used.
+         - `processes` is the number of processes to compute signatures in
+           (by default, the number of CPUs).  Images are prefetched for the
+           documents passed to add_many() and replace_many() when the
+           documents are processed in this process (ie, with `processes` set
+           to 1); when they're processed in a ProcessorPool with several
+           workers, the workers compute the signatures, using the cache.  The
+           processes are only started when images are first prefetched.
+
+        Calling this with `processes` set to 0 and no `cachepath` restores
+        the default.  The setting isn't stored in the index.
+
+        """
+        if self._index is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+        if self._imgsigs is not None:
+            self._imgsigs.close()
+            self._imgsigs = None
+        if cachepath is not None or processes != 0:
+            self._imgsigs = imgsigs.ImgSigPrefetcher(cachepath, processes)
+
+    def _get_imgseek_fields(self):
+        """Get the set of names of fields which have the IMGSEEK action.
+
+        """
+        return frozenset(
+            fieldname
+            for fieldname, actions in self._field_actions.actions.iteritems()
+            if FieldActions.IMGSEEK in actions._actions)
+
+    def build_spelling(self, fields=None, min_freq=1, clear=True):
+        """Build the spelling table from the terms in the index.
+
+        The words indexed for each field (using the field-specific terms, so
+        fields indexed with `allow_field_specific` set to False can't be
+        used) are added to the spelling table, with their frequencies set to
+        the number of documents the word occurs in.
+
+         - `fields` is a sequence of the fieldnames to use.  If None, all
+           fields indexed with INDEX_FREETEXT with the `spell` parameter set
+           are used.
+         - `min_freq` is the minimum number of documents a word must occur in
+           for it to be added.  Setting this to 2 or more excludes most
+           misspellings in the indexed text.
+         - `clear` is True to remove the existing contents of the spelling
+           table first, so that the table is rebuilt from scratch.
+
+        Returns the number of words added to the spelling table.  As for
+        other changes, the new spelling table isn't visible to searchers
+        until after the next flush.
+
+        """
+        index = self._index
+        if index is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+
+        # The stopwords, and whether the spell parameter is set, for each
+        # free text field.
+        freetext = {}
+        for fieldname, actions in self._field_actions.actions.iteritems():
+            for kwargs in actions._actions.get(FieldActions.INDEX_FREETEXT,
+                                               ()):
+                freetext[fieldname] = (kwargs.get('stop'),
+                                       kwargs.get('spell', False))
+        if fields is None:
+            fields = [fieldname for fieldname, (stop, spell)
+                      in freetext.iteritems() if spell]
+
+        if clear:
+            for item in list(index.spellings()):
+                index.remove_spelling(item.term, item.termfreq)
+
+        freqs = {}
+        for fieldname in fields:
+            try:
+                prefix = self._field_mappings.get_prefix(fieldname)
+            except KeyError:
+                raise errors.IndexerError("Field %r is not indexed" %
+                                          fieldname)
+            stop = frozenset(freetext.get(fieldname, (None,))[0] or ())
+            termiter = index.allterms()
+            for item in _PrefixedTermItemIter(prefix, termiter):
+                word = item.term[len(prefix):]
+                if word in stop:
+                    continue
+                freqs[word] = freqs.get(word, 0) + item.termfreq
+
+        count = 0
+        for word, freq in freqs.iteritems():
+            if freq >= min_freq:
+                index.add_spelling(word, freq)
+                count += 1
+        return count
+
+    def _calc_hash(self, document, xapdoc):
+        """Calculate the hash of a document, for storing in the hash slot.
+
+        Any hash already present in the document (eg, if it was read from the
+        database) is removed first, so that it doesn't affect the result.
+
+        """
+        if xapdoc.get_value(self._hash_slot):
+            xapdoc.remove_value(self._hash_slot)
+        return document.calc_hash()
+
+    def _write_hashed(self, write, xapdoc, hash):
+        """Write a document with a hash stored in the hash slot.
+
+        The hash is removed from the document again afterwards, so that the
+        caller's document is unchanged.
+
+        """
+        xapdoc.add_value(self._hash_slot, hash)
+        try:
+            write(xapdoc)
+        finally:
+            xapdoc.remove_value(self._hash_slot)
+
+    def _note_written(self, xapdoc):
+        """Note that a document has been written, and flush if needed.
+
+        """
+        stats = self._indexing_stats
+        stats.docs_written += 1
+        stats.docs_since_flush += 1
+        if (self._flush_policy is not None and
+            self._flush_policy.should_flush(stats, xapdoc)):
+            self.flush()
 
     def _store_config(self):
         """Store the configuration for the database.
@@ -171,6 +631,7 @@ class IndexerConnection(object):
         """
         assert self._index is not None
 
+        self._next_docid = self._id_allocator.next_docid
         config_str = cPickle.dumps((
                                      self._field_actions.actions,
                                      self._field_mappings.serialise(),
@@ -215,6 +676,7 @@ class IndexerConnection(object):
             self._field_actions.actions = actions
             self._facet_hierarchy = {}
             self._facet_query_table = {}
+        self._field_actions._set_profile(self._profile)
         self._field_mappings = fieldmappings.FieldMappings(mappings)
 
         self._config_modified = False
@@ -238,6 +700,7 @@ class IndexerConnection(object):
             actions = FieldActions(fieldname)
             self._field_actions[fieldname] = actions
         actions.add(self._field_mappings, fieldtype, **kwargs)
+        self._field_actions.invalidate(fieldname)
         self._config_modified = True
 
     def clear_field_actions(self, fieldname):
@@ -289,34 +752,19 @@ class IndexerConnection(object):
         """
         if self._index is None:
             raise errors.IndexerError("IndexerConnection has been closed")
+        profile = self._profile
+        if profile is not None:
+            started = profile.start()
         result = ProcessedDocument(self._field_mappings)
         result.id = document.id
-        context = ActionContext(self)
+        context = ActionContext(self, defer_spelling=self._defer_spelling)
 
         self._field_actions.perform(result, document, context, store_only)
 
+        if profile is not None:
+            profile.stop('process', started)
         return result
 
-    def _get_bytes_used_by_doc_terms(self, xapdoc):
-        """Get an estimate of the bytes used by the terms in a document.
-
-        (This is a very rough estimate.)
-
-        """
-        count = 0
-        for item in xapdoc.termlist():
-            # The term may also be stored in the spelling correction table, so
-            # double the amount used.
-            count += len(item.term) * 2
-
-            # Add a few more bytes for holding the wdf, and other bits and
-            # pieces.
-            count += 8
-
-        # Empirical observations indicate that about 5 times as much memory as
-        # the above calculation predicts is used for buffering in practice.
-        return count * 5
-
     def add(self, document, store_only=False):
         """Add a new document to the search engine index.
 
@@ -334,33 +782,51 @@ class IndexerConnection(object):
         indexed for searching. See process() method for more info about this
         argument.
 
+        If a background commit is in progress (see set_background_commit()),
+        the document is processed immediately, but only added to the database
+        when the commit has finished.  In this case, any error from adding the
+        document (such as a DuplicatedIdError) is raised later, by the call
+        which applies the queued changes.
+
         """
-        if self._index is None:
+        if self._db is None:
             raise errors.IndexerError("IndexerConnection has been closed")
+        if self._commit_in_progress():
+            return self._queue_write(self.add, document, store_only)
         if not hasattr(document, '_doc'):
             # It's not a processed document.
             document = self.process(document, store_only)
+        profile = self._profile
+        if profile is not None:
+            started = profile.start()
 
         # Ensure that we have a id
         orig_id = document.id
         if orig_id is None:
-            id, self._next_docid = _allocate_id(self._index,
-                                                self._next_docid)
-            self._config_modified = True
+            id = self._id_allocator.allocate()
             document.id = id
         else:
             id = orig_id
             if self._index.term_exists('Q' + id):
                 raise errors.DuplicatedIdError("Document ID of document supplied to add() is not unique.")
+            self._id_allocator.note_id(id)
+        if profile is not None:
+            started = profile.stop('allocate_id', started)
 
         # Add the document.
+        blobs = self._take_blobs(document, id)
         xapdoc = document.prepare()
-        self._index.add_document(xapdoc)
-
-        if self._max_mem is not None:
-            self._mem_buffered += self._get_bytes_used_by_doc_terms(xapdoc)
-            if self._mem_buffered > self._max_mem:
-                self.flush()
+        if profile is not None:
+            started = profile.stop('prepare', started)
+        if self._hash_slot is None:
+            self._index.add_document(xapdoc)
+        else:
+            self._write_hashed(self._index.add_document, xapdoc,
+                               self._calc_hash(document, xapdoc))
+        self._store_blobs(blobs)
+        if profile is not None:
+            profile.stop('write', started)
+        self._note_written(xapdoc)
 
         if id is not orig_id:
             document.id = orig_id
@@ -383,9 +849,24 @@ class IndexerConnection(object):
         the Xapian document ID to replace.  In this case, the Xappy document ID
         will be not be checked.
 
+        If set_skip_unchanged() has been enabled, and the existing document
+        has the same contents as the new one, nothing is written.
+
+        If a background commit is in progress, the document is queued as for
+        add().
+
         """
-        if self._index is None:
+        if self._db is None:
             raise errors.IndexerError("IndexerConnection has been closed")
+        if self._commit_in_progress():
+            if document.id is None and xapid is None:
+                raise errors.IndexerError("No document ID set for document supplied to replace().")
+            self._queue_write(self.replace, document, store_only, xapid)
+            return
+
+        profile = self._profile
+        if profile is not None:
+            started = profile.start()
 
         # Ensure that we have a id
         id = document.id
@@ -393,30 +874,228 @@ class IndexerConnection(object):
             if xapid is None:
                 raise errors.IndexerError("No document ID set for document supplied to replace().")
             else:
-                id, self._next_docid = _allocate_id(self._index,
-                                                    self._next_docid)
-                self._config_modified = True
+                id = self._id_allocator.allocate()
                 document.id = id
+        else:
+            self._id_allocator.note_id(id)
+        if profile is not None:
+            profile.stop('allocate_id', started)
 
         # Process the document if we havn't already.
         if not hasattr(document, '_doc'):
             # It's not a processed document.
             document = self.process(document, store_only)
 
+        if profile is not None:
+            started = profile.start()
+        blobs = self._take_blobs(document, id)
         xapdoc = document.prepare()
 
+        hash = None
+        if self._hash_slot is not None:
+            hash = self._calc_hash(document, xapdoc)
+            olddoc, _ = self._get_xapdoc(id, xapid)
+            if (olddoc is not None and
+                olddoc.get_value(self._hash_slot) == hash):
+                self._indexing_stats.docs_skipped += 1
+                if profile is not None:
+                    profile.stop('prepare', started)
+                return
+        if profile is not None:
+            started = profile.stop('prepare', started)
+
         if self._index.get_metadata('_xappy_hascache'):
             self._replace_cached_item(xapdoc, id, xapid, store_only)
+            if profile is not None:
+                started = profile.stop('replace_cached', started)
+
+        old_blob_keys = ()
+        if self._index.get_metadata('_xappy_hasblobs'):
+            old_blob_keys = self._get_blob_keys(id, xapid)
 
         if xapid is None:
-            self._index.replace_document('Q' + id, xapdoc)
+            write = lambda doc: self._index.replace_document('Q' + id, doc)
         else:
-            self._index.replace_document(int(xapid), xapdoc)
+            write = lambda doc: self._index.replace_document(int(xapid), doc)
+        if hash is None:
+            write(xapdoc)
+        else:
+            self._write_hashed(write, xapdoc, hash)
+        self._store_blobs(blobs, old_blob_keys, document)
+        if profile is not None:
+            profile.stop('write', started)
+        self._note_written(xapdoc)
+
+    def update_fields(self, id, fields, xapid=None):
+        """Change the contents of some fields of a document in the index.
+
+        `fields` is a dictionary, keyed by fieldname, of the new values for
+        each field to change.  Each entry may be a single value, or a sequence
+        of values (which may be empty, to remove the field from the document).
+        Values may also be Field objects, to supply a weight or an associated
+        value.  The new values are not placed in any field group.
+
+        Only the terms, values and stored data belonging to the changed fields
+        are removed from the stored document, and only the actions for those
+        fields are performed, so this is much cheaper than replace() for
+        documents with lots of text.  However, it can't be used for fields
+        whose terms can't be distinguished from those of other fields: these
+        are fields indexed with INDEX_FREETEXT (unless `search_by_default` is
+        False), and fields indexed with IMGSEEK (unless `terms` is False).
+        Such fields must be changed by replacing the whole document.
+
+        The document to change is specified by `id`, or by the xapian document
+        ID `xapid`, as for replace().  An error is raised if the document
+        doesn't exist.
+
+        If a background commit is in progress, the change is queued until the
+        commit has finished.
 
-        if self._max_mem is not None:
-            self._mem_buffered += self._get_bytes_used_by_doc_terms(xapdoc)
-            if self._mem_buffered > self._max_mem:
-                self.flush()
+        """
+        if self._db is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+        if self._commit_in_progress():
+            self._queued.append((self.update_fields, (id, fields, xapid),
+                                 None))
+            return
+
+        prefixes = set()
+        slots = set()
+        newdoc = UnprocessedDocument()
+        for fieldname, values in fields.iteritems():
+            try:
+                actions = self._field_actions[fieldname]
+            except KeyError:
+                raise errors.IndexerError("Field %r has no actions" %
+                                          fieldname)
+            fieldprefixes = actions._get_term_prefixes(self._field_mappings)
+            if fieldprefixes is None:
+                raise errors.IndexerError("Field %r can't be updated without "
+                                          "reprocessing the whole document - "
+                                          "use replace() instead" % fieldname)
+            prefixes.update(fieldprefixes)
+            slots.update(self._field_mappings.get_slots(fieldname))
+
+            if isinstance(values, (basestring, Field)):
+                values = (values,)
+            for value in values:
+                if not isinstance(value, Field):
+                    value = Field(fieldname, value)
+                elif value.name != fieldname:
+                    raise errors.IndexerError("Field %r supplied as a new "
+                                              "value for field %r" %
+                                              (value.name, fieldname))
+                newdoc.fields.append(value)
+
+        xapdoc, xapid = self._get_xapdoc(id, xapid)
+        if xapdoc is None:
+            raise errors.IndexerError("No document with ID %r in the index" %
+                                      id)
+        document = ProcessedDocument(self._field_mappings, xapdoc)
+
+        # Remove everything generated for the old contents of the fields.
+        for term in [item.term for item in xapdoc.termlist()]:
+            if _term_prefix(term) in prefixes:
+                xapdoc.remove_term(term)
+        for slot in slots:
+            xapdoc.remove_value(slot)
+        document._remove_fields(fields.keys())
+
+        context = ActionContext(self, defer_spelling=self._defer_spelling)
+        self._field_actions.perform(document, newdoc, context)
+        self.replace(document, xapid=xapid)
+
+    def _get_processing_config(self):
+        """Get the configuration needed to process documents.
+
+        This is returned as a pickled string, suitable for passing to worker
+        processes (see the `parallel` module).
+
+        """
+        return cPickle.dumps((self._field_actions.actions,
+                              self._field_mappings.serialise()), 2)
+
+    def _process_many(self, documents, store_only, processes, pool):
+        """Process a sequence of documents, possibly in parallel.
+
+        Returns an iterator over (processed document, spellings) pairs, and
+        the pool which is being used (which the caller must close if it wasn't
+        supplied by the caller).
+
+        """
+        import parallel
+        ownpool = None
+        if pool is None:
+            pool = ownpool = parallel.ProcessorPool(self, processes)
+        else:
+            pool._check_config(self)
+        if self._imgsigs is not None and pool._pool is None:
+            documents = self._imgsigs.lookahead(documents,
+                                                self._get_imgseek_fields())
+        return pool.imap(documents, store_only), ownpool
+
+    def _add_spellings(self, spellings):
+        """Add a list of (word, frequency) pairs to the spelling table.
+
+        """
+        if self._defer_spelling:
+            return
+        for word, freq in spellings:
+            self._index.add_spelling(word, freq)
+
+    def add_many(self, documents, store_only=False, processes=None, pool=None):
+        """Add a sequence of new documents to the search engine index.
+
+        This has the same effect as calling add() for each document in turn,
+        but the processing of UnprocessedDocuments is performed in a pool of
+        worker processes, so can make use of multiple CPUs.  The documents are
+        added to the database in the order in which they are supplied.
+
+        `documents` may be any iterable; it is consumed incrementally, and the
+        number of documents held in memory at once is bounded.
+
+        `processes` is the number of worker processes to use (by default, the
+        number of CPUs).  Alternatively, an existing `parallel.ProcessorPool`
+        may be supplied as `pool`, to avoid the cost of starting the worker
+        processes for each call.
+
+        Returns a list of the ids of the added documents.
+
+        """
+        if self._index is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+        results, ownpool = self._process_many(documents, store_only,
+                                              processes, pool)
+        try:
+            ids = []
+            for document, spellings in results:
+                self._add_spellings(spellings)
+                ids.append(self.add(document, store_only))
+            return ids
+        finally:
+            if ownpool is not None:
+                ownpool.terminate()
+
+    def replace_many(self, documents, store_only=False, processes=None,
+                     pool=None):
+        """Replace a sequence of documents in the search engine index.
+
+        This has the same effect as calling replace() for each document in
+        turn, but the processing is performed in a pool of worker processes,
+        as for add_many().
+
+        """
+        if self._index is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+        results, ownpool = self._process_many(documents, store_only,
+                                              processes, pool)
+        try:
+            for document, spellings in results:
+                self._add_spellings(spellings)
+                self.replace(document, store_only)
+        finally:
+            if ownpool is not None:
+                ownpool.terminate()
 
     def _replace_cached_item(self, newdoc, id, xapid, store_only):
         if store_only:
@@ -429,6 +1108,73 @@ class IndexerConnection(object):
             if olddoc is not None:
                 self.cache_manager.replace(olddoc, newdoc)
 
+    def _get_blob(self, key):
+        """Get the contents of a blob holding a field stored out-of-line.
+
+        Blobs are kept in the metadata of the index.  Subclasses may override
+        this method, and _set_blob(), to keep them elsewhere.
+
+        """
+        return self._index.get_metadata(key)
+
+    def _get_blob_loader(self, xapid):
+        """Get the function used to read the blobs of a document.
+
+        `xapid` is the xapian document ID of the document.  The function
+        returned is passed the key of a blob, and returns its contents.
+
+        """
+        return self._get_blob
+
+    def _set_blob(self, key, contents):
+        """Set the contents of a blob holding a field stored out-of-line.
+
+        If `contents` is empty, the blob should be removed.
+
+        """
+        self._index.set_metadata(key, contents)
+
+    def _take_blobs(self, document, id):
+        """Get the blobs to store for the fields of a document which are
+        stored out-of-line.
+
+        This must be called before the document is prepared.
+
+        """
+        fields = self._field_actions._get_out_of_line_fields()
+        if len(fields) == 0:
+            return {}
+        return document._take_blobs(fields, id)
+
+    def _get_blob_keys(self, docid=None, xapid=None):
+        """Get the keys of the blobs referred to by a document in the index.
+
+        """
+        xapdoc, _ = self._get_xapdoc(docid, xapid)
+        if xapdoc is None:
+            return ()
+        return ProcessedDocument(self._field_mappings,
+                                 xapdoc)._get_blob_keys()
+
+    def _store_blobs(self, blobs, old_keys=(), document=None):
+        """Store the blobs for a document which has been written.
+
+        Any blobs in `old_keys` (the blobs referred to by the document which
+        was replaced) which are no longer referred to by `document` are
+        removed.
+
+        """
+        if len(blobs) != 0:
+            for key, contents in blobs.iteritems():
+                self._set_blob(key, contents)
+            if not self._index.get_metadata('_xappy_hasblobs'):
+                self._index.set_metadata('_xappy_hasblobs', '1')
+        if len(old_keys) != 0:
+            keys = frozenset(document._get_blob_keys())
+            for key in old_keys:
+                if key not in keys:
+                    self._set_blob(key, '')
+
     def _make_synonym_key(self, original, field):
         """Make a synonym key (ie, the term or group of terms to store in
         xapian).
@@ -673,14 +1419,25 @@ class IndexerConnection(object):
         the Xapian document ID to delete.  In this case, the Xappy document ID
         will be not be checked.
 
+        If a background commit is in progress, the deletion is queued until
+        the commit has finished.
+
         """
-        if self._index is None:
+        if self._db is None:
             raise errors.IndexerError("IndexerConnection has been closed")
+        if self._commit_in_progress():
+            self._queued.append((self.delete, (id, xapid), None))
+            return
 
         # Remove any cached items from the cache.
         if self._index.get_metadata('_xappy_hascache'):
             self._remove_cached_items(id, xapid)
 
+        # Remove any blobs for fields stored out-of-line.
+        if self._index.get_metadata('_xappy_hasblobs'):
+            for key in self._get_blob_keys(id, xapid):
+                self._set_blob(key, '')
+
         # Now, remove the actual document.
         if xapid is None:
             assert id is not None
@@ -688,6 +1445,72 @@ class IndexerConnection(object):
         else:
             self._index.delete_document(int(xapid))
 
+    def delete_matching(self, query, dry_run=False, batch_size=1000):
+        """Delete all the documents matching a query.
+
+        `query` may be a xappy Query (eg, built using a SearchConnection on
+        the same index), or a xapian Query.  The query is run against this
+        connection, so it sees any changes which haven't been flushed yet.
+
+        The matching documents are found in batches of `batch_size`, and
+        deleted by xapian document ID, removing any cached items and
+        out-of-line stored fields for each batch in a single operation.  This
+        is much faster than searching and calling delete() for each result.
+
+        If `dry_run` is True, nothing is deleted.
+
+        Returns the number of documents deleted (or, if `dry_run` is True,
+        the number of documents which match the query).
+
+        """
+        if self._db is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+        if batch_size < 1:
+            raise errors.IndexerError("batch_size must be at least 1")
+        if hasattr(query, '_get_xapian_query'):
+            query = query._get_xapian_query()
+
+        # The index property waits for any background commit to finish.
+        index = self._index
+        enq = xapian.Enquire(index)
+        enq.set_query(query)
+        enq.set_weighting_scheme(xapian.BoolWeight())
+        enq.set_docid_order(xapian.Enquire.ASCENDING)
+        if dry_run:
+            doccount = index.get_doccount()
+            return enq.get_mset(0, 0, doccount).get_matches_estimated()
+
+        hascache = index.get_metadata('_xappy_hascache')
+        if hascache and self.cache_manager is None:
+            raise errors.IndexerError("CacheManager has been applied to this "
+                                      "index, but is not currently set.")
+        hasblobs = index.get_metadata('_xappy_hasblobs')
+
+        deleted = 0
+        while True:
+            # Deleted documents no longer match, so each batch is read from
+            # the start of the results.
+            mset = enq.get_mset(0, batch_size)
+            if len(mset) == 0:
+                break
+            if hascache or hasblobs:
+                docs = [(item.document, item.docid) for item in mset]
+                if hascache:
+                    self.cache_manager.remove_cached_items_many(self, docs)
+                if hasblobs:
+                    for xapdoc, xapid in docs:
+                        keys = ProcessedDocument(self._field_mappings,
+                                                 xapdoc)._get_blob_keys()
+                        for key in keys:
+                            self._set_blob(key, '')
+                xapids = [xapid for xapdoc, xapid in docs]
+            else:
+                xapids = [item.docid for item in mset]
+            for xapid in xapids:
+                index.delete_document(xapid)
+            deleted += len(xapids)
+        return deleted
+
     def set_cache_manager(self, cache_manager):
         """Set the cache manager.
 
@@ -751,16 +1574,148 @@ class IndexerConnection(object):
         If an exception occurs, any changes since the last call to flush() may
         be lost.
 
+        If background commits are enabled (see set_background_commit()), this
+        starts the commit, and returns without waiting for it to finish.  If a
+        previous background commit is still in progress, this waits for it
+        first.
+
         """
         if self._index is None:
             raise errors.IndexerError("IndexerConnection has been closed")
         if self._config_modified:
             self._store_config()
-        self._index.flush()
-        self._mem_buffered = 0
+        self._id_allocator.save()
+        rss_before = memutils.get_rss()
+        if self._background_commit:
+            # Make sure nothing needs to read the database to allocate IDs
+            # while the commit is in progress.
+            self._id_allocator._get_watermark()
+            # The cache manager may use the same database, so must be flushed
+            # before the commit starts.
+            if self.cache_manager is not None:
+                self.cache_manager.flush()
+            self._committer = _BackgroundCommit(self._db, rss_before)
+            return
+        started = time.time()
+        if self._profile is not None:
+            profile_started = self._profile.start()
+        self._db.flush()
+        if self._profile is not None:
+            self._profile.stop('flush', profile_started)
+        self._note_flush(started, time.time(), rss_before)
         if self.cache_manager is not None:
             self.cache_manager.flush()
 
+    def _note_flush(self, started, finished, rss_before):
+        """Update the statistics and flush policy after a flush.
+
+        """
+        self._indexing_stats._note_flush(started, finished, rss_before)
+        if self._flush_policy is not None:
+            self._flush_policy.reset(self._indexing_stats)
+
+    def set_background_commit(self, background=True):
+        """Set whether flushes should commit in a background thread.
+
+        When this is enabled, flush() (including flushes performed
+        automatically by the flush policy) starts the commit in a separate
+        thread, and returns immediately.  While the commit is in progress,
+        documents passed to add(), replace() and their variants are processed
+        as usual, but are queued in memory, and written to the database when
+        the commit has finished.  This allows the processing of the next batch
+        of documents to continue while the previous batch is committed.
+
+        Any other use of the database (eg, get_document(), or changing the
+        configuration) waits for the commit to finish, and writes the queued
+        documents, first.  wait_for_commit() may be called to do this
+        explicitly, and close() always waits for the final commit.
+
+        If the commit fails, the error is raised by the next call which waits
+        for it.  Note that iterators returned by the connection must not be
+        used while a background commit is in progress.
+
+        """
+        if self._index is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+        self._background_commit = background
+
+    def wait_for_commit(self):
+        """Wait for any background commit to finish.
+
+        Any changes queued while the commit was in progress are then written to
+        the database.  If the commit failed, the exception which it raised is
+        raised here; the queued changes are kept, and will be written when the
+        connection is next used.
+
+        """
+        if self._db is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+        while self._committer is not None or len(self._queued) != 0:
+            committer = self._committer
+            if committer is not None:
+                self._committer = None
+                committer.wait()
+                if self._profile is not None:
+                    # The commit ran in another thread, so the processor
+                    # time used by it can't be measured.
+                    self._profile.add('background_commit',
+                                      committer.finished - committer.started,
+                                      0.0)
+                self._note_flush(committer.started, committer.finished,
+                                 committer.rss_before)
+            queued, self._queued = self._queued, []
+            for num, (method, args, spellings) in enumerate(queued):
+                try:
+                    if spellings:
+                        self._add_spellings(spellings)
+                    method(*args)
+                except:
+                    self._queued = queued[num + 1:] + self._queued
+                    raise
+
+    def _commit_in_progress(self):
+        """Check if a background commit is still running.
+
+        """
+        return self._committer is not None and not self._committer.done()
+
+    def _queue_write(self, method, document, store_only, *args):
+        """Queue a document to be written when the background commit ends.
+
+        The document is processed immediately.  Returns the ID of the
+        document.
+
+        """
+        spellings = []
+        if hasattr(document, '_doc'):
+            # Take a copy, in case the caller modifies the document.
+            document.prepare()
+            document = ProcessedDocument._from_transport_state(
+                self._field_mappings, document._get_transport_state())
+        else:
+            result = ProcessedDocument(self._field_mappings)
+            result.id = document.id
+            context = ActionContext(self, readonly=True, spellings=spellings,
+                                    defer_spelling=self._defer_spelling)
+            self._field_actions.perform(result, document, context,
+                                        store_only)
+            document = result
+
+        id = document.id
+        if id is None:
+            id = self._id_allocator.allocate_without_index()
+            if id is None:
+                # Need to wait for the commit to allocate an ID.
+                self.wait_for_commit()
+                self._add_spellings(spellings)
+                return method(document, store_only, *args)
+            document.id = id
+        else:
+            self._id_allocator.note_id(id)
+        self._queued.append((method, (document, store_only) + args,
+                             spellings))
+        return id
+
     def close(self):
         """Close the connection to the database.
 
@@ -777,12 +1732,18 @@ class IndexerConnection(object):
         the last call to flush may be lost.
 
         """
-        if self._index is None:
+        if self._db is None:
             return
         try:
-            self.flush()
             try:
-                self._index.close()
+                self.flush()
+                self.wait_for_commit()
+            finally:
+                # Don't close the database while a commit is in progress.
+                if self._committer is not None:
+                    self._committer._thread.join()
+            try:
+                self._db.close()
             except AttributeError:
                 # Xapian versions earlier than 1.1.0 didn't have a close()
                 # method, so we just had to rely on the garbage collector to
@@ -794,10 +1755,16 @@ class IndexerConnection(object):
                 pass
         finally:
             self._index = None
+            self._committer = None
+            self._queued = []
             self._indexpath = None
             self._field_actions = None
             self._field_mappings = None
+            self._id_allocator = None
             self._config_modified = False
+            if self._imgsigs is not None:
+                self._imgsigs.close()
+                self._imgsigs = None
 
         if self.cache_manager is not None:
             self.cache_manager.close()
@@ -824,12 +1791,16 @@ class IndexerConnection(object):
             raise errors.IndexerError("IndexerConnection has been closed")
         return PrefixedTermIter('Q', self._index.allterms())
 
-    def get_document(self, id):
+    def get_document(self, id, fields=None):
         """Get the document with the specified unique ID.
 
         Raises a KeyError if there is no such document.  Otherwise, it returns
         a ProcessedDocument.
 
+        If `fields` is not None, it is a sequence of fieldnames, and only the
+        stored data for these fields will be returned in the `data` property
+        of the document (see SearchConnection.get_document()).
+
         """
         if self._index is None:
             raise errors.IndexerError("IndexerConnection has been closed")
@@ -850,6 +1821,7 @@ class IndexerConnection(object):
         result = ProcessedDocument(self._field_mappings)
         result.id = id
         result._doc = self._index.get_document(plitem.docid)
+        result._set_projection(fields, self._get_blob_loader(plitem.docid))
         return result
 
     def iter_synonyms(self, prefix=""):
@@ -985,20 +1957,58 @@ class PrefixedTermIter(object):
             return term[self._prefixlen + 1 + self._trimlen:]
         return term[self._prefixlen + self._trimlen:]
 
+class _PrefixedTermItemIter(object):
+    """Iterate through the items for all the unstemmed free text terms with a
+    given prefix.
+
+    Terms whose prefix is longer (ie, which have another capital letter after
+    `prefix`) are skipped, as are terms with a ':' after the prefix, which
+    aren't generated by free text indexing.
+
+    """
+    def __init__(self, prefix, termiter):
+        self._prefix = prefix
+        self._prefixlen = len(prefix)
+        self._termiter = termiter
+        self._started = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        prefix = self._prefix
+        prefixlen = self._prefixlen
+        while True:
+            if not self._started:
+                item = self._termiter.skip_to(prefix)
+                self._started = True
+            else:
+                item = self._termiter.next()
+            term = item.term
+            if term[:prefixlen] != prefix:
+                raise StopIteration
+            if len(term) > prefixlen:
+                ch = term[prefixlen]
+                if ch != ':' and not ('A' <= ch <= 'Z'):
+                    return item
+
 class DocumentIter(object):
     """Iterate through all the documents returned by a postlist.
 
     """
-    def __init__(self, connection, postingiter):
+    def __init__(self, connection, postingiter, fields=None):
         """Initialise the prefixed term iterator.
 
         - `connection` is the connection being iterated.
         - `postingiter` is a xapian PostingIterator, which should be at its start.
+        - `fields` is the list of fields to return the data for (or None to
+          return all fields except those stored out-of-line).
 
         """
 
         self._connection = connection
         self._postingiter = postingiter
+        self._fields = fields
 
     def __iter__(self):
         return self
@@ -1010,6 +2020,8 @@ class DocumentIter(object):
         posting = self._postingiter.next()
         result = ProcessedDocument(self._connection._field_mappings)
         result._doc = self._connection._index.get_document(posting.docid)
+        result._set_projection(self._fields,
+            self._connection._get_blob_loader(posting.docid))
         return result
 
 class SynonymIter(object):
@@ -0,0 +1,170 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""lru.py: A least-recently-used cache.
+
+"""
+__docformat__ = "restructuredtext en"
+
+# Indices of the fields of the entries in the linked list.
+_PREV, _NEXT, _KEY, _VALUE, _SIZE = 0, 1, 2, 3, 4
+
+class LRUCache(object):
+    """A mapping which holds a limited number of items.
+
+    When the cache is full, storing a new item discards the item which was
+    least recently stored or looked up.  The number of lookups which found,
+    or failed to find, an item are counted in the `hits` and `misses`
+    attributes.
+
+    If `max_size` is not None, each item is stored with a size (usually an
+    estimate of the number of bytes it uses), and items are also discarded
+    to keep the total size of the items no more than `max_size`.
+
+    """
+    def __init__(self, max_items, max_size=None):
+        if max_items < 1:
+            raise ValueError("max_items must be at least 1")
+        self.max_items = max_items
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        """Remove all the items from the cache.
+
+        The hit and miss counts are not reset.
+
+        """
+        # Entries are held in a circular doubly linked list, with the most
+        # recently used entry immediately after the root.
+        self._root = root = [None, None, None, None, 0]
+        root[_PREV] = root[_NEXT] = root
+        self._entries = {}
+        self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _unlink(self, entry):
+        entry[_PREV][_NEXT] = entry[_NEXT]
+        entry[_NEXT][_PREV] = entry[_PREV]
+
+    def _link_first(self, entry):
+        root = self._root
+        entry[_PREV] = root
+        entry[_NEXT] = root[_NEXT]
+        root[_NEXT][_PREV] = entry
+        root[_NEXT] = entry
+
+    def get(self, key, default=None, count=True):
+        """Get an item from the cache, marking it as recently used.
+
+        Returns `default` if the item isn't in the cache.  If `count` is
+        False, the lookup isn't counted as a hit or miss; the caller should
+        then count it with note_hit() or note_miss() once it knows whether
+        the item was usable.
+
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            if count:
+                self.misses += 1
+            return default
+        if count:
+            self.hits += 1
+        self._unlink(entry)
+        self._link_first(entry)
+        return entry[_VALUE]
+
+    def note_hit(self):
+        """Count a lookup made with `count` set to False as a hit.
+
+        """
+        self.hits += 1
+
+    def note_miss(self):
+        """Count a lookup made with `count` set to False as a miss.
+
+        """
+        self.misses += 1
+
+    def set_max_items(self, max_items):
+        """Change the maximum number of items held in the cache.
+
+        If the cache holds more than `max_items` items, the least recently
+        used are discarded.
+
+        """
+        if max_items < 1:
+            raise ValueError("max_items must be at least 1")
+        self.max_items = max_items
+        while len(self._entries) > max_items:
+            self._discard_last()
+
+    def set(self, key, value, size=0):
+        """Store an item in the cache, discarding old items if necessary.
+
+        `size` is the size of the item.  If this is more than `max_size`, the
+        item isn't stored (and any existing item with the same key is
+        removed).
+
+        """
+        self.remove(key)
+        if self.max_size is not None and size > self.max_size:
+            return
+        while len(self._entries) >= self.max_items or \
+              (self.max_size is not None and
+               self.size + size > self.max_size):
+            self._discard_last()
+        entry = [None, None, key, value, size]
+        self._entries[key] = entry
+        self.size += size
+        self._link_first(entry)
+
+    def remove(self, key):
+        """Remove an item from the cache, if it is present.
+
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._unlink(entry)
+            self.size -= entry[_SIZE]
+
+    def _discard_last(self):
+        """Discard the least recently used item.
+
+        """
+        entry = self._root[_PREV]
+        self._unlink(entry)
+        del self._entries[entry[_KEY]]
+        self.size -= entry[_SIZE]
+        return entry
+
+    def get_stats(self):
+        """Get a dictionary of statistics about the use of the cache.
+
+        """
+        return {'items': len(self._entries), 'max_items': self.max_items,
+                'size': self.size, 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses}
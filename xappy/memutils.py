@@ -89,3 +89,28 @@ def get_physical_memory():
     if result is not None:
         return result
     return _get_physical_mem_win32()
+
+def get_rss():
+    """Get the resident set size of the current process, in bytes.
+
+    This is currently only implemented for systems with a /proc filesystem
+    (eg, Linux).  If the value can't be obtained, returns None.
+
+    """
+    try:
+        fd = open('/proc/self/statm')
+    except IOError:
+        return None
+    try:
+        try:
+            pages = int(fd.read().split()[1])
+        except (IndexError, ValueError):
+            return None
+    finally:
+        fd.close()
+
+    try:
+        pagesize = os.sysconf('SC_PAGESIZE')
+    except (AttributeError, ValueError):
+        return None
+    return pages * pagesize
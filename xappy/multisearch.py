@@ -0,0 +1,281 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""multisearch.py: Search several indexes together.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import cPickle as _cPickle
+
+import xapian
+import errors
+import fieldmappings
+import result_cache
+from searchconnection import SearchConnection, _unpickle_config
+from sharding import split_xapid
+
+def _merge_configs(configs, paths):
+    """Merge the configurations of several indexes.
+
+    `configs` is a list of the serialised configurations, and `paths` the
+    corresponding index paths (used in error messages).  The fields of the
+    indexes must be compatible: each field must have the same actions, term
+    prefix and value slots in every index which has it, and no prefix or slot
+    may be used for different fields in different indexes.  If they aren't, a
+    SearchError is raised.
+
+    Returns the merged configuration, serialised in the same form.
+
+    """
+    actions = {}
+    prefixes = {}
+    prefix_fields = {}
+    slots = {}
+    slot_fields = {}
+    prefixcount = 0
+    slotcount = 0
+    facet_hierarchy = {}
+    facet_query_table = {}
+    sources = {}
+
+    for config_str, path in zip(configs, paths):
+        if len(config_str) == 0:
+            continue
+        (index_actions, mappings, index_hierarchy, index_query_table,
+         next_docid) = _unpickle_config(config_str)
+        mappings = fieldmappings.FieldMappings(mappings)
+
+        for field, fieldactions in index_actions.iteritems():
+            if field not in actions:
+                actions[field] = fieldactions
+                sources[field] = path
+            elif actions[field]._actions != fieldactions._actions:
+                raise errors.SearchError("Field %r has different actions in "
+                                         "indexes %r and %r" %
+                                         (field, sources[field], path))
+
+        for field, prefix in mappings._prefixes.iteritems():
+            if prefixes.setdefault(field, prefix) != prefix:
+                raise errors.SearchError("Field %r has a different prefix in "
+                                         "index %r" % (field, path))
+            if prefix_fields.setdefault(prefix, field) != field:
+                raise errors.SearchError("Prefix %r is used by fields %r and "
+                                         "%r in index %r" % (prefix,
+                                         prefix_fields[prefix], field, path))
+        prefixcount = max(prefixcount, mappings._prefixcount)
+
+        for key, slot in mappings._slots.iteritems():
+            if slots.setdefault(key, slot) != slot:
+                raise errors.SearchError("Field %r has a different slot for "
+                                         "%r in index %r" %
+                                         (key[0], key[1], path))
+            if slot_fields.setdefault(slot, key) != key:
+                raise errors.SearchError("Slot %d is used by fields %r and "
+                                         "%r in index %r" %
+                                         (slot, slot_fields[slot][0], key[0],
+                                          path))
+        slotcount = max(slotcount, mappings._slotcount)
+
+        for facet, parents in index_hierarchy.iteritems():
+            merged = facet_hierarchy.setdefault(facet, [])
+            for parent in parents:
+                if parent not in merged:
+                    merged.append(parent)
+        for query_type, facets in index_query_table.iteritems():
+            merged = facet_query_table.setdefault(query_type, {})
+            for facet, association in facets.iteritems():
+                merged.setdefault(facet, association)
+
+    mappings = _cPickle.dumps((prefixes, prefixcount, slots, slotcount), 2)
+    return _cPickle.dumps((actions, mappings, facet_hierarchy,
+                           facet_query_table, 0), 2)
+
+class MultiSearchConnection(SearchConnection):
+    """A connection for searching several indexes together.
+
+    The indexes are searched as a single database (using
+    `xapian.Database.add_database()`), so a search is a single match, with
+    statistics such as term frequencies taken across all the indexes.  This
+    supports all the methods of SearchConnection.  The configurations of the
+    indexes are merged, and must be compatible: this is the case if the
+    indexes were created with the same field actions, added in the same order
+    (fields which are only in some of the indexes should be added last).
+
+    Xapian document IDs refer to the combined database: use `get_source()` to
+    find which index a result came from.  Unique IDs need only be unique
+    within each index; if the same ID is used in several indexes,
+    `get_document()` must be called with a `xapid` rather than the ID.
+
+    Indexes with a cache manager can't be searched together.
+
+    """
+    _index_weights = None
+
+    def __init__(self, paths, weights=None, rerank_depth=1000):
+        """Open a connection to the indexes at each of `paths`.
+
+        `weights` and `rerank_depth` are passed to `set_index_weights()`.
+
+        """
+        if isinstance(paths, basestring):
+            paths = [paths]
+        paths = list(paths)
+        if len(paths) == 0:
+            raise errors.SearchError("No indexes to search")
+        self._paths = paths
+        self.cache_manager = None
+        self._indexpath = paths[0]
+        self._close_handlers = []
+        self._subindexes = []
+        self._index = xapian.Database()
+        try:
+            for path in paths:
+                subindex = xapian.Database(path)
+                if subindex.get_metadata('_xappy_hascache'):
+                    raise errors.SearchError("Index %r has a cache manager, "
+                                             "so can't be searched with "
+                                             "other indexes" % path)
+                self._subindexes.append(subindex)
+                self._index.add_database(subindex)
+            self._load_config()
+        except:
+            if hasattr(self._index, 'close'):
+                self._index.close()
+            self._index = None
+            raise
+        self._imgterms_cache = {}
+        self.set_index_weights(weights, rerank_depth)
+
+    def _read_config(self):
+        """Read and merge the configurations of each of the indexes.
+
+        """
+        configs = []
+        for subindex in self._subindexes:
+            while True:
+                try:
+                    configs.append(subindex.get_metadata('_xappy_config'))
+                    break
+                except xapian.DatabaseModifiedError, e:
+                    subindex.reopen()
+        return _merge_configs(configs, self._paths)
+
+    def _get_blob_loader(self, xapid):
+        """Get the function used to read the blobs of a document.
+
+        The blobs are kept in the metadata of the index holding the document,
+        and the same key may be used in other indexes (if they contain a
+        document with the same ID), so they are read from that index.
+
+        """
+        index, _ = split_xapid(xapid, len(self._paths))
+        return self._make_blob_loader(self._subindexes[index])
+
+    def get_index_count(self):
+        """Get the number of indexes being searched.
+
+        """
+        return len(self._paths)
+
+    def get_index_path(self, index):
+        """Get the path of the index with a given number.
+
+        Indexes are numbered from 0, in the order they were passed to the
+        constructor.
+
+        """
+        return self._paths[index]
+
+    def get_source(self, doc):
+        """Find the index which a document or search result came from.
+
+        `doc` is a ProcessedDocument (such as a SearchResult) returned by
+        this connection, or a xapian document ID in the combined database.
+        Returns a tuple of (index number, xapian document ID within the
+        index).
+
+        """
+        if isinstance(doc, (int, long)):
+            xapid = doc
+        else:
+            xapid = doc._doc.get_docid()
+        return split_xapid(xapid, len(self._paths))
+
+    def set_index_weights(self, weights=None, rerank_depth=1000):
+        """Set the relative weights of the indexes.
+
+        `weights` is a sequence of numbers, one for each index, which the
+        weights of documents from that index are multiplied by when ranking
+        results by relevance.  If None, all indexes have equal weight.
+
+        Xapian can't weight the databases in a match differently, so a single
+        match is performed for the top `rerank_depth` results (or down to the
+        end rank requested, if that's further), which are then reordered by
+        their adjusted weights.  A document from a highly weighted index which
+        isn't in the top `rerank_depth` results of the match won't be moved
+        up.  The percentages of results are those from the match.  Searches
+        which are sorted by a field aren't affected by the weights, and the
+        experimental clustering and reordering methods of SearchResults use
+        the results in match order.
+
+        """
+        if weights is not None:
+            weights = map(float, weights)
+            if len(weights) != len(self._paths):
+                raise errors.SearchError("One weight must be given for each "
+                                         "index")
+            if min(weights) < 0:
+                raise errors.SearchError("Index weights must not be "
+                                         "negative")
+            if len(set(weights)) == 1 and weights[0] > 0:
+                # Equal weights don't change the order of the results.
+                weights = None
+        if rerank_depth < 1:
+            raise errors.SearchError("rerank_depth must be at least 1")
+        self._index_weights = weights
+        self._rerank_depth = rerank_depth
+        if self._result_cache is not None:
+            self._result_cache.clear()
+
+    def _index_weight(self, xapid):
+        return self._index_weights[(xapid - 1) % len(self._paths)]
+
+    def _search(self, query, startrank, endrank, fields, checkatleast,
+                sortby, *params):
+        """Perform a search, applying the weights of the indexes.
+
+        """
+        if self._index_weights is None or sortby is not None:
+            return SearchConnection._search(self, query, startrank, endrank,
+                                            fields, checkatleast, sortby,
+                                            *params)
+        depth = max(endrank, self._rerank_depth)
+        results = SearchConnection._search(self, query, 0, depth, fields,
+                                           checkatleast, sortby, *params)
+        collapse = params[0]
+        cached = result_cache.CachedSearch(results, depth,
+                                           collapse is not None)
+        cached.reweight(self._index_weight)
+        def rerun():
+            return SearchConnection._search(self, query, startrank, endrank,
+                                            fields, checkatleast, sortby,
+                                            *params)
+        return cached.make_results(self, query, startrank, endrank, fields,
+                                   rerun)
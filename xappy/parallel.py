@@ -0,0 +1,247 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""parallel.py: Processing of documents in a pool of worker processes.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import collections
+import cPickle
+try:
+    import multiprocessing
+except ImportError:
+    # multiprocessing is only in 2.6 onwards
+    multiprocessing = None
+
+from datastructures import ProcessedDocument
+import errors
+from fieldactions import ActionContext, ActionSet
+import fieldmappings
+import imgsigs
+
+class _ProcessingState(object):
+    """The state needed to process documents, without a database.
+
+    This provides the attributes of a connection which are used by the field
+    actions, so it can be used in place of a connection when making an
+    ActionContext.
+
+    """
+    _index = None
+    _imgsigs = None
+
+    def __init__(self, actions, mappings):
+        self._field_actions = ActionSet()
+        self._field_actions.actions = actions
+        self._field_mappings = fieldmappings.FieldMappings(mappings)
+        self._imgterms_cache = {}
+
+    def process(self, document, store_only):
+        """Process a document, returning a transportable form of the result.
+
+        Returns a 2-tuple containing the transport state of the processed
+        document, and a list of (word, frequency) pairs to add to the spelling
+        table.
+
+        """
+        result = ProcessedDocument(self._field_mappings)
+        result.id = document.id
+        spellings = []
+        context = ActionContext(self, readonly=True, spellings=spellings)
+        self._field_actions.perform(result, document, context, store_only)
+        return result._get_transport_state(), spellings
+
+# The processing state for the current worker process.
+_worker_state = None
+
+def _init_worker(config_str, imgsig_cachepath):
+    """Initialise a worker process, with a copy of the configuration.
+
+    """
+    global _worker_state
+    _worker_state = _ProcessingState(*cPickle.loads(config_str))
+    if imgsig_cachepath is not None:
+        _worker_state._imgsigs = imgsigs.ImgSigCache(imgsig_cachepath)
+
+def _process_chunk(documents, store_only):
+    """Process a list of documents in a worker process.
+
+    """
+    return [_worker_state.process(document, store_only)
+            for document in documents]
+
+class ProcessorPool(object):
+    """A pool of processes for processing documents.
+
+    Each worker process holds a read-only copy of the field configuration of
+    the connection which the pool was created for, taken at the time the pool
+    was created.  If the configuration of the connection is changed after
+    this, a new pool must be created.
+
+    Creating the worker processes is fairly expensive, so if documents are to
+    be added in several batches it's best to create a single pool and pass it
+    to each call to `IndexerConnection.add_many()` or
+    `IndexerConnection.replace_many()`.
+
+    """
+    def __init__(self, conn, processes=None, chunksize=16, max_pending=None):
+        """Create a pool of processes.
+
+         - `conn` is the connection to take the configuration from.
+         - `processes` is the number of worker processes to use.  If None,
+           the number of CPUs in the system is used.  If 1, or if the
+           multiprocessing module is not available, documents are processed
+           in the calling process.
+         - `chunksize` is the number of documents to send to a worker process
+           in each task.
+         - `max_pending` is the maximum number of tasks which may be waiting
+           to be processed, or waiting to be written, at once.  This bounds
+           the memory used for queued documents.  If None, a small multiple of
+           the number of processes is used.
+
+        """
+        self._config = conn._get_processing_config()
+        self._fieldmappings = conn._field_mappings
+        if processes is None:
+            if multiprocessing is None:
+                processes = 1
+            else:
+                processes = multiprocessing.cpu_count()
+        if processes < 1:
+            raise errors.IndexerError("Number of processes must be at "
+                                      "least 1")
+        if chunksize < 1:
+            raise errors.IndexerError("Chunk size must be at least 1")
+        if max_pending is None:
+            max_pending = processes * 4
+        self.processes = processes
+        self.chunksize = chunksize
+        self.max_pending = max(max_pending, 1)
+
+        # The image signature cache or prefetcher of the connection, if any
+        # (see IndexerConnection.set_image_signatures()).
+        conn_imgsigs = getattr(conn, '_imgsigs', None)
+        if processes == 1 or multiprocessing is None:
+            self._pool = None
+            self._state = _ProcessingState(*cPickle.loads(self._config))
+            self._state._imgsigs = conn_imgsigs
+        else:
+            cachepath = None
+            if conn_imgsigs is not None and conn_imgsigs.cache is not None:
+                cachepath = conn_imgsigs.cache.path
+            self._pool = multiprocessing.Pool(processes, _init_worker,
+                                              (self._config, cachepath))
+            self._state = None
+
+    def _check_config(self, conn):
+        """Check that the pool's configuration matches a connection.
+
+        """
+        if conn._get_processing_config() != self._config:
+            raise errors.IndexerError("Configuration of connection has changed "
+                                      "since the processor pool was created")
+
+    def _unpack(self, state, spellings):
+        return (ProcessedDocument._from_transport_state(self._fieldmappings,
+                                                        state),
+                spellings)
+
+    def imap(self, documents, store_only=False):
+        """Process an iterable of documents.
+
+        Returns an iterator which returns a 2-tuple for each document, in the
+        order in which the documents were supplied.  The first item of each
+        tuple is the ProcessedDocument, and the second is a list of (word,
+        frequency) pairs which should be added to the spelling table.
+
+        Documents which are already instances of ProcessedDocument are
+        returned unchanged (with an empty list of spellings).
+
+        """
+        if self._pool is None:
+            for document in documents:
+                if hasattr(document, '_doc'):
+                    yield document, ()
+                else:
+                    yield self._unpack(*self._state.process(document,
+                                                            store_only))
+            return
+
+        # Each item in pending is either an AsyncResult for a chunk of
+        # documents being processed, or a list of up to `chunksize` documents
+        # which were supplied already processed; they're kept in a single
+        # queue so that the order of the documents is preserved.
+        pending = collections.deque()
+        chunk = []
+
+        def submit():
+            pending.append(self._pool.apply_async(_process_chunk,
+                                                  (chunk[:], store_only)))
+            del chunk[:]
+
+        def complete():
+            item = pending.popleft()
+            if isinstance(item, list):
+                return [(doc, ()) for doc in item]
+            return [self._unpack(state, spellings)
+                    for state, spellings in item.get()]
+
+        for document in documents:
+            if hasattr(document, '_doc'):
+                if len(chunk) != 0:
+                    submit()
+                if (len(pending) != 0 and isinstance(pending[-1], list) and
+                    len(pending[-1]) < self.chunksize):
+                    pending[-1].append(document)
+                else:
+                    pending.append([document])
+            else:
+                if not isinstance(document.fields, list):
+                    # Iterators can't be sent to the worker processes.
+                    document.fields = list(document.fields)
+                chunk.append(document)
+                if len(chunk) >= self.chunksize:
+                    submit()
+            while len(pending) >= self.max_pending:
+                for item in complete():
+                    yield item
+        if len(chunk) != 0:
+            submit()
+        while len(pending) != 0:
+            for item in complete():
+                yield item
+
+    def close(self):
+        """Close the pool, shutting down the worker processes.
+
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def terminate(self):
+        """Stop the worker processes immediately.
+
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
@@ -0,0 +1,211 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""profiling.py: Timing the stages of indexing.
+
+An IndexingProfile records the number of calls, and the wall-clock and
+processor time spent, in each stage of indexing performed by an
+IndexerConnection, and in each action performed on each field.  Profiling is
+enabled with `IndexerConnection.set_profiling()`; when it is disabled, the
+only overhead is a check for each document written.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import csv
+import os
+import sys
+import time
+
+if sys.platform == 'win32':
+    # time.clock() returns wall-clock time on Windows.
+    def _cpu_time():
+        return sum(os.times()[:2])
+else:
+    _cpu_time = time.clock
+
+class ProfileEntry(object):
+    """The timings recorded for a stage of indexing, or for an action.
+
+    The following attributes are available:
+
+     - `field`: the name of the field the action was performed on, or None
+       for a stage of indexing.
+     - `name`: the name of the stage or action.
+     - `calls`: the number of times the stage or action was performed.
+     - `wall_time`: the total wall-clock time spent, in seconds.
+     - `cpu_time`: the total processor time spent, in seconds.
+
+    """
+    __slots__ = 'field', 'name', 'calls', 'wall_time', 'cpu_time'
+
+    def __init__(self, field, name):
+        self.field = field
+        self.name = name
+        self.calls = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+
+    @property
+    def mean_wall_time(self):
+        """The average wall-clock time per call, in seconds.
+
+        """
+        if self.calls == 0:
+            return None
+        return self.wall_time / self.calls
+
+    def __repr__(self):
+        return ('<ProfileEntry(field=%r, name=%r, calls=%d, wall_time=%.6f, '
+                'cpu_time=%.6f)>' % (self.field, self.name, self.calls,
+                                     self.wall_time, self.cpu_time))
+
+class IndexingProfile(object):
+    """Timings of the stages of indexing, and of field actions.
+
+    The stages recorded by an IndexerConnection are:
+
+     - `process`: processing an UnprocessedDocument (this includes the time
+       spent in the field actions, which are also recorded separately).
+     - `allocate_id`: allocating or checking the ID of a document.
+     - `prepare`: preparing the processed document to be written (including
+       packing the stored data).
+     - `replace_cached`: copying cached query results for a replaced
+       document.
+     - `write`: adding or replacing the document in the database.
+     - `flush`: flushing changes to disk.
+     - `background_commit`: commits performed in the background (see
+       `IndexerConnection.set_background_commit()`).  Only the wall-clock
+       time of these is recorded.
+
+    Documents processed in other processes (eg, by add_many()) aren't
+    included in the `process` stage or in the timings of the actions.
+
+    """
+    def __init__(self):
+        self.start_time = time.time()
+        # Dictionary of ProfileEntry objects, keyed by (field, name).
+        self._entries = {}
+
+    def start(self):
+        """Start timing something.
+
+        Returns a value to pass to stop().
+
+        """
+        return time.time(), _cpu_time()
+
+    def stop(self, name, started, field=None):
+        """Record the time spent since `started` against a stage or action.
+
+        `started` is a value returned by start() or stop().  Returns a value
+        which may be passed to stop() to time a following stage.
+
+        """
+        now = time.time(), _cpu_time()
+        self.add(name, now[0] - started[0], now[1] - started[1], field)
+        return now
+
+    def add(self, name, wall_time, cpu_time, field=None, calls=1):
+        """Add some timings to the entry for a stage or action.
+
+        """
+        key = (field, name)
+        try:
+            entry = self._entries[key]
+        except KeyError:
+            entry = self._entries[key] = ProfileEntry(field, name)
+        entry.calls += calls
+        entry.wall_time += wall_time
+        entry.cpu_time += cpu_time
+
+    def reset(self):
+        """Discard all the timings recorded so far.
+
+        """
+        self.start_time = time.time()
+        self._entries = {}
+
+    def get_report(self):
+        """Get a list of ProfileEntry objects for the timings recorded.
+
+        The stages of indexing are returned first, followed by the actions,
+        and each are ordered by decreasing wall-clock time.
+
+        """
+        entries = self._entries.values()
+        entries.sort(key=lambda entry: (entry.field is not None,
+                                        -entry.wall_time,
+                                        entry.field, entry.name))
+        return entries
+
+    def format_report(self):
+        """Get the timings recorded, as a string holding a table.
+
+        """
+        lines = ['%-30s %10s %12s %12s' % ('Stage/action', 'Calls',
+                                           'Wall(s)', 'CPU(s)')]
+        for entry in self.get_report():
+            if entry.field is None:
+                label = entry.name
+            else:
+                label = '%s:%s' % (entry.field, entry.name)
+            lines.append('%-30s %10d %12.3f %12.3f' % (label, entry.calls,
+                                                      entry.wall_time,
+                                                      entry.cpu_time))
+        return '\n'.join(lines)
+
+    def write_csv(self, fileobj):
+        """Write the timings recorded to a file, in CSV format.
+
+        `fileobj` may be an open file, or the path of a file to write.  The
+        first row holds the column headings.
+
+        """
+        if isinstance(fileobj, basestring):
+            fd = open(fileobj, 'wb')
+            try:
+                self.write_csv(fd)
+            finally:
+                fd.close()
+            return
+        writer = csv.writer(fileobj)
+        writer.writerow(('Field', 'Stage/Action', 'Calls', 'Wall(seconds)',
+                         'CPU(seconds)'))
+        for entry in self.get_report():
+            writer.writerow((entry.field or '', entry.name, entry.calls,
+                             '%.6f' % entry.wall_time,
+                             '%.6f' % entry.cpu_time))
+
+    def __str__(self):
+        return self.format_report()
+
+def profile_action(profile, fieldname, name, fn):
+    """Wrap a compiled field action so that it records its time.
+
+    """
+    start = profile.start
+    stop = profile.stop
+    def timed_action(doc, field, context):
+        started = start()
+        try:
+            fn(doc, field, context)
+        finally:
+            stop(name, started, fieldname)
+    return timed_action
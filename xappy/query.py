@@ -36,12 +36,15 @@ class Query(object):
     OP_OR = xapian.Query.OP_OR
 
     def __init__(self, query=None, _refs=None, _conn=None, _ranges=None,
-                 _serialised=None, _queryid=None):
+                 _serialised=None, _queryid=None, _portable=True):
         """Create a new query.
 
         If `query` is a xappy.Query, or xapian.Query, object, the new query is
         initialised as a copy of the supplied query.
 
+        `_portable` should be False if the query depends on something which
+        its serialised form doesn't describe (see `_get_portable_repr()`).
+
         """
         # Copy _refs, and make sure it's a list.
         if _refs is None:
@@ -69,6 +72,7 @@ class Query(object):
             self.__conn = _conn
             self.__ranges = _ranges
             self.__serialised = _serialised
+            self.__portable = _portable
             self.__cacheinfo = (_queryid, self)
             self.__search_params = {}
         else:
@@ -81,6 +85,7 @@ class Query(object):
                 self.__serialised = query.__serialised
             else:
                 self.__serialised = _serialised
+            self.__portable = _portable
             self.__cacheinfo = (_queryid, self)
             self.__search_params = copy.deepcopy(query.__search_params)
             self.__merge_params(query)
@@ -132,6 +137,10 @@ class Query(object):
         # Combine the refs
         self.__refs.extend(query.__refs)
 
+        # A query is only portable if all its parts are.
+        if not query.__portable:
+            self.__portable = False
+
         # Combine the ranges
         for range in query.__ranges:
             if range not in self.__ranges:
@@ -490,6 +499,16 @@ class Query(object):
         """
         self.__serialised = serialised
 
+    def _set_portable(self, portable):
+        """Set whether the query's serialised form describes it fully.
+
+        This is intended for internal xappy use, when a query which depends on
+        something its serialised form doesn't describe (such as an
+        ExternalWeightSource) is built (see `_get_portable_repr()`).
+
+        """
+        self.__portable = portable
+
     def _get_queryid(self):
         """Get the queryid if the query is a cached query.
 
@@ -504,6 +523,21 @@ class Query(object):
         """
         return self.__cacheinfo[1]
 
+    def _get_portable_repr(self):
+        """Get a serialised form of the query which doesn't depend on state.
+
+        Returns None if the query has no serialised form, if it was marked
+        as depending on something which its serialised form doesn't describe
+        (such as an ExternalWeightSource), or if the query has been merged
+        with results held by the cache manager.  Otherwise, the serialised
+        form describes the query fully, so can be used to recreate it on
+        another connection to the same database, or as a cache key.
+
+        """
+        if self._get_queryid() is not None or not self.__portable:
+            return None
+        return self.__serialised
+
     def __str__(self):
         return str(self.__query)
 
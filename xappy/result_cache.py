@@ -0,0 +1,285 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""result_cache.py: Search results held in the connection's result cache.
+
+See `SearchConnection.set_result_cache()`.
+
+"""
+__docformat__ = "restructuredtext en"
+
+from array import array
+
+from mset_search_results import ResultStats
+from searchresults import SearchResult, SearchResultContext, SearchResults, \
+         _TermWeights
+
+def _freeze(value):
+    """Convert a search parameter to a hashable form, for use in a key.
+
+    Raises TypeError if this isn't possible.
+
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(_freeze(item) for item in value))
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item))
+                            for key, item in value.iteritems()))
+    hash(value)
+    return value
+
+def make_key(query, params):
+    """Make the key for the results of a search.
+
+    `params` is a sequence of the parameters which affect the results.
+    Returns None if the results of the search can't be cached: this is the
+    case if the query has no portable serialised form (see
+    `Query._get_portable_repr()`); for example, a query using an
+    ExternalWeightSource might give different results without the database
+    changing.
+
+    """
+    serialised = query._get_portable_repr()
+    if serialised is None:
+        return None
+    try:
+        return (serialised, _freeze(params))
+    except TypeError:
+        return None
+
+class _CachedMSetItem(object):
+    """The parts of a xapian MSetItem which are used by SearchResult.
+
+    """
+    __slots__ = 'document', 'rank', 'weight', 'percent', 'collapse_count', \
+                'collapse_key'
+
+class CachedSearch(object):
+    """The results of a search, held in a compact form.
+
+    The results for ranks from 0 to `endrank` are held, with the statistics,
+    facets and term weights of the search.
+
+    """
+    def __init__(self, results, endrank, collapse):
+        """Take the results from the SearchResults of an uncached search.
+
+        The search must have been performed with startrank 0, and endrank
+        `endrank`.  `collapse` is True if the search collapsed the results.
+
+        """
+        if isinstance(results._ordering, CachedResultOrdering):
+            self._copy_from(results._ordering, endrank)
+            return
+        mset = results._ordering.mset
+        self.docids = array('I')
+        self.weights = array('d')
+        self.percents = array('B')
+        self.collapse_counts = None
+        self.collapse_keys = None
+        if collapse:
+            self.collapse_counts = array('I')
+            self.collapse_keys = []
+        for item in mset:
+            self.docids.append(item.docid)
+            self.weights.append(item.weight)
+            self.percents.append(item.percent)
+            if collapse:
+                self.collapse_counts.append(item.collapse_count)
+                self.collapse_keys.append(item.collapse_key)
+        # If fewer results than were asked for were returned, these are all
+        # the results.
+        self.endrank = endrank
+        self.complete = len(self.docids) < endrank
+        self.stats = (mset.get_matches_lower_bound(),
+                      mset.get_matches_upper_bound(),
+                      mset.get_matches_estimated())
+
+        self.term_weights = {}
+        for term in results._query._get_terms():
+            try:
+                self.term_weights[term] = mset.get_termweight(term)
+            except Exception:
+                pass
+
+        # The facet values are calculated when the FacetResults are made, so
+        # the match spies aren't needed any more.
+        self.facets = results._facets
+        if hasattr(self.facets, 'facetspies'):
+            self.facets.facetspies = None
+
+        self.size = self._calc_size()
+
+    def _copy_from(self, ordering, endrank):
+        """Take the results from a CachedResultOrdering.
+
+        This is used for searches whose results are already held in a
+        CachedSearch (such as reweighted searches; see `reweight()`).
+
+        """
+        source = ordering.cached
+        end = ordering.get_endrank()
+        self.docids = source.docids[:end]
+        self.weights = source.weights[:end]
+        self.percents = source.percents[:end]
+        self.collapse_counts = None
+        self.collapse_keys = None
+        if source.collapse_counts is not None:
+            self.collapse_counts = source.collapse_counts[:end]
+            self.collapse_keys = source.collapse_keys[:end]
+        self.endrank = endrank
+        self.complete = len(self.docids) < endrank
+        self.stats = source.stats
+        self.term_weights = source.term_weights
+        self.facets = source.facets
+        self.size = self._calc_size()
+
+    def reweight(self, factor):
+        """Multiply the weights of the results, and reorder them.
+
+        `factor` is a function which is passed the xapian docid of each
+        result, and returns the number to multiply its weight by.  The results
+        are then sorted by decreasing weight; results with equal weights keep
+        their relative order.  The percentages are left unchanged.
+
+        """
+        weights = [weight * factor(docid)
+                   for docid, weight in zip(self.docids, self.weights)]
+        order = sorted(xrange(len(weights)), key=lambda i: -weights[i])
+        self.docids = array('I', [self.docids[i] for i in order])
+        self.weights = array('d', [weights[i] for i in order])
+        self.percents = array('B', [self.percents[i] for i in order])
+        if self.collapse_counts is not None:
+            self.collapse_counts = array('I', [self.collapse_counts[i]
+                                               for i in order])
+            self.collapse_keys = [self.collapse_keys[i] for i in order]
+
+    def _calc_size(self):
+        """Estimate the number of bytes used to hold the results.
+
+        """
+        size = 512 + len(self.docids) * 13
+        if self.collapse_keys is not None:
+            size += len(self.docids) * 4
+            for key in self.collapse_keys:
+                size += 40 + len(key)
+        for term in self.term_weights:
+            size += 80 + len(term)
+        for values in getattr(self.facets, 'facetvalues', {}).itervalues():
+            size += 100
+            for value, count in values:
+                size += 80 + len(str(value))
+        return size
+
+    def covers(self, endrank):
+        """Check if the results up to `endrank` are held.
+
+        """
+        return self.complete or endrank <= self.endrank
+
+    def make_results(self, conn, query, startrank, endrank, fields, rerun):
+        """Make a SearchResults object for a range of the results.
+
+        `rerun` is a function which performs the search again, without the
+        cache, returning its SearchResults.  This is used if the results are
+        reordered (since reordering needs the original MSet).
+
+        """
+        context = SearchResultContext(conn, conn._field_mappings,
+                                      _TermWeights(self.term_weights),
+                                      query, fields)
+        ordering = CachedResultOrdering(self, context, startrank,
+                                        min(endrank, len(self.docids)),
+                                        rerun)
+        return SearchResults(conn, query, conn._field_mappings, self.facets,
+                             ordering, ResultStats(None, self.stats),
+                             context)
+
+class CachedResultOrdering(object):
+    """The ordering of a range of the results held in a CachedSearch.
+
+    """
+    def __init__(self, cached, context, startrank, endrank, rerun):
+        self.cached = cached
+        self.context = context
+        self.startrank = startrank
+        self.endrank = max(startrank, endrank)
+        self.rerun = rerun
+
+    def _make_result(self, rank):
+        cached = self.cached
+        item = _CachedMSetItem()
+        item.document = self.context.conn._index.get_document(
+            cached.docids[rank])
+        item.rank = rank
+        item.weight = cached.weights[rank]
+        item.percent = cached.percents[rank]
+        if cached.collapse_counts is None:
+            item.collapse_count = 0
+            item.collapse_key = ''
+        else:
+            item.collapse_count = cached.collapse_counts[rank]
+            item.collapse_key = cached.collapse_keys[rank]
+        return SearchResult(item, self.context)
+
+    def get_iter(self):
+        """Get an iterator over the search results.
+
+        """
+        for rank in xrange(self.startrank, self.endrank):
+            yield self._make_result(rank)
+
+    def get_hit(self, index):
+        """Get the hit with a given index.
+
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Search result index out of range")
+        return self._make_result(self.startrank + index)
+
+    def get_startrank(self):
+        return self.startrank
+
+    def get_endrank(self):
+        return self.endrank
+
+    def __len__(self):
+        """Get the number of items in this ordering.
+
+        """
+        return self.endrank - self.startrank
+
+    # The experimental clustering and reordering methods need the MSet, so
+    # perform the search again to get it.
+
+    def _cluster(self, *args):
+        return self.rerun()._ordering._cluster(*args)
+
+    def _reorder_by_collapse(self, *args):
+        return self.rerun()._ordering._reorder_by_collapse(*args)
+
+    def _reorder_by_clusters(self, *args):
+        return self.rerun()._ordering._reorder_by_clusters(*args)
+
+    def _reorder_by_similarity(self, *args):
+        return self.rerun()._ordering._reorder_by_similarity(*args)
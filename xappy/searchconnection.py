@@ -31,6 +31,8 @@ import cPickle as _cPickle
 import math
 import inspect
 import itertools
+import sys
+import threading
 
 import xapian
 from cache_search_results import CacheResultOrdering
@@ -44,6 +46,8 @@ import fieldmappings
 import errors
 from indexerconnection import IndexerConnection, PrefixedTermIter, \
          DocumentIter, SynonymIter, _allocate_id
+from lru import LRUCache
+import result_cache
 from query import Query
 from searchresults import SearchResults, SearchResultContext
 from mset_search_results import FacetResults, NoFacetResults, \
@@ -67,6 +71,94 @@ class ExternalWeightSource(object):
         """
         return NotImplementedError("Subclasses should implement this method")
 
+def _qp_cache_key(fields):
+    """Get a hashable form of a list of fieldnames, for use in a cache key.
+
+    """
+    if fields is None:
+        return None
+    if isinstance(fields, basestring):
+        return (fields, )
+    if len(fields) == 0:
+        return None
+    return tuple(fields)
+
+def _unpickle_config(config_str):
+    """Unpickle a non-empty configuration read from a database.
+
+    Returns a tuple of (actions, serialised field mappings, facet hierarchy,
+    facet query table, next docid).
+
+    """
+    try:
+        (actions,
+         mappings,
+         facet_hierarchy,
+         facet_query_table,
+         next_docid) = _cPickle.loads(config_str)
+        # Backwards compatibility; there used to only be one parent.
+        for key in facet_hierarchy:
+            parents = facet_hierarchy[key]
+            if isinstance(parents, basestring):
+                parents = [parents]
+                facet_hierarchy[key] = parents
+    except ValueError:
+        # Backwards compatibility - configuration used to lack _facet_hierarchy and _facet_query_table
+        (actions,
+         mappings,
+         next_docid) = _cPickle.loads(config_str)
+        facet_hierarchy = {}
+        facet_query_table = {}
+    return actions, mappings, facet_hierarchy, facet_query_table, next_docid
+
+class _PooledSearch(object):
+    """A search performed in a separate thread, with a pooled connection.
+
+    The search is only performed if the connection can be brought to the
+    given revision of the database; if not, `wait()` returns None.
+
+    """
+    def __init__(self, pool, conn, revision, serialised, startrank, endrank,
+                 kwargs, owner, query):
+        self._exc_info = None
+        self._results = None
+        self._thread = threading.Thread(target=self._run,
+            args=(pool, conn, revision, serialised, startrank, endrank,
+                  kwargs, owner, query))
+        self._thread.start()
+
+    def _run(self, pool, conn, revision, serialised, startrank, endrank,
+             kwargs, owner, query):
+        discard = False
+        try:
+            try:
+                if conn._get_revision() != revision:
+                    conn.reopen()
+                    if conn._get_revision() != revision:
+                        return
+                results = conn.search(conn.query_from_evalable(serialised),
+                                      startrank, endrank, **kwargs)
+                # The connection may be used by another thread once it's
+                # returned to the pool, so the results mustn't refer to it.
+                self._results = results._detach(owner, query)
+            except errors.XapianDatabaseError:
+                discard = True
+                self._exc_info = sys.exc_info()
+            except:
+                self._exc_info = sys.exc_info()
+        finally:
+            pool.checkin(conn, discard=discard)
+
+    def wait(self):
+        """Wait for the search, returning its results.
+
+        """
+        self._thread.join()
+        if self._exc_info is not None:
+            exc_info, self._exc_info = self._exc_info, None
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return self._results
+
 class SearchConnection(object):
     """A connection to the search engine for searching.
 
@@ -80,8 +172,28 @@ class SearchConnection(object):
                          xapian.QueryParser.FLAG_AUTO_MULTIWORD_SYNONYMS)
     _qp_flags_bool = xapian.QueryParser.FLAG_BOOLEAN
 
+    # The maximum number of prepared query parsers to keep.
+    _qp_cache_size = 64
+
     _index = None
 
+    # Prepared query parsers, keyed by the parameters used to prepare them,
+    # and the configuration string they were prepared for.
+    _qp_cache = None
+    _qp_cache_config = None
+
+    # The cache of parsed queries (see set_query_cache()), and the revision
+    # of the database the queries in it were parsed with.
+    _query_cache = None
+    _query_cache_revision = None
+
+    # The cache of search results (see set_result_cache()), the revision of
+    # the database the results in it were found with, and the number of
+    # results to fetch at once when filling it.
+    _result_cache = None
+    _result_cache_revision = None
+    _result_cache_window = 100
+
     def __init__(self, indexpath):
         """Create a new connection to the index for searching.
 
@@ -164,13 +276,20 @@ class SearchConnection(object):
         # class.  Move it to a shared location.
         assert self._index is not None
 
-        while True:
-            try:
-                config_str = self._index.get_metadata('_xappy_config')
-                break
-            except xapian.DatabaseModifiedError, e:
-                # Don't call self.reopen() since that calls _load_config()!
-                self._index.reopen()
+        config_str = self._read_config()
+
+        # The prepared query parsers depend only on the configuration (they
+        # read synonyms from the database when parsing), so are kept if the
+        # configuration hasn't changed.
+        if self._qp_cache is None or config_str != self._qp_cache_config:
+            self._qp_cache = {}
+            self._qp_cache_config = config_str
+            if self._query_cache is not None:
+                self._query_cache.clear()
+            if self._result_cache is not None:
+                self._result_cache.clear()
+        self._check_query_cache_revision()
+        self._check_result_cache_revision()
 
         if len(config_str) == 0:
             self._field_actions = ActionSet()
@@ -180,29 +299,13 @@ class SearchConnection(object):
             self._facet_query_table = {}
             return
 
-        try:
-            (actions,
-             mappings,
-             self._facet_hierarchy,
-             self._facet_query_table,
-             self._next_docid) = _cPickle.loads(config_str)
-            self._field_actions = ActionSet()
-            self._field_actions.actions = actions
-            # Backwards compatibility; there used to only be one parent.
-            for key in self._facet_hierarchy:
-                parents = self._facet_hierarchy[key]
-                if isinstance(parents, basestring):
-                    parents = [parents]
-                    self._facet_hierarchy[key] = parents
-        except ValueError:
-            # Backwards compatibility - configuration used to lack _facet_hierarchy and _facet_query_table
-            (actions,
-             mappings,
-             self._next_docid) = _cPickle.loads(config_str)
-            self._field_actions = ActionSet()
-            self._field_actions.actions = actions
-            self._facet_hierarchy = {}
-            self._facet_query_table = {}
+        (actions,
+         mappings,
+         self._facet_hierarchy,
+         self._facet_query_table,
+         self._next_docid) = _unpickle_config(config_str)
+        self._field_actions = ActionSet()
+        self._field_actions.actions = actions
         self._field_mappings = fieldmappings.FieldMappings(mappings)
 
         if self._index.get_metadata('_xappy_hascache'):
@@ -212,6 +315,17 @@ class SearchConnection(object):
             self.cache_manager.db = self._index
             self.cache_manager.writable = False
 
+    def _read_config(self):
+        """Read the serialised configuration from the database.
+
+        """
+        while True:
+            try:
+                return self._index.get_metadata('_xappy_config')
+            except xapian.DatabaseModifiedError, e:
+                # Don't call self.reopen() since that calls _load_config()!
+                self._index.reopen()
+
     def reopen(self):
         """Reopen the connection.
 
@@ -788,6 +902,8 @@ class SearchConnection(object):
         if self._index is None:
             raise errors.SearchError("SearchConnection has been closed")
         serialised = self._make_parent_func_repr("query_difference")
+        # The repr of a callable difference_func can't be used to rebuild it.
+        portable = isinstance(difference_func, basestring)
 
         actions_map = {'collsort': FieldActions.SORT_AND_COLLAPSE,
                        'facet': FieldActions.FACET}
@@ -804,6 +920,7 @@ class SearchConnection(object):
             result = self._difference_accel_query(ranges, range_accel_prefix,
                                                   val, difference_func, num)
             result._set_serialised(serialised)
+            result._set_portable(portable)
             return result
         else:
             # not approx
@@ -823,6 +940,7 @@ class SearchConnection(object):
 
             result = self.query_external_weight(DifferenceWeight())
             result._set_serialised(serialised)
+            result._set_portable(portable)
             return result
 
     @staticmethod
@@ -1124,6 +1242,12 @@ class SearchConnection(object):
             raise errors.SearchError("Cannot specify both `default_allow` and `default_deny` "
                                       "(got %r and %r)" % (default_allow, default_deny))
 
+        key = ('parse', _qp_cache_key(allow), _qp_cache_key(deny), default_op,
+               _qp_cache_key(default_allow), _qp_cache_key(default_deny))
+        qp = self._get_cached_queryparser(key)
+        if qp is not None:
+            return qp
+
         qp = xapian.QueryParser()
         qp.set_database(self._index)
         qp.set_default_op(default_op)
@@ -1175,8 +1299,31 @@ class SearchConnection(object):
                         qp.add_prefix('', self._field_mappings.get_prefix(field))
                         # FIXME - set stemming options for the default prefix
 
+        self._set_cached_queryparser(key, qp)
         return qp
 
+    def _get_cached_queryparser(self, key):
+        """Get a prepared query parser from the cache.
+
+        Returns None if there is no query parser in the cache for `key`.
+
+        """
+        qp = self._qp_cache.get(key)
+        if qp is not None:
+            # Parsing may have turned stemming off (see
+            # _query_parse_with_fallback()), so restore the default strategy
+            # (which has no effect if no stemmer is set).
+            qp.set_stemming_strategy(qp.STEM_SOME)
+        return qp
+
+    def _set_cached_queryparser(self, key, qp):
+        """Store a prepared query parser in the cache.
+
+        """
+        if len(self._qp_cache) >= self._qp_cache_size:
+            self._qp_cache.clear()
+        self._qp_cache[key] = qp
+
     def _query_parse_with_prefix(self, qp, string, flags, prefix):
         """Parse a query, with an optional prefix.
 
@@ -1227,6 +1374,143 @@ class SearchConnection(object):
         return Query(xapian.Query(xapian.Query.OP_AND_MAYBE, q1, q2),
                      _conn=self)
 
+    def set_query_cache(self, max_items=1000):
+        """Set the number of parsed queries to keep.
+
+        Applications often parse the same query strings repeatedly, and
+        parsing a string is fairly expensive (query_parse() parses each
+        string at least twice).  When this is set to a positive number, the
+        results of up to that many calls to query_parse() are kept, keyed by
+        the query string and the other parameters, and the least recently used
+        are discarded when the cache is full.  By default, no queries are
+        kept.
+
+        Parsed queries depend on the synonyms in the database, so the cache is
+        emptied when reopen() moves to a new revision of the database (or on
+        each reopen(), if the revision of the database can't be found, as for
+        sharded databases).  It is also emptied if the configuration of the
+        database changes.
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        if max_items is None or max_items <= 0:
+            self._query_cache = None
+            return
+        if self._query_cache is None:
+            self._query_cache = LRUCache(max_items)
+            self._query_cache_revision = self._get_revision()
+        else:
+            self._query_cache.set_max_items(max_items)
+
+    def get_query_cache_stats(self):
+        """Get statistics about the use of the cache of parsed queries.
+
+        Returns a dictionary with the number of queries in the cache
+        ('items'), the maximum number ('max_items'), and the number of calls
+        to query_parse() which found ('hits'), or didn't find ('misses'), the
+        query in the cache.  Returns None if the cache isn't enabled (see
+        set_query_cache()).
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        if self._query_cache is None:
+            return None
+        return self._query_cache.get_stats()
+
+    def _get_revision(self):
+        """Get the revision of the database, or None if it can't be found.
+
+        """
+        try:
+            return self._index.get_revision()
+        except (AttributeError, xapian.InvalidOperationError):
+            # get_revision() isn't available in older versions of xapian, or
+            # for databases made of several subdatabases.
+            return None
+
+    def _check_query_cache_revision(self):
+        """Empty the cache of parsed queries if the revision has changed.
+
+        """
+        if self._query_cache is None:
+            return
+        revision = self._get_revision()
+        if revision is None or revision != self._query_cache_revision:
+            self._query_cache.clear()
+            self._query_cache_revision = revision
+
+    def set_result_cache(self, max_bytes=16*1024*1024, max_items=10000,
+                         window=100):
+        """Set the amount of memory to use for caching search results.
+
+        When this is set, the results of calls to search() are kept, keyed by
+        the serialised form of the query and the search parameters, so that
+        repeating a search doesn't run the query again.  The document IDs,
+        weights and percentages of the results are kept, with the statistics
+        about the number of matches, the facets and the term weights; the
+        documents themselves are read from the database when they are
+        returned.
+
+         - `max_bytes` is the (approximate) maximum number of bytes to use
+           for the cache.  The least recently used results are discarded when
+           this, or `max_items`, is exceeded.  If None or 0, the cache is
+           disabled (which is the default).
+         - `max_items` is the maximum number of searches to keep results for.
+         - `window` is the number of results to fetch at once: a search for
+           results which aren't in the cache fetches the results from rank 0
+           to the next multiple of `window`, so that requests for the
+           following pages of results can be served from the cache.  The
+           statistics about the number of matches are therefore computed
+           checking at least this many results, so may be more accurate than
+           those from an uncached search.
+
+        The cache is emptied when reopen() moves to a new revision of the
+        database (or on each reopen(), if the revision of the database can't
+        be found).  Searches for queries with no serialised form, for queries
+        which use an ExternalWeightSource, or for queries using the cache
+        manager, are never cached.
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        if not max_bytes:
+            self._result_cache = None
+            return
+        if window < 1:
+            raise errors.SearchError("window must be at least 1")
+        self._result_cache = LRUCache(max_items, max_bytes)
+        self._result_cache_revision = self._get_revision()
+        self._result_cache_window = window
+
+    def get_result_cache_stats(self):
+        """Get statistics about the use of the cache of search results.
+
+        Returns a dictionary with the number of searches held in the cache
+        ('items'), the estimated number of bytes used ('size'), the limits
+        ('max_items' and 'max_size'), and the number of searches which were
+        ('hits') and weren't ('misses') served from the cache.  Returns None
+        if the cache isn't enabled (see set_result_cache()).
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        if self._result_cache is None:
+            return None
+        return self._result_cache.get_stats()
+
+    def _check_result_cache_revision(self):
+        """Empty the cache of search results if the revision has changed.
+
+        """
+        if self._result_cache is None:
+            return
+        revision = self._get_revision()
+        if revision is None or revision != self._result_cache_revision:
+            self._result_cache.clear()
+            self._result_cache_revision = revision
+
     def query_parse(self, string, allow=None, deny=None, default_op=OP_AND,
                     default_allow=None, default_deny=None,
                     allow_wildcards=False):
@@ -1278,11 +1562,28 @@ class SearchConnection(object):
         Returns a Query object, which may be passed to the search() method, or
         combined with other queries.
 
+        If set_query_cache() has been called, the result may be taken from
+        the cache of parsed queries.
+
         """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        serialised = self._make_parent_func_repr("query_parse")
+        if self._query_cache is not None:
+            key = (string, _qp_cache_key(allow), _qp_cache_key(deny),
+                   default_op, _qp_cache_key(default_allow),
+                   _qp_cache_key(default_deny), bool(allow_wildcards))
+            cached = self._query_cache.get(key)
+            if cached is not None:
+                return Query(cached, _conn=self, _serialised=serialised)
+
         qp = self._prepare_queryparser(allow, deny, default_op, default_allow,
                                        default_deny)
         result = self._query_parse_with_fallback(qp, string, allow_wildcards)
-        serialised = self._make_parent_func_repr("query_parse")
+        if self._query_cache is not None:
+            self._query_cache.set(key, result)
+            # Return a copy, so the cached query isn't modified.
+            result = Query(result, _conn=self)
         result._set_serialised(serialised)
         return result
 
@@ -1333,16 +1634,22 @@ class SearchConnection(object):
             if action == FieldActions.INDEX_FREETEXT:
                 if value is None:
                     raise errors.SearchError("Supplied value must not be None")
-                qp = xapian.QueryParser()
-                qp.set_default_op(default_op)
+                key = ('field', field, default_op)
+                qp = self._get_cached_queryparser(key)
+                if qp is None:
+                    qp = xapian.QueryParser()
+                    qp.set_default_op(default_op)
+                    for kwargs in kwargslist:
+                        try:
+                            lang = kwargs['language']
+                            my_stemmer = xapian.Stem(lang)
+                            qp.my_stemmer = my_stemmer
+                            qp.set_stemmer(my_stemmer)
+                            qp.set_stemming_strategy(qp.STEM_SOME)
+                        except KeyError:
+                            pass
+                    self._set_cached_queryparser(key, qp)
                 prefix = self._field_mappings.get_prefix(field)
-                for kwargs in kwargslist:
-                    try:
-                        lang = kwargs['language']
-                        qp.set_stemmer(xapian.Stem(lang))
-                        qp.set_stemming_strategy(qp.STEM_SOME)
-                    except KeyError:
-                        pass
                 result = self._query_parse_with_fallback(qp, value,
                                                          allow_wildcards,
                                                          prefix)
@@ -1639,7 +1946,8 @@ class SearchConnection(object):
 
         postingsource = ExternalWeightPostingSource(self, source)
         return Query(xapian.Query(postingsource),
-                     _refs=[postingsource], _conn=self, _serialised=serialised)
+                     _refs=[postingsource], _conn=self, _serialised=serialised,
+                     _portable=False)
 
     def query_all(self, weight=None):
         """A query which matches all the documents in the database.
@@ -2116,7 +2424,7 @@ class SearchConnection(object):
                percentcutoff=None, weightcutoff=None,
                query_type=None, weight_params=None, collapse_max=1,
                stats_checkatleast=0, facet_checkatleast=0,
-               facet_desired_num_of_categories=7):
+               facet_desired_num_of_categories=7, fields=None):
         """Perform a search, for documents matching a query.
 
         - `query` is the query to perform.
@@ -2169,14 +2477,171 @@ class SearchConnection(object):
           names are "k1", "k2", "k3", "b", "min_normlen".  Any unrecognised
           names will be ignored.  For documentation of the parameters, see the
           docs/weighting.rst document.
+        - `fields` is a sequence of the names of fields to return the stored
+          data for in each result (see get_document()).  If None, data is
+          returned for all fields except those stored out-of-line.
 
         If neither 'allowfacets' or 'denyfacets' is specified, all fields
         holding facets will be considered (but see 'usesubfacets').
 
+        If set_result_cache() has been called, the results may be taken from
+        the cache of search results.
+
         """
         if self._index is None:
             raise errors.SearchError("SearchConnection has been closed")
+        params = (checkatleast, sortby, collapse, getfacets, allowfacets,
+                  denyfacets, usesubfacets, percentcutoff, weightcutoff,
+                  query_type, weight_params, collapse_max, stats_checkatleast,
+                  facet_checkatleast, facet_desired_num_of_categories)
+        def do_search(startrank, endrank):
+            return self._search(query, startrank, endrank, fields, *params)
+
+        key = None
+        if self._result_cache is not None:
+            key = result_cache.make_key(query, params)
+        if key is None:
+            return do_search(startrank, endrank)
+
+        # A cached search which doesn't cover the ranks asked for is counted
+        # as a miss, since the search has to be run.
+        cached = self._result_cache.get(key, count=False)
+        if cached is not None and not cached.covers(endrank):
+            cached = None
+        if cached is None:
+            self._result_cache.note_miss()
+            window = self._result_cache_window
+            fetch_endrank = ((endrank + window - 1) // window) * window
+            cached = result_cache.CachedSearch(do_search(0, fetch_endrank),
+                                               fetch_endrank,
+                                               collapse is not None)
+            self._result_cache.set(key, cached, cached.size)
+        else:
+            self._result_cache.note_hit()
+        return cached.make_results(self, query, startrank, endrank, fields,
+                                   lambda: do_search(startrank, endrank))
+
+    def search_many(self, searches, pool=None, reopen=True):
+        """Perform several searches, returning a list of their results.
+
+        `searches` is a sequence of tuples of (query, startrank, endrank), or
+        (query, startrank, endrank, kwargs), where `kwargs` is a dictionary of
+        the other parameters to pass to search().  The query may be a Query
+        or a query string, which is parsed with query_parse() using the
+        default settings.  The results are returned in the same order as the
+        searches.
+
+        All the searches are checked before any are performed.  If `reopen`
+        is True, the connection is then reopened (once), so that the searches
+        see the latest revision of the database; all the searches see the
+        same revision.
+
+        If `pool` is a SearchConnectionPool for the same database, searches
+        after the first are performed concurrently, each in a separate thread
+        with a connection taken from the pool, so that the time taken is
+        closer to that of the slowest search than to the total.  A search is
+        performed on this connection instead if its query can't be recreated
+        on another connection (see `Query._get_portable_repr()`), if the pool
+        has no free connections, or if a pooled connection can't be brought
+        to the same revision as this one (or the revision can't be found).
+        The results of searches performed with pooled connections are
+        detached from them before they're returned to the pool (see
+        `SearchResults._detach()`): the stored data of each hit is read, for
+        the fields asked for, and anything else which needs a connection
+        (such as `SearchResult.relevant_data()`) uses this one.  These results
+        can't be clustered or reordered.
+
+        If a search fails, the exception is raised once all the searches
+        have finished.
 
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        argnames = set(inspect.getargspec(SearchConnection.search)[0][4:])
+        prepared = []
+        for search in searches:
+            if not isinstance(search, (tuple, list)) or \
+               len(search) not in (3, 4):
+                raise errors.SearchError("Each search must be a tuple of "
+                                         "(query, startrank, endrank) or "
+                                         "(query, startrank, endrank, kwargs)")
+            query, startrank, endrank = search[:3]
+            kwargs = {}
+            if len(search) == 4:
+                kwargs = search[3]
+            if not isinstance(query, (Query, basestring)):
+                raise errors.SearchError("Search query must be a Query or a "
+                                         "string, not %r" % (query, ))
+            unknown = set(kwargs) - argnames
+            if unknown:
+                raise errors.SearchError("Unknown search parameters: %s" %
+                                         ', '.join(sorted(unknown)))
+            prepared.append((query, startrank, endrank, kwargs))
+
+        if reopen:
+            self.reopen()
+        for i, (query, startrank, endrank, kwargs) in enumerate(prepared):
+            if isinstance(query, basestring):
+                prepared[i] = (self.query_parse(query), startrank, endrank,
+                               kwargs)
+
+        pooled = {}
+        revision = None
+        if pool is not None:
+            revision = self._get_revision()
+        if revision is not None:
+            for i in xrange(1, len(prepared)):
+                query, startrank, endrank, kwargs = prepared[i]
+                serialised = query._get_portable_repr()
+                if serialised is None:
+                    continue
+                try:
+                    conn = pool.checkout(timeout=0)
+                except errors.SearchError:
+                    # No free connections.
+                    break
+                pooled[i] = _PooledSearch(pool, conn, revision, serialised,
+                                          startrank, endrank, kwargs, self,
+                                          query)
+
+        results = [None] * len(prepared)
+        exc_info = None
+        for i, (query, startrank, endrank, kwargs) in enumerate(prepared):
+            if i in pooled:
+                continue
+            try:
+                results[i] = self.search(query, startrank, endrank, **kwargs)
+            except:
+                exc_info = sys.exc_info()
+                break
+
+        for i in sorted(pooled):
+            try:
+                results[i] = pooled[i].wait()
+            except:
+                if exc_info is None:
+                    exc_info = sys.exc_info()
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        # Perform any searches which couldn't be done with the same revision
+        # on a pooled connection.
+        for i in sorted(pooled):
+            if results[i] is None:
+                query, startrank, endrank, kwargs = prepared[i]
+                results[i] = self.search(query, startrank, endrank, **kwargs)
+        return results
+
+    def _search(self, query, startrank, endrank, fields,
+                checkatleast, sortby, collapse, getfacets, allowfacets,
+                denyfacets, usesubfacets, percentcutoff, weightcutoff,
+                query_type, weight_params, collapse_max, stats_checkatleast,
+                facet_checkatleast, facet_desired_num_of_categories):
+        """Perform a search, without using the cache of search results.
+
+        The parameters are as for search().
+
+        """
         if checkatleast == -1:
             checkatleast = self._index.get_doccount()
         if stats_checkatleast == -1:
@@ -2315,7 +2780,8 @@ class SearchConnection(object):
             weightgetter = FIXME
 
         # The context is supplied to each SearchResult.
-        context = SearchResultContext(self, self._field_mappings, weightgetter, query)
+        context = SearchResultContext(self, self._field_mappings, weightgetter,
+                                      query, fields)
 
         if cache_hits is None:
             # Use the ordering returned by the MSet.
@@ -2352,12 +2818,16 @@ class SearchConnection(object):
             raise errors.SearchError("SearchConnection has been closed")
         return PrefixedTermIter('Q', self._index.allterms())
 
-    def iter_documents(self):
+    def iter_documents(self, fields=None):
         """Get an iterator which returns all the documents in the database.
 
         The documents will often be returned in the order in which they were
         added, but this should not be relied on.
 
+        If `fields` is not None, it is a sequence of fieldnames, and only the
+        stored data for these fields will be decoded for each document (see
+        get_document()).
+
         Note that the iterator returned by this method may raise a
         xapian.DatabaseModifiedError exception if modifications are committed
         to the database while the iteration is in progress.  If this happens,
@@ -2367,9 +2837,9 @@ class SearchConnection(object):
         """
         if self._index is None:
             raise errors.SearchError("SearchConnection has been closed")
-        return DocumentIter(self, self._index.postlist(''))
+        return DocumentIter(self, self._index.postlist(''), fields)
 
-    def get_document(self, docid=None, xapid=None):
+    def get_document(self, docid=None, xapid=None, fields=None):
         """Get the document with the specified unique ID.
 
         This should usually be called with the `docid` parameter set to the
@@ -2385,6 +2855,12 @@ class SearchConnection(object):
         Raises a KeyError if there is no such document.  Otherwise, it returns
         a ProcessedDocument.
 
+        If `fields` is not None, it is a sequence of fieldnames, and only the
+        stored data for these fields will be returned in the `data` property
+        of the document.  This avoids decoding fields which aren't needed, and
+        allows fields which are stored out-of-line to be read.  Data for any
+        field can also be read with ProcessedDocument.get_data().
+
         """
         if self._index is None:
             raise errors.SearchError("SearchConnection has been closed")
@@ -2415,6 +2891,7 @@ class SearchConnection(object):
 
                 result = ProcessedDocument(self._field_mappings)
                 result._doc = self._index.get_document(xapid)
+                result._set_projection(fields, self._get_blob_loader(xapid))
                 return result
             except xapian.DatabaseModifiedError, e:
                 self.reopen()
@@ -2467,6 +2944,41 @@ class SearchConnection(object):
             except xapian.DatabaseModifiedError, e:
                 self.reopen()
 
+    def _get_blob(self, key):
+        """Get the contents of a blob holding a field stored out-of-line.
+
+        Blobs are kept in the metadata of the index (see
+        IndexerConnection._get_blob()).
+
+        """
+        return self.get_metadata(key)
+
+    def _get_blob_loader(self, xapid):
+        """Get the function used to read the blobs of a document.
+
+        `xapid` is the xapian document ID of the document.  The function
+        returned is passed the key of a blob, and returns its contents.
+        Subclasses which search several databases together override this to
+        read the blobs from the database holding the document.
+
+        """
+        return self._get_blob
+
+    def _make_blob_loader(self, index):
+        """Make a function which reads blobs from the metadata of `index`.
+
+        `index` is one of the databases which make up the database being
+        searched.
+
+        """
+        def get_blob(key):
+            while True:
+                try:
+                    return index.get_metadata(key)
+                except xapian.DatabaseModifiedError, e:
+                    self.reopen()
+        return get_blob
+
     def iter_terms_for_field(self, field, starts_with=''):
         """Return an iterator over the terms that a field has in the index.
 
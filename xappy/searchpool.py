@@ -0,0 +1,512 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""searchpool.py: A thread-safe pool of search connections.
+
+A SearchConnectionPool keeps a set of open SearchConnections for a database,
+which threads check out while they perform a search and check in again
+afterwards.  Connections are opened in advance, closed when they have been
+idle for too long, and reopened whenever the pool notices that a new revision
+of the database has been flushed, so that a search doesn't have to wait for
+the database to be opened, or fail with a DatabaseModifiedError because the
+revision it was reading has been overwritten.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import sys
+import threading
+import time
+import traceback
+
+import errors
+from searchconnection import SearchConnection
+
+class _PooledConnection(object):
+    """A connection in the pool, with the information needed to manage it.
+
+    """
+    __slots__ = ('conn', 'generation', 'last_used')
+
+    def __init__(self, conn, generation):
+        self.conn = conn
+        self.generation = generation
+        self.last_used = time.time()
+
+class SearchConnectionPool(object):
+    """A thread-safe pool of connections to a database for searching.
+
+    Connections are taken from the pool with `checkout()`, and must be given
+    back with `checkin()` once the caller has finished with them (including
+    with any SearchResults obtained from them)::
+
+        conn = pool.checkout()
+        try:
+            results = conn.search(conn.query_parse(querystr), 0, 10)
+            ...
+        finally:
+            pool.checkin(conn)
+
+    The pool notices that the database has been modified by checking the
+    revision of a connection's database at most once every `check_interval`
+    seconds.  When a new revision is found, every connection in the pool is
+    reopened before it is next handed out.  If the revision can't be found
+    (for example, with versions of Xapian which don't support
+    `get_revision()`), the connections are instead reopened every
+    `check_interval` seconds.
+
+    """
+    _cond = None
+    _maintainer = None
+
+    def __init__(self, indexpath, max_size=10, min_size=1, max_idle=300.0,
+                 check_interval=0.1, maintenance_interval=None,
+                 factory=None):
+        """Create a pool of connections to the index at `indexpath`.
+
+         - `max_size` is the maximum number of connections which may be open
+           at once.  When this many are checked out, `checkout()` waits for
+           one to be checked in.
+         - `min_size` is the number of connections to open immediately, and
+           to keep open even when idle.
+         - `max_idle` is the time, in seconds, after which connections which
+           haven't been used are closed (if there are more than `min_size` of
+           them).  If None, idle connections are never closed.
+         - `check_interval` is the minimum time, in seconds, between checks
+           for a new revision of the database.  If 0, the revision is checked
+           on every checkout.
+         - `maintenance_interval`, if not None, is the time in seconds between
+           calls to `maintain()` by a background thread, so that idle
+           connections are reopened, closed and warmed up outside of the
+           threads doing searches.
+         - `factory` is the callable used to open a connection, given
+           `indexpath`.  It defaults to `SearchConnection`.
+
+        """
+        if max_size < 1:
+            raise errors.SearchError("max_size must be at least 1")
+        if min_size < 0 or min_size > max_size:
+            raise errors.SearchError("min_size must be between 0 and "
+                                     "max_size")
+        if factory is None:
+            factory = SearchConnection
+        self._indexpath = indexpath
+        self._factory = factory
+        self._max_size = max_size
+        self._min_size = min_size
+        self._max_idle = max_idle
+        self._check_interval = check_interval
+
+        self._cond = threading.Condition()
+        self._stop_maintenance = threading.Event()
+        # The idle connections, with the most recently used last.
+        self._idle = []
+        # The connections which are checked out, keyed by id().
+        self._checked_out = {}
+        # The number of connections being opened.
+        self._opening = 0
+        self._closed = False
+
+        # The latest revision seen, and a counter which is incremented
+        # whenever the database may have changed.  Connections which were
+        # last reopened in an earlier generation need to be reopened.
+        self._revision = None
+        self._generation = 0
+        self._last_check = time.time()
+
+        self._stats = dict(checkouts=0, waits=0, opened=0, reopened=0,
+                           evicted=0, discarded=0)
+
+        self.warm()
+
+        if maintenance_interval is not None:
+            self._maintainer = threading.Thread(target=self._maintain_loop,
+                                                args=(maintenance_interval,))
+            self._maintainer.setDaemon(True)
+            self._maintainer.start()
+
+    def __del__(self):
+        self.close()
+
+    def _open(self):
+        """Open a new connection, returning it wrapped for the pool.
+
+        The caller must have reserved space for it, by incrementing
+        self._opening, and must decrement self._opening when the connection
+        has been added to the idle list or the checked out connections.  If
+        opening fails, this is done here.
+
+        """
+        try:
+            conn = self._factory(self._indexpath)
+        except:
+            self._cond.acquire()
+            try:
+                self._opening -= 1
+                self._cond.notify()
+            finally:
+                self._cond.release()
+            raise
+        revision = conn._get_revision()
+        self._cond.acquire()
+        try:
+            self._stats['opened'] += 1
+            if revision is not None:
+                if self._revision is not None and revision > self._revision:
+                    self._generation += 1
+                if self._revision is None or revision > self._revision:
+                    self._revision = revision
+            return _PooledConnection(conn, self._generation)
+        finally:
+            self._cond.release()
+
+    def _refresh(self, entry, force=False):
+        """Make sure a connection is up to date before it is handed out.
+
+        The entry must not be in the idle list, so that no other thread can
+        use it.  If the revision is due to be checked, the connection is
+        reopened and its revision compared to the latest seen; otherwise, it
+        is only reopened if a newer revision has been seen since it was last
+        reopened.  If `force` is True, the revision is checked regardless of
+        when it was last checked.
+
+        """
+        now = time.time()
+        self._cond.acquire()
+        try:
+            due = force or (now - self._last_check >= self._check_interval)
+            if due:
+                self._last_check = now
+            if not due and entry.generation == self._generation:
+                return
+        finally:
+            self._cond.release()
+
+        entry.conn.reopen()
+        revision = entry.conn._get_revision()
+
+        self._cond.acquire()
+        try:
+            self._stats['reopened'] += 1
+            if revision is None:
+                if due:
+                    # There's no way to tell whether the database has
+                    # changed, so assume that it has.
+                    self._generation += 1
+            elif self._revision is None or revision > self._revision:
+                if self._revision is not None:
+                    self._generation += 1
+                self._revision = revision
+            entry.generation = self._generation
+        finally:
+            self._cond.release()
+
+    def _close_entry(self, entry):
+        """Close a connection which has been removed from the pool.
+
+        """
+        try:
+            entry.conn.close()
+        except errors.SearchEngineError:
+            pass
+
+    def checkout(self, timeout=None):
+        """Get a connection from the pool.
+
+        If all `max_size` connections are checked out, this waits until one
+        is checked in.  If `timeout` is not None, a SearchError is raised if
+        no connection becomes available within `timeout` seconds.
+
+        The connection must be returned to the pool with `checkin()`.
+
+        """
+        entry = None
+        self._cond.acquire()
+        try:
+            if timeout is not None:
+                endtime = time.time() + timeout
+            waited = False
+            while True:
+                if self._closed:
+                    raise errors.SearchError("SearchConnectionPool has been "
+                                             "closed")
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size() < self._max_size:
+                    self._opening += 1
+                    break
+                if not waited:
+                    waited = True
+                    self._stats['waits'] += 1
+                if timeout is None:
+                    self._cond.wait()
+                else:
+                    remaining = endtime - time.time()
+                    if remaining <= 0:
+                        raise errors.SearchError("Timed out waiting for a "
+                                                 "search connection")
+                    self._cond.wait(remaining)
+            self._stats['checkouts'] += 1
+        finally:
+            self._cond.release()
+
+        opened = (entry is None)
+        try:
+            if opened:
+                entry = self._open()
+            else:
+                self._refresh(entry)
+        except:
+            if not opened:
+                self._discard(entry)
+            raise
+
+        self._cond.acquire()
+        try:
+            self._checked_out[id(entry.conn)] = entry
+            if opened:
+                self._opening -= 1
+        finally:
+            self._cond.release()
+        return entry.conn
+
+    def checkin(self, conn, discard=False):
+        """Return a connection to the pool.
+
+        If `discard` is True, the connection is closed rather than being
+        reused: this should be done if an unexpected error occurred while
+        using it.  A connection which has been closed is always discarded.
+
+        """
+        self._cond.acquire()
+        try:
+            try:
+                entry = self._checked_out.pop(id(conn))
+            except KeyError:
+                raise errors.SearchError("Connection was not checked out "
+                                         "from this pool")
+            if not discard and conn._index is not None and not self._closed:
+                entry.last_used = time.time()
+                self._idle.append(entry)
+                self._cond.notify()
+                return
+        finally:
+            self._cond.release()
+        self._discard(entry)
+
+    def _discard(self, entry):
+        """Close a connection which has been checked out, freeing its space.
+
+        """
+        self._close_entry(entry)
+        self._cond.acquire()
+        try:
+            self._stats['discarded'] += 1
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def _size(self):
+        """Get the number of connections open or being opened.
+
+        Must be called with the lock held.
+
+        """
+        return len(self._idle) + len(self._checked_out) + self._opening
+
+    def warm(self, count=None):
+        """Open connections until there are at least `count` in the pool.
+
+        `count` defaults to the pool's `min_size`, and is limited to its
+        `max_size`.  This is called automatically when the pool is created.
+
+        """
+        if count is None:
+            count = self._min_size
+        count = min(count, self._max_size)
+        while True:
+            self._cond.acquire()
+            try:
+                if self._closed or self._size() >= count:
+                    return
+                self._opening += 1
+            finally:
+                self._cond.release()
+            entry = self._open()
+            self._cond.acquire()
+            try:
+                # Put new connections at the start of the list, so that they
+                # count as the least recently used.
+                self._idle.insert(0, entry)
+                self._opening -= 1
+                self._cond.notify()
+            finally:
+                self._cond.release()
+
+    def maintain(self):
+        """Perform maintenance on the idle connections in the pool.
+
+        This closes connections which have been idle for more than
+        `max_idle` seconds (keeping at least `min_size` connections open),
+        reopens idle connections if a new revision of the database has been
+        flushed, and opens connections to bring the pool up to `min_size`.
+
+        This may be called periodically by the application, or automatically
+        by setting `maintenance_interval` when creating the pool, so that this
+        work is done outside the threads performing searches.
+
+        """
+        evicted = []
+        probe = None
+        self._cond.acquire()
+        try:
+            if self._closed:
+                return
+            if self._max_idle is not None:
+                cutoff = time.time() - self._max_idle
+                while (self._idle and self._idle[0].last_used < cutoff and
+                       self._size() > self._min_size):
+                    evicted.append(self._idle.pop(0))
+                self._stats['evicted'] += len(evicted)
+            if self._idle:
+                # Check the revision using the most recently used connection.
+                probe = self._idle.pop()
+        finally:
+            self._cond.release()
+
+        for entry in evicted:
+            self._close_entry(entry)
+
+        if probe is not None:
+            self._refresh_idle([probe], True)
+            # Reopen any other connections which are now out of date.
+            self._cond.acquire()
+            try:
+                stale = [entry for entry in self._idle
+                         if entry.generation != self._generation]
+                for entry in stale:
+                    self._idle.remove(entry)
+            finally:
+                self._cond.release()
+            self._refresh_idle(stale, False)
+
+        self.warm()
+
+    def _refresh_idle(self, entries, force):
+        """Refresh connections taken from the idle list, and put them back.
+
+        """
+        for i, entry in enumerate(entries):
+            try:
+                self._refresh(entry, force)
+            except:
+                for entry in entries[i:]:
+                    self._discard(entry)
+                raise
+            self._cond.acquire()
+            try:
+                self._insert_idle(entry)
+            finally:
+                self._cond.release()
+
+    def _insert_idle(self, entry):
+        """Put an entry back in the idle list, in order of last use.
+
+        Must be called with the lock held.
+
+        """
+        pos = len(self._idle)
+        while pos > 0 and self._idle[pos - 1].last_used > entry.last_used:
+            pos -= 1
+        self._idle.insert(pos, entry)
+        self._cond.notify()
+
+    def _maintain_loop(self, interval):
+        while not self._stop_maintenance.isSet():
+            self._stop_maintenance.wait(interval)
+            if self._stop_maintenance.isSet():
+                break
+            try:
+                self.maintain()
+            except errors.SearchEngineError:
+                # Leave the connections to be reopened when checked out.
+                pass
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except:
+                # Report the error, but keep maintaining the pool.
+                print >>sys.stderr, "WARNING: unhandled exception in " \
+                    "SearchConnectionPool maintenance:"
+                traceback.print_exc()
+
+    def get_stats(self):
+        """Get statistics about the pool.
+
+        Returns a dictionary with the following items:
+
+         - `size`: the number of connections open.
+         - `idle`: the number of connections in the pool, not checked out.
+         - `checked_out`: the number of connections checked out.
+         - `checkouts`: the number of calls to `checkout()`.
+         - `waits`: the number of checkouts which had to wait for a connection
+           to be checked in.
+         - `opened`: the number of connections opened.
+         - `reopened`: the number of times a connection has been reopened.
+         - `evicted`: the number of connections closed for being idle.
+         - `discarded`: the number of connections discarded by `checkin()`,
+           or after an error.
+
+        """
+        self._cond.acquire()
+        try:
+            stats = dict(self._stats)
+            stats['size'] = self._size()
+            stats['idle'] = len(self._idle)
+            stats['checked_out'] = len(self._checked_out)
+            return stats
+        finally:
+            self._cond.release()
+
+    def close(self):
+        """Close the pool.
+
+        Idle connections are closed immediately; connections which are
+        checked out are closed when they are checked in.  No more
+        connections may be checked out after this has been called.
+
+        """
+        if self._cond is None:
+            # The pool wasn't initialised (this is called by __del__()).
+            return
+        self._cond.acquire()
+        try:
+            if self._closed:
+                return
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        self._stop_maintenance.set()
+        if (self._maintainer is not None and
+            self._maintainer is not threading.currentThread()):
+            self._maintainer.join()
+        for entry in idle:
+            self._close_entry(entry)
@@ -36,7 +36,8 @@ class SearchResultContext(object):
     information about the search.
 
     """
-    def __init__(self, conn, field_mappings, term_weights, query):
+    def __init__(self, conn, field_mappings, term_weights, query,
+                 fields=None):
         """Initialise a context.
 
          - `conn`: the SearchConnection used.
@@ -44,12 +45,37 @@ class SearchResultContext(object):
            slots.
          - `term_weights`: an object used to get term weights.
          - `query`: the query which was performed.
+         - `fields`: the fields to return stored data for, or None.
 
         """
         self.conn = conn
         self.field_mappings = field_mappings
         self.term_weights = term_weights
         self.query = query
+        if fields is not None:
+            if isinstance(fields, basestring):
+                fields = (fields,)
+            fields = frozenset(fields)
+        self.fields = fields
+
+class _TermWeights(object):
+    """Term weights for a query, copied from the MSet it was run with.
+
+    """
+    def __init__(self, weights):
+        self.weights = weights
+
+    def get(self, term):
+        return self.weights.get(term, 0)
+
+class _DetachedConnection(object):
+    """Stands in for the connection of search results which have been
+    detached from it (see `SearchResults._detach()`).
+
+    """
+    def __getattr__(self, name):
+        raise errors.SearchError("The search results have been detached "
+                                 "from the connection they were found with")
 
 class SearchResult(ProcessedDocument):
     """A result from a search.
@@ -81,6 +107,8 @@ class SearchResult(ProcessedDocument):
     """
     def __init__(self, msetitem, context):
         ProcessedDocument.__init__(self, context.field_mappings, msetitem.document)
+        self._set_projection(context.fields, context.conn._get_blob_loader(
+            msetitem.document.get_docid()))
         self.rank = msetitem.rank
         self.weight = msetitem.weight
         self.percent = msetitem.percent
@@ -104,6 +132,19 @@ class SearchResult(ProcessedDocument):
         # Map from (field, offset) to group number.
         self._grouplu = None
 
+    def _detach(self, context):
+        """Make this result independent of the database it was read from.
+
+        The stored data and the xapian document are copied, as for
+        `ProcessedDocument._detach()`, and the result then uses `context`,
+        which mustn't refer to the database either.
+
+        """
+        ProcessedDocument._detach(self)
+        self._term_weights = context.term_weights
+        self._conn = context.conn
+        self._query = context.query
+
     def _get_language(self, field):
         """Get the language that should be used for a given field.
 
@@ -499,7 +540,7 @@ class SearchResult(ProcessedDocument):
 
         """
         highlighter = highlight.Highlighter(language_code=self._get_language(field))
-        field = self.data[field]
+        field = self.get_data(field)
         results = []
         text = '\n'.join(field)
         if query is None:
@@ -531,7 +572,7 @@ class SearchResult(ProcessedDocument):
 
         """
         highlighter = highlight.Highlighter(language_code=self._get_language(field))
-        field = self.data[field]
+        field = self.get_data(field)
         results = []
         if query is None:
             query = self._query
@@ -544,6 +585,58 @@ class SearchResult(ProcessedDocument):
                 (self.rank, self.id, self.data))
 
 
+class _DetachedResultOrdering(object):
+    """The ordering of a list of hits which have already been read.
+
+    """
+    def __init__(self, hits, startrank, endrank):
+        self.hits = hits
+        self.startrank = startrank
+        self.endrank = endrank
+
+    def get_iter(self):
+        return iter(self.hits)
+
+    def get_hit(self, index):
+        return self.hits[index]
+
+    def get_startrank(self):
+        return self.startrank
+
+    def get_endrank(self):
+        return self.endrank
+
+    def __len__(self):
+        return len(self.hits)
+
+    def _unsupported(self, *args):
+        raise errors.SearchError("Search results which have been detached "
+                                 "from their connection can't be clustered "
+                                 "or reordered")
+    _cluster = _unsupported
+    _reorder_by_collapse = _unsupported
+    _reorder_by_clusters = _unsupported
+    _reorder_by_similarity = _unsupported
+
+class _DetachedStats(object):
+    """Statistics on the number of matching documents, which have already
+    been read.
+
+    """
+    def __init__(self, lower_bound, upper_bound, estimated):
+        self.lower_bound = lower_bound
+        self.upper_bound = upper_bound
+        self.estimated = estimated
+
+    def get_lower_bound(self):
+        return self.lower_bound
+
+    def get_upper_bound(self):
+        return self.upper_bound
+
+    def get_estimated(self):
+        return self.estimated
+
 class SearchResults(object):
     """A set of results of a search.
 
@@ -559,6 +652,51 @@ class SearchResults(object):
         self._field_mappings = field_mappings
         self._facets = facets
 
+    def _detach(self, conn=None, query=None):
+        """Make a copy of these results which doesn't refer to the database.
+
+        The hits are read, with their stored data (see
+        `ProcessedDocument._detach()`), and the statistics, facets and term
+        weights are copied, so that the copy can be used once the connection
+        the search was performed with has been closed, or is being used by
+        another thread.
+
+        If `conn` is not None, it is a connection to the same database, which
+        the copy uses for anything which needs one (such as
+        `SearchResult.relevant_data()`), with `query` (if given) as the query
+        which was performed.  Otherwise, anything which needs a connection
+        raises SearchError.  The copy can't be clustered or reordered.
+
+        """
+        if conn is None:
+            conn = _DetachedConnection()
+        if query is None:
+            query = self._query
+        weights = {}
+        for term in self._query._get_terms():
+            try:
+                weights[term] = self._context.term_weights.get(term)
+            except Exception:
+                pass
+        context = SearchResultContext(conn, self._field_mappings,
+                                      _TermWeights(weights), query,
+                                      self._context.fields)
+        hits = []
+        for hit in self:
+            hit._detach(context)
+            hits.append(hit)
+        ordering = _DetachedResultOrdering(hits, self.startrank, self.endrank)
+        stats = _DetachedStats(self.matches_lower_bound,
+                               self.matches_upper_bound,
+                               self.matches_estimated)
+        # The facet values are calculated when the FacetResults are made, so
+        # the match spies aren't needed any more.
+        facets = self._facets
+        if hasattr(facets, 'facetspies'):
+            facets.facetspies = None
+        return SearchResults(conn, query, self._field_mappings, facets,
+                             ordering, stats, context)
+
     def _cluster(self, num_clusters, maxdocs, fields=None,
                  assume_single_value=False):
         """Cluster results based on similarity.
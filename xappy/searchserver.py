@@ -0,0 +1,592 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""searchserver.py: A multi-process search server, and a client for it.
+
+A SearchServer answers searches sent as JSON over HTTP.  It binds a listening
+socket and then forks a fixed number of worker processes, each of which
+accepts connections on that socket and holds its own SearchConnection, so
+searches are processed in parallel without contending for the global
+interpreter lock of a single process.  A SearchClient sends searches to the
+server, with methods mirroring those of SearchConnection.
+
+The requests are POSTed to a path naming the method, with a JSON object as
+the body:
+
+ - `/search`: `query` is a query string, parsed on the server with
+   `SearchConnection.query_parse()` using the options in `parse` (a dict);
+   alternatively, `serialised` is the evalable repr of a Query, which is only
+   accepted if the server was started with `allow_evalable` (since it is
+   passed to eval).  `startrank` and `endrank` give the range of results, and
+   `params` holds any other parameters for `SearchConnection.search()`.  If
+   `maxfacets` is given, the suggested facets are returned too.
+ - `/get_document`: `id` is the ID of the document, and `fields` optionally
+   lists the fields to return.
+ - `/spell_correct`: `query` is the query string, and `parse` holds other
+   parameters for `SearchConnection.spell_correct()`.
+ - `/get_doccount`: no parameters.
+
+The response is a JSON object; if an error occurs, it holds `error` (the name
+of the exception class) and `message`.
+
+The server can be run from the command line; use the `--help` option for
+details.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import BaseHTTPServer
+import httplib
+import inspect
+import optparse
+import os
+import signal
+import sys
+import time
+try:
+    import simplejson as json
+except ImportError:
+    import json
+try:
+    import multiprocessing
+except ImportError:
+    # multiprocessing is only in 2.6 onwards
+    multiprocessing = None
+
+import xapian
+import errors
+from searchconnection import SearchConnection
+
+# The parameters of SearchConnection.search() which may be sent to the
+# server (excluding the query and range of results).
+_SEARCH_PARAMS = frozenset(inspect.getargspec(SearchConnection.search)[0][4:])
+_PARSE_PARAMS = frozenset(inspect.getargspec(SearchConnection.query_parse)[0][2:])
+_SPELL_PARAMS = frozenset(inspect.getargspec(SearchConnection.spell_correct)[0][2:])
+
+def _to_str(value):
+    """Convert the unicode strings in a decoded JSON value to UTF-8.
+
+    Lists are converted to tuples, except at the top level of a dict value
+    (so the stored data of a document is a dict of lists, as usual).
+
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return tuple(_to_str(item) for item in value)
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.iteritems():
+            item = _to_str(item)
+            if isinstance(item, tuple):
+                item = list(item)
+            result[_to_str(key)] = item
+        return result
+    return value
+
+def _check_params(params, allowed, kind):
+    if not isinstance(params, dict):
+        raise errors.SearchError("%s parameters must be an object" % kind)
+    unknown = set(params) - allowed
+    if unknown:
+        raise errors.SearchError("Unknown %s parameters: %s" %
+                                 (kind, ', '.join(sorted(unknown))))
+    return dict((str(key), _to_str(value))
+                for key, value in params.iteritems())
+
+class _SearchService(object):
+    """The methods of the server, run in a worker process.
+
+    """
+    def __init__(self, indexpath, factory, allow_evalable, check_interval):
+        self._conn = factory(indexpath)
+        self._allow_evalable = allow_evalable
+        self._check_interval = check_interval
+        self._last_reopen = time.time()
+        self.methods = {
+            '/search': self.search,
+            '/get_document': self.get_document,
+            '/spell_correct': self.spell_correct,
+            '/get_doccount': self.get_doccount,
+        }
+
+    def call(self, path, request):
+        """Call the method for a path, reopening the connection as needed.
+
+        """
+        method = self.methods.get(path)
+        if method is None:
+            raise errors.SearchError("Unknown method %r" % path)
+        if not isinstance(request, dict):
+            raise errors.SearchError("Request must be an object")
+        now = time.time()
+        if now - self._last_reopen >= self._check_interval:
+            self._conn.reopen()
+            self._last_reopen = now
+        attempts = 0
+        while True:
+            try:
+                return method(request)
+            except xapian.DatabaseModifiedError:
+                attempts += 1
+                if attempts == 3:
+                    raise
+                self._conn.reopen()
+                self._last_reopen = time.time()
+
+    def _make_query(self, request):
+        if 'serialised' in request:
+            if not self._allow_evalable:
+                raise errors.SearchError("This server doesn't accept "
+                                         "serialised queries")
+            return self._conn.query_from_evalable(
+                _to_str(request['serialised']))
+        parse = _check_params(request.get('parse', {}), _PARSE_PARAMS,
+                              'query_parse')
+        return self._conn.query_parse(_to_str(request.get('query', '')),
+                                      **parse)
+
+    def search(self, request):
+        query = self._make_query(request)
+        params = _check_params(request.get('params', {}), _SEARCH_PARAMS,
+                               'search')
+        results = self._conn.search(query, int(request.get('startrank', 0)),
+                                    int(request.get('endrank', 10)),
+                                    **params)
+        reply = {
+            'startrank': results.startrank,
+            'endrank': results.endrank,
+            'stats': [results.matches_lower_bound,
+                      results.matches_upper_bound,
+                      results.matches_estimated],
+            'estimate_is_exact': results.estimate_is_exact,
+            'more_matches': results.more_matches,
+            'hits': [[hit.id, hit.weight, hit.percent, hit.data]
+                     for hit in results],
+        }
+        if params.get('getfacets'):
+            reply['facets'] = results.get_facets()
+            maxfacets = request.get('maxfacets')
+            if maxfacets is not None:
+                reply['suggested_facets'] = results.get_suggested_facets(
+                    int(maxfacets),
+                    required_facets=_to_str(request.get('required_facets')))
+        return reply
+
+    def get_document(self, request):
+        fields = request.get('fields')
+        if fields is not None:
+            fields = _to_str(fields)
+        doc = self._conn.get_document(_to_str(request['id']), fields=fields)
+        return {'id': doc.id, 'data': doc.data}
+
+    def spell_correct(self, request):
+        params = _check_params(request.get('parse', {}), _SPELL_PARAMS,
+                               'spell_correct')
+        return {'result': self._conn.spell_correct(
+            _to_str(request.get('query', '')), **params)}
+
+    def get_doccount(self, request):
+        return {'result': self._conn.get_doccount()}
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handle a request to the search server.
+
+    """
+    def do_POST(self):
+        status = 200
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                request = json.loads(self.rfile.read(length))
+            except ValueError:
+                raise errors.SearchError("Request is not valid JSON")
+            reply = self.server.service.call(self.path, request)
+        except KeyError, e:
+            status = 404
+            reply = {'error': 'KeyError', 'message': e.args and e.args[0]}
+        except errors.SearchEngineError, e:
+            status = 400
+            reply = {'error': e.__class__.__name__, 'message': str(e)}
+        except Exception, e:
+            status = 500
+            reply = {'error': e.__class__.__name__, 'message': str(e)}
+        body = json.dumps(reply, separators=(',', ':'))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.log_requests:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                                                              *args)
+
+class SearchServer(object):
+    """A server for searching an index, using several worker processes.
+
+    The server listens on `address` (a (host, port) tuple) as soon as it is
+    created.  `start()` forks the worker processes, and returns; `stop()`
+    stops them.  `serve_forever()` starts the workers if they haven't been
+    started, and then restarts any which exit, until the server is stopped
+    (for example, by a keyboard interrupt).
+
+    This needs `os.fork()`, so isn't available on Windows.
+
+    """
+    def __init__(self, indexpath, host='127.0.0.1', port=0, processes=None,
+                 allow_evalable=False, check_interval=1.0, factory=None,
+                 log_requests=False):
+        """Create a server for the index at `indexpath`.
+
+         - `host` and `port` give the address to listen on.  By default, the
+           server only accepts connections from the local host, on a port
+           chosen by the operating system (see the `address` attribute).
+         - `processes` is the number of worker processes (by default, the
+           number of CPUs).
+         - `allow_evalable`, if True, allows clients to send serialised Query
+           objects.  These are passed to eval(), so this should only be set
+           if every client which can connect to the server is trusted.
+         - `check_interval` is the minimum time, in seconds, between reopening
+           the connections to see new revisions of the index.
+         - `factory` is the callable used by each worker to open its
+           connection, given `indexpath`.  It defaults to
+           `SearchConnection`.
+         - `log_requests`, if True, logs each request to stderr.
+
+        """
+        if not hasattr(os, 'fork'):
+            raise errors.SearchError("SearchServer needs os.fork(), which "
+                                     "isn't available on this platform")
+        if processes is None:
+            if multiprocessing is None:
+                processes = 1
+            else:
+                processes = multiprocessing.cpu_count()
+        if processes < 1:
+            raise errors.SearchError("processes must be at least 1")
+        if factory is None:
+            factory = SearchConnection
+        self._indexpath = indexpath
+        self._processes = processes
+        self._allow_evalable = allow_evalable
+        self._check_interval = check_interval
+        self._factory = factory
+        self._httpd = BaseHTTPServer.HTTPServer((host, port), _RequestHandler)
+        self._httpd.log_requests = log_requests
+        self.address = self._httpd.server_address
+        self._children = {}
+        self._stopping = False
+
+    def _spawn(self):
+        """Fork a worker process.
+
+        """
+        pid = os.fork()
+        if pid != 0:
+            self._children[pid] = time.time()
+            return
+        status = 1
+        try:
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                self._httpd.service = _SearchService(self._indexpath,
+                    self._factory, self._allow_evalable,
+                    self._check_interval)
+                self._httpd.serve_forever()
+                status = 0
+            except:
+                import traceback
+                traceback.print_exc()
+        finally:
+            os._exit(status)
+
+    def start(self):
+        """Start the worker processes.
+
+        """
+        if self._httpd is None:
+            raise errors.SearchError("SearchServer has been stopped")
+        while len(self._children) < self._processes:
+            self._spawn()
+
+    def serve_forever(self):
+        """Run the server, restarting workers which exit, until stopped.
+
+        """
+        self.start()
+        try:
+            while not self._stopping and self._children:
+                try:
+                    pid, status = os.wait()
+                except OSError:
+                    continue
+                started = self._children.pop(pid, None)
+                if self._stopping:
+                    break
+                if started is not None and time.time() - started < 1.0:
+                    # Don't restart workers which fail immediately too often.
+                    time.sleep(1.0)
+                self._spawn()
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def stop(self):
+        """Stop the worker processes, and close the listening socket.
+
+        """
+        self._stopping = True
+        for pid in self._children.keys():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in self._children.keys():
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self._children = {}
+        if self._httpd is not None:
+            self._httpd.server_close()
+            self._httpd = None
+
+class RemoteSearchResult(object):
+    """A result from a search performed by a SearchServer.
+
+    Has the `id`, `rank`, `weight`, `percent` and `data` attributes of a
+    SearchResult.
+
+    """
+    __slots__ = 'id', 'rank', 'weight', 'percent', 'data'
+
+    def __init__(self, id, rank, weight, percent, data):
+        self.id = id
+        self.rank = rank
+        self.weight = weight
+        self.percent = percent
+        self.data = data
+
+    def __repr__(self):
+        return '<RemoteSearchResult(rank=%d, id=%r, data=%r)>' % (
+            self.rank, self.id, self.data)
+
+class RemoteSearchResults(object):
+    """The results of a search performed by a SearchServer.
+
+    This supports the commonly used parts of the SearchResults interface:
+    iteration, indexing and len() for the hits, the statistics about the
+    number of matches, and the facets.
+
+    """
+    def __init__(self, reply):
+        self.startrank = reply['startrank']
+        self.endrank = reply['endrank']
+        (self.matches_lower_bound,
+         self.matches_upper_bound,
+         self.matches_estimated) = reply['stats']
+        self.estimate_is_exact = reply['estimate_is_exact']
+        self.more_matches = reply['more_matches']
+        self._hits = [RemoteSearchResult(_to_str(id), self.startrank + i,
+                                         weight, percent, _to_str(data))
+                      for i, (id, weight, percent, data)
+                      in enumerate(reply['hits'])]
+        self._facets = _to_str(reply.get('facets'))
+        self._suggested_facets = reply.get('suggested_facets')
+        if self._suggested_facets is not None:
+            self._suggested_facets = list(_to_str(self._suggested_facets))
+
+    def __len__(self):
+        return len(self._hits)
+
+    def __iter__(self):
+        return iter(self._hits)
+
+    def __getitem__(self, index_or_slice):
+        return self._hits[index_or_slice]
+
+    def get_hit(self, index):
+        return self._hits[index]
+
+    def get_facets(self):
+        """Get the facets calculated for the results.
+
+        Only available if the search was performed with `getfacets` set.
+
+        """
+        if self._facets is None:
+            raise errors.SearchError("Facets weren't requested")
+        return self._facets
+
+    def get_suggested_facets(self):
+        """Get the suggested facets for the results.
+
+        Only available if `maxfacets` was passed to `SearchClient.search()`,
+        and `getfacets` was set.
+
+        """
+        if self._suggested_facets is None:
+            raise errors.SearchError("Suggested facets weren't requested")
+        return self._suggested_facets
+
+class SearchClient(object):
+    """A client for a SearchServer.
+
+    """
+    def __init__(self, host='127.0.0.1', port=None, timeout=None):
+        """Create a client for the server at `host` and `port`.
+
+        `timeout`, if not None, is the timeout in seconds for each request.
+
+        """
+        if port is None:
+            raise errors.SearchError("The port of the server must be given")
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+
+    def _call(self, method, request):
+        if self._timeout is None:
+            conn = httplib.HTTPConnection(self._host, self._port)
+        else:
+            conn = httplib.HTTPConnection(self._host, self._port,
+                                          timeout=self._timeout)
+        try:
+            body = json.dumps(request, separators=(',', ':'))
+            conn.request('POST', '/' + method, body,
+                         {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            reply = json.loads(response.read())
+        finally:
+            conn.close()
+        if response.status != 200:
+            name = reply.get('error')
+            message = _to_str(reply.get('message'))
+            if name == 'KeyError':
+                raise KeyError(message)
+            exc = getattr(errors, str(name), None)
+            if not (isinstance(exc, type) and
+                    issubclass(exc, errors.SearchEngineError)):
+                exc = errors.SearchError
+                message = '%s: %s' % (name, message)
+            raise exc(message)
+        return reply
+
+    def search(self, query, startrank, endrank, parse=None, maxfacets=None,
+               required_facets=None, **kwargs):
+        """Perform a search.
+
+        `query` is either a query string, which is parsed by the server using
+        the options in the `parse` dict (as keyword arguments to
+        `SearchConnection.query_parse()`), or a Query, which is sent in its
+        serialised form (this is only accepted if the server allows it).
+
+        The other keyword arguments are passed to `SearchConnection.search()`
+        on the server, so must be representable in JSON.  If `maxfacets` is
+        not None and `getfacets` is set, the results include the suggested
+        facets.
+
+        Returns a RemoteSearchResults object.
+
+        """
+        request = {'startrank': startrank, 'endrank': endrank,
+                   'params': kwargs}
+        if isinstance(query, basestring):
+            request['query'] = query
+            if parse is not None:
+                request['parse'] = parse
+        else:
+            serialised = query._get_portable_repr()
+            if serialised is None:
+                raise errors.SearchError("Query can't be sent to a server")
+            request['serialised'] = serialised
+        if maxfacets is not None:
+            request['maxfacets'] = maxfacets
+            request['required_facets'] = required_facets
+        return RemoteSearchResults(self._call('search', request))
+
+    def get_document(self, id, fields=None):
+        """Get the stored data of the document with the given ID.
+
+        Returns a tuple of (id, data).  Raises KeyError if there is no such
+        document.
+
+        """
+        reply = self._call('get_document', {'id': id, 'fields': fields})
+        return _to_str(reply['id']), _to_str(reply['data'])
+
+    def spell_correct(self, querystr, **kwargs):
+        """Correct the spelling of a query string.
+
+        The keyword arguments are passed to `SearchConnection.spell_correct()`
+        on the server.
+
+        """
+        reply = self._call('spell_correct', {'query': querystr,
+                                             'parse': kwargs})
+        return _to_str(reply['result'])
+
+    def get_doccount(self):
+        """Get the number of documents in the index.
+
+        """
+        return self._call('get_doccount', {})['result']
+
+def main(argv=None):
+    """Run a search server from the command line.
+
+    Returns the exit status.
+
+    """
+    parser = optparse.OptionParser(
+        usage="%prog [options] INDEXPATH",
+        description="Serve searches of an index as JSON over HTTP, using a "
+                    "pool of worker processes.")
+    parser.add_option('--host', default='127.0.0.1',
+                      help="Address to listen on (default: %default)")
+    parser.add_option('--port', type='int', default=8340,
+                      help="Port to listen on (default: %default)")
+    parser.add_option('-p', '--processes', type='int',
+                      help="Number of worker processes (default: the number "
+                      "of CPUs)")
+    parser.add_option('--check-interval', type='float', default=1.0,
+                      help="Minimum time in seconds between checks for a new "
+                      "revision of the index (default: %default)")
+    parser.add_option('--allow-evalable', action='store_true', default=False,
+                      help="Accept serialised queries.  These are passed to "
+                      "eval(), so only use this if all clients are trusted")
+    parser.add_option('-v', '--verbose', action='store_true', default=False,
+                      help="Log each request")
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error("Wrong number of arguments")
+
+    server = SearchServer(args[0], options.host, options.port,
+                          options.processes, options.allow_evalable,
+                          options.check_interval,
+                          log_requests=options.verbose)
+    sys.stderr.write("Serving %r on %s:%d\n" % ((args[0],) + server.address))
+    server.serve_forever()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
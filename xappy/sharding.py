@@ -0,0 +1,846 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""sharding.py: Indexes split across several databases.
+
+A sharded index is a directory holding a number of ordinary xappy databases
+("shards"), named "shard0", "shard1", and so on.  Each document is stored in
+exactly one shard, chosen from a hash of its document ID.  All the shards have
+the same field configuration.
+
+A ShardedIndexerConnection writes to each shard from a separate process, so
+documents are processed and written in parallel.  A ShardedSearchConnection
+searches all the shards together, as if they were a single database.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import cPickle
+import os
+import Queue
+import re
+import sys
+import zlib
+try:
+    import multiprocessing
+except ImportError:
+    # multiprocessing is only in 2.6 onwards
+    multiprocessing = None
+
+import xapian
+
+from cachemanager.xapian_manager import BASE_CACHE_SLOT, \
+     CACHE_MANAGER_MAX_HITS, encode, decode
+from datastructures import ProcessedDocument
+import errors
+import fieldmappings
+from indexerconnection import IndexerConnection, _IdAllocator
+from searchconnection import SearchConnection
+
+_shard_re = re.compile('^shard([0-9]+)$')
+
+def _shard_path(path, shard):
+    """Get the path of a shard of a sharded index.
+
+    """
+    return os.path.join(path, 'shard%d' % shard)
+
+def _find_shards(path):
+    """Get the number of shards in an existing sharded index.
+
+    Returns 0 if there are no shards at the path.
+
+    """
+    if not os.path.isdir(path):
+        return 0
+    shards = set()
+    for name in os.listdir(path):
+        m = _shard_re.match(name)
+        if m:
+            shards.add(int(m.group(1)))
+    if shards and shards != set(range(len(shards))):
+        raise errors.SearchEngineError("Shards missing from sharded index "
+                                       "at %r" % path)
+    return len(shards)
+
+def shard_for_id(id, shards):
+    """Get the number of the shard which holds the document with a given ID.
+
+    """
+    if isinstance(id, unicode):
+        id = id.encode('utf-8')
+    return (zlib.crc32(id) & 0xffffffff) % shards
+
+def merged_xapid(shard, xapid, shards):
+    """Convert a xapian docid in a shard to a docid in the merged database.
+
+    """
+    return (xapid - 1) * shards + shard + 1
+
+def split_xapid(xapid, shards):
+    """Convert a docid in the merged database to a (shard, xapid) pair.
+
+    """
+    return (xapid - 1) % shards, (xapid - 1) // shards + 1
+
+def _picklable_error(e):
+    """Make sure that an exception can be sent between processes.
+
+    """
+    try:
+        cPickle.dumps(e, 2)
+        return e
+    except Exception:
+        return errors.IndexerError("%s: %s" % (e.__class__.__name__, e))
+
+class _ShardCacheProxy(object):
+    """Stands in for the cache manager in the process writing a shard.
+
+    The real cache manager is held by the parent process, and refers to
+    documents by their docids in the merged database.  This records the cached
+    hits which need to be removed when documents are deleted or replaced, so
+    that they can be passed back to the parent to apply.
+
+    """
+    def __init__(self, shard, shards):
+        self.shard = shard
+        self.shards = shards
+        self.removals = []
+
+    def replace(self, olddoc, newdoc):
+        # Copy any cached query items over to the new document.
+        for value in olddoc.values():
+            if value.num < BASE_CACHE_SLOT:
+                continue
+            newdoc.add_value(value.num, value.value)
+
+    def remove_cached_items(self, iconn, doc, xapid):
+        xapid = merged_xapid(self.shard, xapid, self.shards)
+        for value in doc.values():
+            if value.num < BASE_CACHE_SLOT:
+                continue
+            rank = int(CACHE_MANAGER_MAX_HITS -
+                       xapian.sortable_unserialise(value.value))
+            self.removals.append((value.num, rank, xapid))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+def _cmd_add(conn, state, store_only):
+    doc = ProcessedDocument._from_transport_state(conn._field_mappings, state)
+    conn.add(doc, store_only)
+
+def _cmd_replace(conn, state, store_only):
+    doc = ProcessedDocument._from_transport_state(conn._field_mappings, state)
+    conn.replace(doc, store_only)
+
+def _cmd_set_values(conn, items):
+    for xapid, values in items:
+        try:
+            xapdoc = conn._index.get_document(xapid)
+        except xapian.DocNotFoundError:
+            continue
+        for slot, value in values:
+            xapdoc.add_value(slot, value)
+        conn._index.replace_document(xapid, xapdoc)
+
+def _cmd_term_exists(conn, term):
+    return conn._index.term_exists(term)
+
+def _cmd_get_document(conn, id):
+    return conn.get_document(id)._get_transport_state()
+
+def _cmd_take_cache_removals(conn):
+    result = conn.cache_manager.removals
+    conn.cache_manager.removals = []
+    return result
+
+_worker_commands = {
+    '_add': _cmd_add,
+    '_replace': _cmd_replace,
+    '_set_values': _cmd_set_values,
+    '_term_exists': _cmd_term_exists,
+    '_get_document': _cmd_get_document,
+    '_take_cache_removals': _cmd_take_cache_removals,
+}
+
+def _shard_worker(path, dbtype, shard, shards, commands, results):
+    """The main loop of a process writing to a shard.
+
+    Commands are read from the `commands` queue, and are 4-tuples of (name,
+    args, kwargs, reply).  If `reply` is true, a (success, result) pair is put
+    on the `results` queue when the command completes.  Otherwise, the first
+    error which occurs is remembered, and reported by the next flush.
+
+    A command with a name of None closes the connection and ends the process.
+
+    """
+    try:
+        conn = IndexerConnection(path, dbtype)
+        conn.set_metadata('_xappy_shards', str(shards))
+        conn.set_cache_manager(_ShardCacheProxy(shard, shards))
+    except Exception, e:
+        results.put((False, _picklable_error(e)))
+        return
+    results.put((True, None))
+
+    error = None
+    while True:
+        name, args, kwargs, reply = commands.get()
+        if name is None:
+            break
+        try:
+            fn = _worker_commands.get(name)
+            if fn is None:
+                result = getattr(conn, name)(*args, **kwargs)
+            else:
+                result = fn(conn, *args, **kwargs)
+        except Exception, e:
+            if reply:
+                results.put((False, _picklable_error(e)))
+            elif error is None:
+                error = _picklable_error(e)
+            continue
+        if reply:
+            if name == 'flush' and error is not None:
+                results.put((False, error))
+                error = None
+            else:
+                results.put((True, result))
+
+    try:
+        conn.close()
+    except Exception, e:
+        if error is None:
+            error = _picklable_error(e)
+    if error is None:
+        results.put((True, None))
+    else:
+        results.put((False, error))
+
+class _ShardedIdIndex(object):
+    """Provides the database methods used by an _IdAllocator, for a sharded
+    index.
+
+    """
+    def __init__(self, conn):
+        self._conn = conn
+
+    def get_metadata(self, key):
+        return self._conn._call(0, 'get_metadata', key)
+
+    def set_metadata(self, key, value):
+        self._conn._send(0, 'set_metadata', key, value)
+
+    def get_doccount(self):
+        return sum(self._conn._call_all('get_doccount'))
+
+    def allterms(self, prefix):
+        # This is only used before any documents have been written by the
+        # connection, so the committed contents of the shards are up to date.
+        for shard in xrange(self._conn._shards):
+            db = xapian.Database(_shard_path(self._conn._path, shard))
+            for item in db.allterms(prefix):
+                yield item
+
+    def term_exists(self, term):
+        shard = shard_for_id(term[1:], self._conn._shards)
+        return self._conn._call(shard, '_term_exists', term)
+
+class _ShardedIdAllocator(_IdAllocator):
+    """Allocator for document IDs in a sharded index.
+
+    The state is stored in the metadata of the first shard, under a different
+    key from that used by the connection to the shard itself.
+
+    """
+    _metadata_key = '_xappy_shard_idblock'
+
+class ShardedIndexerConnection(object):
+    """A connection for indexing to a sharded index.
+
+    This supports most of the methods of IndexerConnection.  Changes to the
+    configuration are applied to every shard.  Documents are sent to the
+    process writing to the shard which they belong in, and are processed
+    there, so several documents are processed and written in parallel.
+
+    Because documents are written asynchronously, errors which occur when
+    adding, replacing or deleting a document (such as adding a document with
+    an ID which already exists) are reported by the next call to flush() or
+    close(), rather than by the method which caused them.
+
+    Documents can't be referred to by xapian document ID, since these differ
+    between the shards and the merged database.
+
+    """
+    _index = None
+
+    def __init__(self, path, shards=None, dbtype=None, max_pending=100):
+        """Open a connection to a sharded index, creating it if necessary.
+
+         - `path` is the directory holding the shards.
+         - `shards` is the number of shards to create.  This must be given if
+           the index doesn't already exist; if it does, it must be None or
+           the number of shards in the index.
+         - `dbtype` is the database type to use for new shards (see
+           IndexerConnection).
+         - `max_pending` is the maximum number of commands which may be
+           waiting to be performed by each shard.  If this many are waiting,
+           adding further documents will block.
+
+        """
+        if multiprocessing is None:
+            raise errors.IndexerError("Sharded indexes require the "
+                                      "multiprocessing module")
+        existing = _find_shards(path)
+        if existing:
+            if shards is not None and shards != existing:
+                raise errors.IndexerError("Sharded index at %r has %d shards, "
+                                          "not %d" % (path, existing, shards))
+            shards = existing
+        elif shards is None:
+            raise errors.IndexerError("Number of shards must be specified "
+                                      "when creating a sharded index")
+        if shards < 1:
+            raise errors.IndexerError("Number of shards must be at least 1")
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self._path = path
+        self._shards = shards
+        self.cache_manager = None
+        self._procs = []
+        self._commands = []
+        self._results = []
+        for shard in xrange(shards):
+            commands = multiprocessing.Queue(max_pending)
+            results = multiprocessing.Queue()
+            proc = multiprocessing.Process(target=_shard_worker,
+                args=(_shard_path(path, shard), dbtype, shard, shards,
+                      commands, results))
+            proc.daemon = True
+            proc.start()
+            self._procs.append(proc)
+            self._commands.append(commands)
+            self._results.append(results)
+
+        # Use a true value for _index, so that the usual checks for a closed
+        # connection work.
+        self._index = True
+        try:
+            exc_info = None
+            for shard in xrange(shards):
+                try:
+                    self._wait(shard)
+                except:
+                    if exc_info is None:
+                        exc_info = sys.exc_info()
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            configs = self._call_all('_get_processing_config')
+            for config in configs[1:]:
+                if config != configs[0]:
+                    raise errors.IndexerError("Shards of index at %r have "
+                                              "different configurations" %
+                                              path)
+            self._load_mappings(configs[0])
+            self._id_allocator = _ShardedIdAllocator(_ShardedIdIndex(self), 0)
+        except:
+            self._terminate()
+            raise
+
+    def __del__(self):
+        self.close()
+
+    def _load_mappings(self, config):
+        """Set the field mappings from a processing configuration.
+
+        """
+        actions, mappings = cPickle.loads(config)
+        self._field_mappings = fieldmappings.FieldMappings(mappings)
+
+    def _check_open(self):
+        if self._index is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+
+    def _put(self, shard, item):
+        """Put an item on the command queue for a shard.
+
+        """
+        while True:
+            try:
+                self._commands[shard].put(item, True, 1)
+                return
+            except Queue.Full:
+                if not self._procs[shard].is_alive():
+                    raise errors.IndexerError("Process for shard %d has "
+                                              "died" % shard)
+
+    def _wait(self, shard):
+        """Wait for the result of a command from a shard.
+
+        """
+        while True:
+            try:
+                success, result = self._results[shard].get(True, 1)
+                break
+            except Queue.Empty:
+                if not self._procs[shard].is_alive():
+                    raise errors.IndexerError("Process for shard %d has "
+                                              "died" % shard)
+        if not success:
+            raise result
+        return result
+
+    def _send(self, shard, name, *args, **kwargs):
+        """Send a command to a shard, without waiting for the result.
+
+        """
+        self._put(shard, (name, args, kwargs, False))
+
+    def _call(self, shard, name, *args, **kwargs):
+        """Call a method on a shard, and return the result.
+
+        """
+        self._put(shard, (name, args, kwargs, True))
+        return self._wait(shard)
+
+    def _call_all(self, name, *args, **kwargs):
+        """Call a method on all the shards, and return a list of the results.
+
+        The command is sent to all the shards before waiting for any of the
+        results, so they run in parallel.  If any of the shards report an
+        error, the first error is raised once all the shards have finished.
+
+        """
+        for shard in xrange(self._shards):
+            self._put(shard, (name, args, kwargs, True))
+        results = []
+        exc_info = None
+        for shard in xrange(self._shards):
+            # Wait for every shard, even after an error, so that no replies
+            # are left unread to be mistaken for the results of later calls.
+            try:
+                results.append(self._wait(shard))
+            except:
+                if exc_info is None:
+                    exc_info = sys.exc_info()
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return results
+
+    def _config_call(self, name, *args, **kwargs):
+        """Call a method which modifies the configuration, on all shards.
+
+        """
+        self._check_open()
+        self._call_all(name, *args, **kwargs)
+        self._load_mappings(self._call(0, '_get_processing_config'))
+
+    def add_field_action(self, fieldname, fieldtype, **kwargs):
+        """Add an action to be performed on a field.
+
+        See IndexerConnection.add_field_action().
+
+        """
+        self._config_call('add_field_action', fieldname, fieldtype, **kwargs)
+
+    def clear_field_actions(self, fieldname):
+        """Clear all actions for the specified field.
+
+        See IndexerConnection.clear_field_actions().
+
+        """
+        self._config_call('clear_field_actions', fieldname)
+
+    def get_fields_with_actions(self):
+        """Get a list of field names which have actions defined.
+
+        """
+        self._check_open()
+        return self._call(0, 'get_fields_with_actions')
+
+    def add_synonym(self, original, synonym, field=None,
+                    original_field=None, synonym_field=None):
+        """Add a synonym to the index (see IndexerConnection.add_synonym()).
+
+        """
+        self._config_call('add_synonym', original, synonym, field=field,
+                          original_field=original_field,
+                          synonym_field=synonym_field)
+
+    def remove_synonym(self, original, synonym, field=None):
+        """Remove a synonym from the index.
+
+        """
+        self._config_call('remove_synonym', original, synonym, field)
+
+    def clear_synonyms(self, original, field=None):
+        """Remove all synonyms for a word or phrase.
+
+        """
+        self._config_call('clear_synonyms', original, field)
+
+    def add_subfacet(self, subfacet, facet):
+        """Add a subfacet-facet relationship to the facet hierarchy.
+
+        """
+        self._config_call('add_subfacet', subfacet, facet)
+
+    def remove_subfacet(self, subfacet):
+        """Remove any existing facet hierarchy relationship for a subfacet.
+
+        """
+        self._config_call('remove_subfacet', subfacet)
+
+    def set_facet_for_query_type(self, query_type, facet, association):
+        """Set the association between a query type and a facet.
+
+        """
+        self._config_call('set_facet_for_query_type', query_type, facet,
+                          association)
+
+    def set_metadata(self, key, value):
+        """Set an item of metadata stored in the index.
+
+        The metadata is stored in all the shards.
+
+        """
+        self._check_open()
+        self._call_all('set_metadata', key, value)
+
+    def get_metadata(self, key):
+        """Get an item of metadata stored in the index.
+
+        """
+        self._check_open()
+        return self._call(0, 'get_metadata', key)
+
+    def get_doccount(self):
+        """Count the number of documents in the index.
+
+        This includes documents which haven't yet been flushed.
+
+        """
+        self._check_open()
+        return sum(self._call_all('get_doccount'))
+
+    def _send_document(self, cmd, id, document, store_only):
+        """Send a document to the shard which it belongs in.
+
+        `cmd` is the name of the command to perform with the document ('add'
+        or 'replace').
+
+        Note that the queues pickle the items put on them in a background
+        thread, so the item sent must not be modified afterwards: a copy of
+        the document is therefore sent.
+
+        """
+        if hasattr(document, '_doc'):
+            cmd = '_' + cmd
+            item = document._get_transport_state()
+        else:
+            item = document.__class__(id, list(document.fields))
+        self._send(shard_for_id(id, self._shards), cmd, item, store_only)
+
+    def add(self, document, store_only=False):
+        """Add a new document to the index.
+
+        See IndexerConnection.add().  Note that an error caused by the document
+        having an ID which is already in use will be reported by the next call
+        to flush().
+
+        """
+        self._check_open()
+        id = document.id
+        if id is None:
+            id = self._id_allocator.allocate()
+            if hasattr(document, '_doc'):
+                document = ProcessedDocument._from_transport_state(
+                    self._field_mappings, document._get_transport_state())
+                document.id = id
+        else:
+            self._id_allocator.note_id(id)
+        self._send_document('add', id, document, store_only)
+        return id
+
+    def replace(self, document, store_only=False, xapid=None):
+        """Replace a document in the index.
+
+        See IndexerConnection.replace().  The `xapid` parameter isn't
+        supported for sharded indexes.
+
+        """
+        self._check_open()
+        if xapid is not None:
+            raise errors.IndexerError("Documents in a sharded index can't be "
+                                      "replaced by xapian document ID")
+        id = document.id
+        if id is None:
+            raise errors.IndexerError("No document ID set for document "
+                                      "supplied to replace().")
+        self._id_allocator.note_id(id)
+        self._send_document('replace', id, document, store_only)
+
+    def add_many(self, documents, store_only=False):
+        """Add a sequence of new documents to the index.
+
+        The documents are processed in parallel by the processes writing to
+        each shard.  Returns a list of the ids of the added documents.
+
+        """
+        return [self.add(document, store_only) for document in documents]
+
+    def replace_many(self, documents, store_only=False):
+        """Replace a sequence of documents in the index.
+
+        """
+        for document in documents:
+            self.replace(document, store_only)
+
+    def delete(self, id=None, xapid=None):
+        """Delete a document from the index.
+
+        The `xapid` parameter isn't supported for sharded indexes.
+
+        """
+        self._check_open()
+        if xapid is not None or id is None:
+            raise errors.IndexerError("Documents in a sharded index must be "
+                                      "deleted by document ID")
+        self._send(shard_for_id(id, self._shards), 'delete', id)
+
+    def update_fields(self, id, fields):
+        """Change the contents of some fields of a document.
+
+        See IndexerConnection.update_fields().  Documents in a sharded index
+        must be specified by document ID, and any error (eg, if the document
+        doesn't exist) will be reported by the next call to flush().
+
+        """
+        self._check_open()
+        if id is None:
+            raise errors.IndexerError("Documents in a sharded index must be "
+                                      "updated by document ID")
+        self._send(shard_for_id(id, self._shards), 'update_fields', id,
+                   fields)
+
+    def get_document(self, id):
+        """Get the document with the specified unique ID.
+
+        Raises a KeyError if there is no such document.
+
+        """
+        self._check_open()
+        state = self._call(shard_for_id(id, self._shards), '_get_document', id)
+        return ProcessedDocument._from_transport_state(self._field_mappings,
+                                                       state)
+
+    def set_cache_manager(self, cache_manager):
+        """Set the cache manager.
+
+        The cache manager should refer to documents by their xapian document
+        IDs in the merged database (ie, as seen by a ShardedSearchConnection).
+
+        """
+        self.cache_manager = cache_manager
+
+    def apply_cached_items(self):
+        """Apply the items in the cache manager to the shards.
+
+        See XapianCacheManager.apply_cached_items().
+
+        """
+        self._check_open()
+        cm = self.cache_manager
+        if cm is None:
+            raise RuntimeError("Need to set a cache manager before calling "
+                               "apply_cached_items()")
+        caches_meta = self.get_metadata('caches')
+        caches = decode(caches_meta) if caches_meta else {}
+        num_cache_slots = int(self.get_metadata('num_cache_slots') or '0')
+        if cm.id not in caches:
+            caches[cm.id] = num_cache_slots
+        num_cache_slots += cm.num_cached_queries()
+        self._call_all('set_metadata', 'num_cache_slots', str(num_cache_slots))
+        self._call_all('set_metadata', 'caches', encode(caches))
+        self._call_all('set_metadata', '_xappy_hascache', '1')
+        base_slot = BASE_CACHE_SLOT + caches[cm.id]
+
+        batches = [[] for shard in xrange(self._shards)]
+        for xapid, items in cm.iter_by_docid():
+            shard, shard_xapid = split_xapid(xapid, self._shards)
+            values = [(base_slot + queryid,
+                       xapian.sortable_serialise(CACHE_MANAGER_MAX_HITS -
+                                                 rank))
+                      for queryid, rank in items]
+            batch = batches[shard]
+            batch.append((shard_xapid, values))
+            if len(batch) >= 1000:
+                self._send(shard, '_set_values', batch)
+                batches[shard] = []
+        for shard, batch in enumerate(batches):
+            if batch:
+                self._send(shard, '_set_values', batch)
+
+    def _apply_cache_removals(self, removals):
+        """Remove cached hits for documents which were deleted or replaced.
+
+        """
+        if not removals:
+            return
+        cm = self.cache_manager
+        if cm is None:
+            raise errors.IndexerError("CacheManager has been applied to this "
+                                      "index, but is not currently set.")
+        caches_meta = self.get_metadata('caches')
+        caches = decode(caches_meta) if caches_meta else {}
+        if hasattr(cm, 'caches'):
+            managers = cm.caches.values()
+        else:
+            managers = [cm]
+        ranges = []
+        for manager in managers:
+            base_slot = BASE_CACHE_SLOT + caches.get(manager.id, 0)
+            ranges.append((base_slot,
+                           base_slot + manager.num_cached_queries(),
+                           manager))
+        for slot, rank, xapid in removals:
+            for base_slot, upper_slot, manager in ranges:
+                if base_slot <= slot < upper_slot:
+                    manager.remove_hits(slot - base_slot, ((rank, xapid),))
+                    break
+
+    def flush(self):
+        """Apply recent changes to all the shards.
+
+        This waits for all the shards to finish writing the changes sent to
+        them, and raises the first error which occurred (if any) since the
+        last flush.
+
+        """
+        self._check_open()
+        self._id_allocator.save()
+        exc_info = None
+        try:
+            self._call_all('flush')
+        except:
+            exc_info = sys.exc_info()
+        removals = []
+        for result in self._call_all('_take_cache_removals'):
+            removals.extend(result)
+        self._apply_cache_removals(removals)
+        if self.cache_manager is not None:
+            self.cache_manager.flush()
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def close(self):
+        """Close the connection, flushing any unflushed changes.
+
+        """
+        if self._index is None:
+            return
+        exc_info = None
+        try:
+            self.flush()
+        except:
+            exc_info = sys.exc_info()
+        for shard in xrange(self._shards):
+            self._put(shard, (None, (), {}, False))
+        for shard in xrange(self._shards):
+            try:
+                self._wait(shard)
+            except:
+                if exc_info is None:
+                    exc_info = sys.exc_info()
+            self._procs[shard].join()
+        self._index = None
+        self._id_allocator = None
+        if self.cache_manager is not None:
+            self.cache_manager.close()
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _terminate(self):
+        """Stop the shard processes immediately, discarding any changes.
+
+        """
+        for proc in self._procs:
+            if proc.is_alive():
+                proc.terminate()
+            proc.join()
+        self._index = None
+
+class ShardedSearchConnection(SearchConnection):
+    """A connection for searching a sharded index.
+
+    All the shards are searched together, as a single database (using
+    `xapian.Database.add_database()`), so this supports all the methods of
+    SearchConnection.  Xapian document IDs refer to the merged database: use
+    `split_xapid()` to find the shard and document ID within the shard.
+
+    """
+    def __init__(self, path):
+        """Open a connection to the sharded index at `path`.
+
+        """
+        shards = _find_shards(path)
+        if shards == 0:
+            raise errors.SearchError("No sharded index found at %r" % path)
+        self._shards = shards
+        self._shard_paths = [_shard_path(path, shard)
+                             for shard in xrange(shards)]
+        self.cache_manager = None
+        self._indexpath = path
+        self._close_handlers = []
+        self._index = xapian.Database()
+        self._shard_indexes = []
+        for shardpath in self._shard_paths:
+            shard_index = xapian.Database(shardpath)
+            self._shard_indexes.append(shard_index)
+            self._index.add_database(shard_index)
+        try:
+            self._load_config()
+        except:
+            if hasattr(self._index, 'close'):
+                self._index.close()
+            self._index = None
+            raise
+        self._imgterms_cache = {}
+
+    def get_shard_count(self):
+        """Get the number of shards in the index.
+
+        """
+        return self._shards
+
+    def _get_blob_loader(self, xapid):
+        """Get the function used to read the blobs of a document.
+
+        Blobs are stored in the metadata of the shard holding the document,
+        whereas the metadata of the merged database is that of the first
+        shard, so the blobs are read from the shard.
+
+        """
+        shard, _ = split_xapid(xapid, self._shards)
+        return self._make_blob_loader(self._shard_indexes[shard])
@@ -0,0 +1,129 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+import threading
+import time
+
+class TestAsyncSearch(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        iconn = xappy.IndexerConnection(self.indexpath)
+        iconn.add_field_action('a', xappy.FieldActions.INDEX_FREETEXT,
+                               spell=True)
+        iconn.add_field_action('a', xappy.FieldActions.STORE_CONTENT)
+        iconn.add_field_action('f', xappy.FieldActions.FACET)
+        for i in xrange(10):
+            doc = xappy.UnprocessedDocument()
+            doc.id = str(i)
+            doc.append('a', 'document %d' % i)
+            doc.append('f', 'facet%d' % (i % 2))
+            iconn.add(doc)
+        iconn.flush()
+        iconn.close()
+        self.conn = xappy.AsyncSearchConnection(self.indexpath, workers=2,
+                                                max_pending=2)
+
+    def post_test(self):
+        self.conn.close()
+
+    def test_calls(self):
+        results = self.conn.search('document', 0, 3).result(10)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results.matches_estimated, 10)
+        self.assertTrue(results[0].data['a'][0].startswith('document '))
+
+        future = self.conn.search('document', 0, 10,
+                                  process=lambda results: len(results))
+        self.assertEqual(future.result(10), 10)
+
+        doc = self.conn.get_document('3').result(10)
+        self.assertEqual(doc.data['a'], ['document 3'])
+
+        self.assertEqual(self.conn.spell_correct('documant').result(10),
+                         'document')
+
+        facets = self.conn.get_suggested_facets('document',
+                                                checkatleast=-1).result(10)
+        self.assertEqual([(field, list(values)) for field, values in facets],
+                         [('f', [('facet0', 5), ('facet1', 5)])])
+
+        # Errors are raised when the result is requested.
+        future = self.conn.get_document('missing')
+        self.assertRaises(KeyError, future.result, 10)
+        self.assertTrue(isinstance(future.exception(), KeyError))
+
+    def test_detached(self):
+        # Results don't refer to the worker's connection, so can be read while
+        # the workers perform other searches.
+        results = self.conn.search('document', 0, 10, getfacets=True,
+                                   checkatleast=-1).result(10)
+        doc = self.conn.get_document('3').result(10)
+        expected = [(hit.id, hit.data['a']) for hit in results]
+        self.assertEqual(len(expected), 10)
+        futures = [self.conn.search('document', 0, 10) for i in xrange(2)]
+        for i in xrange(20):
+            self.assertEqual([(hit.id, hit.data['a']) for hit in results],
+                             expected)
+            self.assertEqual(results[3].id, expected[3][0])
+        for future in futures:
+            future.result(10)
+        self.assertEqual(results.matches_estimated, 10)
+        self.assertEqual(list(results.get_facets()['f']),
+                         [('facet0', 5), ('facet1', 5)])
+        self.assertRaises(xappy.SearchError, results[0].summarise, 'a')
+
+        # They can still be read once the connection has been closed.
+        self.conn.close()
+        self.assertEqual([(hit.id, hit.data['a']) for hit in results],
+                         expected)
+        self.assertEqual(doc.id, '3')
+        self.assertEqual(doc.data['a'], ['document 3'])
+
+    def test_cancel_and_timeout(self):
+        # Block both workers, so that further calls stay pending.
+        event = threading.Event()
+        blocked = [self.conn.submit(lambda conn: event.wait(10))
+                   for i in xrange(2)]
+        while not (blocked[0].running() and blocked[1].running()):
+            time.sleep(0.01)
+
+        called = []
+        pending = self.conn.search('document', 0, 10)
+        pending.add_done_callback(called.append)
+        timed = self.conn.search('document', 0, 10, timeout=0.01)
+        # The queue of pending calls is full.
+        self.assertRaises(xappy.SearchError, self.conn.search, 'document',
+                          0, 10)
+
+        self.assertTrue(pending.cancel())
+        self.assertTrue(pending.cancelled())
+        self.assertEqual(called, [pending])
+        self.assertRaises(xappy.SearchError, pending.result)
+        self.assertRaises(xappy.SearchError, timed.result, 10)
+        self.assertFalse(blocked[0].cancel())
+
+        event.set()
+        for future in blocked:
+            future.result(10)
+        self.assertEqual(len(self.conn.search('document', 0, 10).result(10)),
+                         10)
+
+if __name__ == '__main__':
+    main()
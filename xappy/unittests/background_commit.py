@@ -0,0 +1,86 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+from xappy import flushpolicy
+
+class TestBackgroundCommit(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        self.iconn = xappy.IndexerConnection(self.indexpath)
+        self.iconn.add_field_action('a', xappy.FieldActions.INDEX_FREETEXT,
+                                    spell=True)
+        self.iconn.add_field_action('a', xappy.FieldActions.STORE_CONTENT)
+        self.iconn.set_background_commit()
+
+    def post_test(self):
+        self.iconn.close()
+
+    def _doc(self, id, text):
+        doc = xappy.UnprocessedDocument(id)
+        doc.append('a', text)
+        return doc
+
+    def test_pipelined(self):
+        ids = []
+        for batch in xrange(5):
+            for i in xrange(100):
+                ids.append(self.iconn.add(self._doc(None, 'word%d' % i)))
+            self.iconn.flush()
+        self.iconn.replace(self._doc(ids[0], 'replaced'))
+        self.iconn.delete(ids[1])
+        self.iconn.wait_for_commit()
+
+        self.assertEqual(len(set(ids)), 500)
+        self.assertEqual(self.iconn.get_doccount(), 499)
+        self.assertEqual(self.iconn.get_document(ids[0]).data['a'],
+                         ['replaced'])
+        self.assertEqual(self.iconn.get_indexing_stats().flush_count, 5)
+
+        self.iconn.close()
+        sconn = xappy.SearchConnection(self.indexpath)
+        self.assertEqual(sconn.get_doccount(), 499)
+        self.assertEqual(sconn.search(sconn.query_parse('word7'),
+                                      0, 10).matches_estimated, 5)
+        self.assertEqual(sconn.spell_correct('wrd7'), 'word7')
+        sconn.close()
+
+    def test_flush_policy(self):
+        self.iconn.set_flush_policy(flushpolicy.DocCountFlushPolicy(10))
+        for i in xrange(95):
+            self.iconn.add(self._doc(str(i), 'text'))
+        self.iconn.close()
+        sconn = xappy.SearchConnection(self.indexpath)
+        self.assertEqual(sconn.get_doccount(), 95)
+        sconn.close()
+
+    def test_queued_error(self):
+        self.iconn.add(self._doc('1', 'text'))
+        self.iconn.flush()
+        def add_duplicate():
+            # The error is raised either immediately, or when the queued
+            # document is written.
+            self.iconn.add(self._doc('1', 'text'))
+            self.iconn.wait_for_commit()
+        self.assertRaises(xappy.DuplicatedIdError, add_duplicate)
+        self.iconn.wait_for_commit()
+        self.assertEqual(self.iconn.get_doccount(), 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+
+class TestBulkBuild(TestCase):
+    def pre_test(self):
+        self.dbpath = os.path.join(self.tempdir, 'db')
+
+    def make_builder(self, **kwargs):
+        builder = xappy.BulkBuilder(self.dbpath, tmpdir=self.tempdir,
+                                    **kwargs)
+        builder.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT,
+                                 spell=True)
+        builder.add_field_action('text', xappy.FieldActions.STORE_CONTENT)
+        builder.add_field_action('cat', xappy.FieldActions.FACET)
+        builder.add_synonym('doc', 'document')
+        return builder
+
+    def make_docs(self, count):
+        for i in xrange(count):
+            doc = xappy.UnprocessedDocument()
+            doc.append('text', 'Document %d' % i)
+            doc.append('cat', 'cat%d' % (i % 2))
+            yield doc
+
+    def test_build(self):
+        """Test building an index with several processes.
+
+        """
+        builder = self.make_builder(processes=3, chunksize=7)
+        ids = builder.add_many(self.make_docs(100))
+        doc = xappy.UnprocessedDocument('explicit')
+        doc.append('text', 'Explicit document')
+        builder.add(doc)
+        self.assertRaises(xappy.DuplicatedIdError, builder.add, doc)
+        self.assertRaises(xappy.IndexerError, builder.add_field_action,
+                          'other', xappy.FieldActions.INDEX_EXACT)
+        self.assertEqual(builder.finish(), 101)
+        self.assertEqual(os.listdir(self.tempdir), ['db'])
+
+        sconn = xappy.SearchConnection(self.dbpath)
+        self.assertEqual(sconn.get_doccount(), 101)
+        self.assertEqual(sorted(sconn.iterids()), sorted(ids + ['explicit']))
+        self.assertEqual(sconn.get_document('a').data['text'],
+                         ['Document 10'])
+        results = sconn.search(sconn.query_parse('doc'), 0, 200)
+        self.assertEqual(len(results), 101)
+        self.assertEqual(sconn.spell_correct('documant'), 'document')
+        sconn.close()
+
+        # New documents get IDs which don't clash with the built ones.
+        iconn = xappy.IndexerConnection(self.dbpath)
+        self.assertEqual(sorted(iconn.get_fields_with_actions()),
+                         ['cat', 'text'])
+        doc = xappy.UnprocessedDocument()
+        doc.append('text', 'New document')
+        self.assertFalse(iconn.add(doc) in ids)
+        iconn.close()
+
+    def test_duplicate_ids(self):
+        """Test that explicit and allocated IDs don't clash.
+
+        """
+        builder = self.make_builder(processes=1)
+        docs = list(self.make_docs(4))
+        self.assertEqual(builder.add(docs[0]), '0')
+        docs[1].id = '0'
+        self.assertRaises(xappy.DuplicatedIdError, builder.add, docs[1])
+        docs[1].id = '2'
+        self.assertEqual(builder.add(docs[1]), '2')
+        self.assertEqual(builder.add(docs[2]), '1')
+        self.assertEqual(builder.add(docs[3]), '3')
+        self.assertEqual(builder.finish(), 4)
+
+        sconn = xappy.SearchConnection(self.dbpath)
+        self.assertEqual(sorted(sconn.iterids()), ['0', '1', '2', '3'])
+        sconn.close()
+
+    def test_existing_path(self):
+        """Test that an existing index can't be overwritten.
+
+        """
+        iconn = xappy.IndexerConnection(self.dbpath)
+        iconn.close()
+        self.assertRaises(xappy.IndexerError, xappy.BulkBuilder, self.dbpath)
+
+    def test_abort(self):
+        """Test abandoning a build.
+
+        """
+        builder = self.make_builder(processes=2)
+        builder.add_many(self.make_docs(10))
+        builder.abort()
+        self.assertEqual(os.listdir(self.tempdir), [])
+        self.assertRaises(xappy.IndexerError, builder.finish)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+import cPickle
+from xappy.fieldactions import ActionContext
+
+class TestCompiledActions(TestCase):
+    def pre_test(self):
+        self.dbpath = os.path.join(self.tempdir, 'db')
+        self.iconn = xappy.IndexerConnection(self.dbpath)
+        self.iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT,
+                                    language='en', stop=('the',))
+        self.iconn.add_field_action('num', xappy.FieldActions.SORTABLE,
+                                    type='float')
+
+    def post_test(self):
+        self.iconn.close()
+
+    def terms(self, pdoc):
+        return [item.term for item in pdoc._doc.termlist()]
+
+    def test_reuse(self):
+        """Test that processing several documents with the same compiled
+        actions gives independent results.
+
+        """
+        doc1 = xappy.UnprocessedDocument()
+        doc1.append('text', 'the running man')
+        doc2 = xappy.UnprocessedDocument()
+        doc2.append('text', 'a walking dog')
+        doc2.append('num', '7')
+        pdoc1 = self.iconn.process(doc1)
+        pdoc2 = self.iconn.process(doc2)
+        pdoc1b = self.iconn.process(doc1)
+        self.assertEqual(self.terms(pdoc1), self.terms(pdoc1b))
+        self.assertTrue('Zrun' in self.terms(pdoc1))
+        self.assertFalse('the' in self.terms(pdoc1))
+        self.assertFalse('running' in self.terms(pdoc2))
+        self.assertEqual(pdoc2.get_value('num', 'collsort'),
+                         xappy.marshall.float_to_string(7))
+
+    def test_invalidate(self):
+        """Test that changing the actions for a field takes effect.
+
+        """
+        doc = xappy.UnprocessedDocument()
+        doc.append('text', 'hello world')
+        self.assertEqual(self.iconn.process(doc).data, {})
+        self.iconn.add_field_action('text', xappy.FieldActions.STORE_CONTENT)
+        self.assertEqual(self.iconn.process(doc).data,
+                         {'text': ['hello world']})
+        self.iconn.clear_field_actions('text')
+        self.assertEqual(self.terms(self.iconn.process(doc)), [])
+
+    def test_field_perform(self):
+        """Test that FieldActions.perform() reuses its compiled actions.
+
+        """
+        actions = self.iconn._field_actions['text']
+        context = ActionContext(self.iconn)
+        field = xappy.Field('text', 'hello world')
+        pdoc = xappy.ProcessedDocument(self.iconn._field_mappings)
+        actions.perform(pdoc, field, context)
+        compiled = actions._compiled
+        self.assertNotEqual(compiled, None)
+        actions.perform(pdoc, field, context)
+        self.assertTrue(actions._compiled is compiled)
+        self.assertTrue('Zhello' in self.terms(pdoc))
+
+        # The compiled actions aren't pickled with the configuration.
+        actions2 = cPickle.loads(cPickle.dumps(actions, 2))
+        self.assertEqual(actions2._compiled, None)
+        self.assertEqual(actions2._actions, actions._actions)
+
+        # Adding an action discards them.
+        actions.add(self.iconn._field_mappings,
+                    xappy.FieldActions.STORE_CONTENT)
+        self.assertEqual(actions._compiled, None)
+        pdoc = xappy.ProcessedDocument(self.iconn._field_mappings)
+        actions.perform(pdoc, field, context)
+        self.assertEqual(pdoc.data, {'text': ['hello world']})
+
+    def test_bad_sort_type(self):
+        """Test that an unknown sort type is reported when processing.
+
+        """
+        self.iconn.add_field_action('bad', xappy.FieldActions.FACET,
+                                    type='wibble')
+        doc = xappy.UnprocessedDocument()
+        doc.append('bad', '1')
+        self.assertRaises(xappy.IndexerError, self.iconn.process, doc)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+
+class TestDeferredSpelling(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        self.iconn = xappy.IndexerConnection(self.indexpath)
+        self.iconn.add_field_action('a', xappy.FieldActions.INDEX_FREETEXT,
+                                    spell=True, stop=('the',))
+        self.iconn.add_field_action('b', xappy.FieldActions.INDEX_FREETEXT)
+        self.iconn.set_deferred_spelling()
+        for i in xrange(5):
+            doc = xappy.UnprocessedDocument()
+            doc.append('a', 'the document number %d' % i)
+            if i == 0:
+                doc.append('a', 'speling')
+            doc.append('b', 'unrelated words')
+            self.iconn.add(doc)
+        self.iconn.add_many([xappy.UnprocessedDocument(None,
+                                [xappy.Field('a', 'parallel document')])],
+                            processes=1)
+        self.iconn.flush()
+
+    def post_test(self):
+        self.iconn.close()
+
+    def _spellings(self):
+        return sorted((item.term, item.termfreq)
+                      for item in self.iconn._index.spellings())
+
+    def test_build_spelling(self):
+        # Nothing is added to the spelling table while indexing.
+        self.assertEqual(self._spellings(), [])
+
+        self.assertEqual(self.iconn.build_spelling(), 9)
+        self.iconn.flush()
+        spellings = self._spellings()
+        self.assertTrue(('document', 6) in spellings)
+        self.assertTrue(('speling', 1) in spellings)
+        self.assertTrue(('parallel', 1) in spellings)
+        self.assertFalse(('the', 5) in spellings)
+        self.assertFalse('unrelated' in [term for term, freq in spellings])
+
+        sconn = xappy.SearchConnection(self.indexpath)
+        self.assertEqual(sconn.spell_correct('documant'), 'document')
+        sconn.close()
+
+    def test_min_freq(self):
+        self.assertEqual(self.iconn.build_spelling(min_freq=2), 2)
+        self.assertEqual(self._spellings(), [('document', 6), ('number', 5)])
+
+        # Rebuilding replaces the existing table.
+        self.assertEqual(self.iconn.build_spelling(fields=['b']), 2)
+        self.assertEqual(self._spellings(), [('unrelated', 5), ('words', 5)])
+
+if __name__ == '__main__':
+    main()
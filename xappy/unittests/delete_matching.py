@@ -0,0 +1,66 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+from xappy.datastructures import _blob_key
+
+class TestDeleteMatching(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        self.iconn = xappy.IndexerConnection(self.indexpath)
+        self.iconn.add_field_action('status', xappy.FieldActions.INDEX_EXACT)
+        self.iconn.add_field_action('body', xappy.FieldActions.STORE_CONTENT,
+                                    out_of_line=True)
+        for i in xrange(25):
+            doc = xappy.UnprocessedDocument(str(i))
+            doc.append('status', i % 5 == 0 and 'live' or 'expired')
+            doc.append('body', 'body %d' % i)
+            self.iconn.add(doc)
+        self.iconn.flush()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+    def post_test(self):
+        self.sconn.close()
+        self.iconn.close()
+
+    def test_delete_matching(self):
+        query = self.sconn.query_field('status', 'expired')
+        self.assertEqual(self.iconn.delete_matching(query, dry_run=True), 20)
+        self.assertEqual(self.iconn.get_doccount(), 25)
+
+        self.assertEqual(self.iconn.delete_matching(query, batch_size=3), 20)
+        self.assertEqual(self.iconn.get_doccount(), 5)
+        self.assertEqual(self.iconn.delete_matching(query), 0)
+        self.iconn.flush()
+
+        self.assertEqual(sorted(self.iconn.iterids()),
+                         ['0', '10', '15', '20', '5'])
+        self.assertEqual(self.iconn.get_metadata(_blob_key('body', '1')), '')
+        self.assertEqual(self.iconn.get_document('5').get_data('body'),
+                         ['body 5'])
+
+    def test_xapian_query(self):
+        import xapian
+        self.iconn.delete_matching(xapian.Query('Q3'))
+        self.assertEqual(self.iconn.get_doccount(), 24)
+        self.assertRaises(xappy.IndexerError, self.iconn.delete_matching,
+                          xapian.Query('Q3'), batch_size=0)
+
+if __name__ == '__main__':
+    main()
@@ -102,6 +102,18 @@ class DifferenceSearchTest(TestCase):
         dist = self.make_dist_comp(val, field)
         filtered = filter(lambda x: dist(x) < 3, res)
         self.assert_(len(filtered) == 6)
+        # A difference function passed as a callable can't be rebuilt from
+        # the serialised form of the query.
+        self.assertEqual(query._get_portable_repr(), None)
+
+    def test_portable(self):
+        """Test that difference queries with a string function are portable.
+
+        """
+        for approx in (True, False):
+            query = self.sconn.query_difference('foo', 5, 'collsort',
+                                                approx=approx)
+            self.assertNotEqual(query._get_portable_repr(), None)
 
     def test_cuttoff_facet_approx(self):
         self.cutoff_test(5, 'bar', 'facet')
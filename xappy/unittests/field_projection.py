@@ -0,0 +1,129 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+
+class TestFieldProjection(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        iconn = xappy.IndexerConnection(self.indexpath)
+        iconn.add_field_action('title', xappy.FieldActions.STORE_CONTENT)
+        iconn.add_field_action('title', xappy.FieldActions.INDEX_FREETEXT)
+        iconn.add_field_action('tag', xappy.FieldActions.STORE_CONTENT)
+        iconn.add_field_action('body', xappy.FieldActions.STORE_CONTENT,
+                               out_of_line=True)
+        iconn.add_field_action('body', xappy.FieldActions.INDEX_FREETEXT)
+        for i in xrange(5):
+            doc = xappy.UnprocessedDocument(str(i))
+            doc.append('title', 'Title %d' % i)
+            doc.append('tag', 'tag%d' % i)
+            doc.append('body', 'The body of document %d ' % i * 50)
+            iconn.add(doc)
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def test_get_document(self):
+        doc = self.sconn.get_document('1')
+        self.assertEqual(doc.data, {'title': ['Title 1'], 'tag': ['tag1']})
+        self.assertEqual(doc.get_data('body'),
+                         ['The body of document 1 ' * 50])
+
+        doc = self.sconn.get_document('1', fields=['title', 'body'])
+        self.assertEqual(doc.data, {'title': ['Title 1'],
+                                    'body': ['The body of document 1 ' * 50]})
+        self.assertEqual(doc.get_data('tag'), ['tag1'])
+
+        doc = self.sconn.get_document('1', fields=['tag'])
+        self.assertEqual(doc.data, {'tag': ['tag1']})
+
+    def test_search(self):
+        results = self.sconn.search(self.sconn.query_field('body', 'document'),
+                                    0, 10, fields=['title'])
+        self.assertEqual(len(results), 5)
+        for result in results:
+            self.assertEqual(result.data.keys(), ['title'])
+        # Fields outside the projection can still be summarised.
+        self.assertTrue('<b>document</b>' in results[0].summarise('body'))
+
+    def test_iter_documents(self):
+        docs = list(self.sconn.iter_documents(fields=('title',)))
+        self.assertEqual(sorted(doc.data['title'][0] for doc in docs),
+                         ['Title %d' % i for i in xrange(5)])
+        for doc in docs:
+            self.assertEqual(doc.data.keys(), ['title'])
+
+    def test_update_and_delete(self):
+        self.sconn.close()
+        iconn = xappy.IndexerConnection(self.indexpath)
+
+        # Writing back a projected document keeps the other fields.
+        doc = iconn.get_document('2', fields=['title'])
+        doc.data['title'] = ['New title']
+        iconn.replace(doc)
+        doc = iconn.get_document('2')
+        self.assertEqual(doc.data, {'title': ['New title'], 'tag': ['tag2']})
+        self.assertEqual(doc.get_data('body'),
+                         ['The body of document 2 ' * 50])
+
+        # Replacing a document with one with no body removes the blob.
+        key = doc._get_blob_keys()[0]
+        doc = xappy.UnprocessedDocument('2')
+        doc.append('title', 'Title 2')
+        iconn.replace(doc)
+        self.assertEqual(iconn.get_metadata(key), '')
+
+        # Deleting a document removes its blob.
+        key = iconn.get_document('3')._get_blob_keys()[0]
+        self.assertNotEqual(iconn.get_metadata(key), '')
+        iconn.delete('3')
+        self.assertEqual(iconn.get_metadata(key), '')
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+    def test_long_id(self):
+        """Test out-of-line fields of a document with a long ID.
+
+        """
+        # The key of the blob doesn't get longer with the document ID, so
+        # long IDs can be used.
+        self.sconn.close()
+        iconn = xappy.IndexerConnection(self.indexpath)
+        longid = 'x' * 230
+        doc = xappy.UnprocessedDocument(longid)
+        doc.append('body', 'Long document')
+        iconn.add(doc)
+        iconn.flush()
+        key = iconn.get_document(longid)._get_blob_keys()[0]
+        self.assertTrue(len(key) < 100)
+        self.assertEqual(iconn.get_document(longid).get_data('body'),
+                         ['Long document'])
+
+        # A missing blob is an error, rather than an empty field.
+        iconn.set_metadata(key, '')
+        iconn.flush()
+        doc = iconn.get_document(longid)
+        self.assertRaises(xappy.SearchEngineError, doc.get_data, 'body')
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+if __name__ == '__main__':
+    main()
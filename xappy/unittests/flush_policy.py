@@ -0,0 +1,169 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+from xappy import flushpolicy
+
+class CountingPolicy(flushpolicy.DocCountFlushPolicy):
+    """A policy which records the number of resets.
+
+    """
+    resets = 0
+    def reset(self, stats):
+        self.resets += 1
+
+class BatchRecordingPolicy(flushpolicy.MemoryFlushPolicy):
+    """A memory policy which records the size of each batch flushed.
+
+    """
+    def __init__(self, *args, **kwargs):
+        flushpolicy.MemoryFlushPolicy.__init__(self, *args, **kwargs)
+        self.batches = []
+
+    def reset(self, stats):
+        if stats.flush_count > 0:
+            self.batches.append(stats.last_flush_docs)
+        flushpolicy.MemoryFlushPolicy.reset(self, stats)
+
+class TestFlushPolicy(TestCase):
+    def pre_test(self):
+        self.dbpath = os.path.join(self.tempdir, 'db')
+        self.iconn = xappy.IndexerConnection(self.dbpath)
+        self.iconn.add_field_action('a', xappy.FieldActions.INDEX_FREETEXT)
+
+    def post_test(self):
+        self.iconn.close()
+
+    def add_docs(self, count):
+        for i in xrange(count):
+            doc = xappy.UnprocessedDocument()
+            doc.append('a', 'Document %d' % i)
+            self.iconn.add(doc)
+
+    def test_doc_count(self):
+        """Test flushing after a number of documents.
+
+        """
+        policy = CountingPolicy(10)
+        self.iconn.set_flush_policy(policy)
+        self.assertEqual(policy.resets, 1)
+        self.add_docs(25)
+        stats = self.iconn.get_indexing_stats()
+        self.assertEqual(stats.flush_count, 2)
+        self.assertEqual(stats.docs_written, 25)
+        self.assertEqual(stats.docs_since_flush, 5)
+        self.assertEqual(stats.last_flush_docs, 10)
+        self.assertEqual(policy.resets, 3)
+
+        # The flushed documents should be visible to a search connection.
+        sconn = xappy.SearchConnection(self.dbpath)
+        self.assertEqual(sconn.get_doccount(), 20)
+        sconn.close()
+
+    def test_no_policy(self):
+        """Test that no automatic flushes happen by default.
+
+        """
+        self.add_docs(25)
+        self.iconn.set_max_mem_use(max_mem=1000000000)
+        self.add_docs(25)
+        self.iconn.set_max_mem_use()
+        self.add_docs(25)
+        stats = self.iconn.get_indexing_stats()
+        self.assertEqual(stats.flush_count, 0)
+        self.assertEqual(stats.docs_since_flush, 75)
+        self.iconn.flush()
+        self.assertEqual(stats.flush_count, 1)
+        self.assertEqual(stats.mean_flush_time, stats.flush_time)
+
+    def test_term_estimate(self):
+        """Test the term estimate policy.
+
+        """
+        self.iconn.set_flush_policy(
+            flushpolicy.TermEstimateFlushPolicy(1))
+        self.add_docs(3)
+        self.assertEqual(self.iconn.get_indexing_stats().flush_count, 3)
+
+    def test_memory(self):
+        """Test that the batches flushed by the memory policy don't grow.
+
+        """
+        from xappy import memutils
+        get_rss = memutils.get_rss
+        for retain in (False, True):
+            # Simulate a process in which each buffered document uses 1000
+            # bytes, and (if `retain` is set) memory freed by a flush isn't
+            # returned to the operating system.
+            iconn = None
+            state = {'peak': 0}
+            def fake_rss():
+                if iconn is None:
+                    return 1000000
+                used = iconn.get_indexing_stats().docs_since_flush * 1000
+                if retain:
+                    state['peak'] = max(state['peak'], used)
+                    used = state['peak']
+                return 1000000 + used
+            memutils.get_rss = fake_rss
+            try:
+                iconn = xappy.IndexerConnection(
+                    os.path.join(self.tempdir, 'mem%d' % retain))
+                iconn.add_field_action('a', xappy.FieldActions.INDEX_FREETEXT)
+                policy = BatchRecordingPolicy(50000, check_interval=10)
+                iconn.set_flush_policy(policy)
+                for i in xrange(500):
+                    doc = xappy.UnprocessedDocument()
+                    doc.append('a', 'Document %d' % i)
+                    iconn.add(doc)
+                self.assertEqual(policy.batches, [60] * 8)
+                self.assertEqual(iconn.get_indexing_stats().bytes_per_doc,
+                                 1000.0)
+                iconn.close()
+            finally:
+                memutils.get_rss = get_rss
+
+    def test_any(self):
+        """Test combining policies.
+
+        """
+        self.iconn.set_flush_policy(flushpolicy.AnyFlushPolicy(
+            flushpolicy.DocCountFlushPolicy(7),
+            flushpolicy.TimeFlushPolicy(3600)))
+        self.add_docs(15)
+        self.assertEqual(self.iconn.get_indexing_stats().flush_count, 2)
+
+    def test_adaptive(self):
+        """Test the bounds of the adaptive policy.
+
+        """
+        policy = flushpolicy.AdaptiveFlushPolicy(initial_docs=5, min_docs=2,
+                                                 max_docs=8)
+        self.iconn.set_flush_policy(policy)
+        self.add_docs(50)
+        self.assertTrue(2 <= policy.batch_docs <= 8)
+        self.assertTrue(self.iconn.get_indexing_stats().flush_count >= 6)
+
+        self.assertRaises(xappy.IndexerError, flushpolicy.AdaptiveFlushPolicy,
+                          min_docs=10, max_docs=5)
+        self.assertRaises(xappy.IndexerError, flushpolicy.AdaptiveFlushPolicy,
+                          target_overhead=2)
+
+if __name__ == '__main__':
+    main()
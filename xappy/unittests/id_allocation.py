@@ -0,0 +1,87 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+
+class TestIdAllocation(TestCase):
+    def pre_test(self):
+        self.dbpath = os.path.join(self.tempdir, 'db')
+        self.iconn = xappy.IndexerConnection(self.dbpath)
+        self.iconn.add_field_action('a', xappy.FieldActions.INDEX_EXACT)
+
+    def post_test(self):
+        self.iconn.close()
+
+    def add(self, id=None):
+        doc = xappy.UnprocessedDocument()
+        doc.append('a', 'x')
+        doc.id = id
+        return self.iconn.add(doc)
+
+    def reopen(self):
+        self.iconn.close()
+        self.iconn = xappy.IndexerConnection(self.dbpath)
+
+    def test_sequential(self):
+        """Test that IDs are allocated in sequence, and skip explicit IDs.
+
+        """
+        self.assertEqual([self.add() for i in xrange(3)], ['0', '1', '2'])
+        self.add('4')
+        self.add('Foo')
+        self.assertEqual([self.add() for i in xrange(3)], ['3', '5', '6'])
+
+    def test_reopen(self):
+        """Test that a new connection allocates from a new block.
+
+        """
+        self.assertEqual(self.add(), '0')
+        self.reopen()
+        self.assertEqual(self.add(), '%x' % 1000)
+        self.assertEqual(self.iconn.get_doccount(), 2)
+
+    def test_explicit_above_block(self):
+        """Test that explicit IDs beyond the current block are respected.
+
+        """
+        self.assertEqual(self.add(), '0')
+        self.add('%x' % 5000)
+        self.reopen()
+        ids = [self.add() for i in xrange(5000)]
+        self.assertFalse('%x' % 5000 in ids)
+        self.assertEqual(len(set(ids)), 5000)
+
+    def test_migration(self):
+        """Test a database without stored allocation state.
+
+        """
+        for i in xrange(10):
+            self.add()
+        self.add('20')
+        self.iconn.flush()
+        self.iconn.set_metadata('_xappy_idblock', '')
+        self.reopen()
+        self.iconn.delete('5')
+        ids = [self.add() for i in xrange(30)]
+        self.assertFalse('20' in ids)
+        self.assertEqual(len(set(ids)), 30)
+        self.assertEqual(self.iconn.get_doccount(), 40)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+from xappy.imgsigs import ImgSigCache, ImgSigPrefetcher
+
+class TestImgSigCache(TestCase):
+    def pre_test(self):
+        self.cachepath = os.path.join(self.tempdir, 'cache')
+        self.imagedir = os.path.join(os.path.dirname(__file__), 'testdata',
+                                     'sampleimages')
+        self.images = sorted(os.path.abspath(os.path.join(dirpath, fname))
+                             for dirpath, dirnames, filenames
+                             in os.walk(self.imagedir)
+                             for fname in filenames
+                             if fname.endswith('jpg'))
+
+    def test_cache_entries(self):
+        cache = ImgSigCache(self.cachepath)
+        path1 = os.path.join(self.tempdir, 'a')
+        path2 = os.path.join(self.tempdir, 'b')
+        for path in (path1, path2):
+            fd = open(path, 'wb')
+            fd.write('same contents')
+            fd.close()
+        key = cache.key(path1)
+        self.assertEqual(len(key), 40)
+        # Keys depend only on the file contents.
+        self.assertEqual(cache.key(path2), key)
+        self.assertEqual(cache.get(key), None)
+        cache.set(key, 'sig\x00data')
+        self.assertEqual(cache.get(key), 'sig\x00data')
+        self.assertEqual(ImgSigCache(self.cachepath).get(key), 'sig\x00data')
+        self.assertEqual(os.listdir(os.path.join(self.cachepath, key[:2])),
+                         [key[2:]])
+
+    def _build(self, indexpath, **kwargs):
+        iconn = xappy.IndexerConnection(indexpath)
+        iconn.add_field_action('image', xappy.FieldActions.IMGSEEK,
+                               terms=False)
+        iconn.add_field_action('file', xappy.FieldActions.STORE_CONTENT)
+        iconn.set_image_signatures(**kwargs)
+        docs = []
+        for path in self.images:
+            doc = xappy.UnprocessedDocument()
+            doc.fields.append(xappy.Field('image', path))
+            doc.fields.append(xappy.Field('file', os.path.basename(path)))
+            docs.append(doc)
+        iconn.add_many(docs, processes=1)
+        iconn.close()
+
+        sconn = xappy.SearchConnection(indexpath)
+        results = sconn.search(sconn.query_image_similarity('image',
+                                                            docid='0'), 0, 10)
+        result = [(item.data['file'][0], round(item.weight, 6))
+                  for item in results]
+        sconn.close()
+        return result
+
+    def test_indexing(self):
+        expected = self._build(os.path.join(self.tempdir, 'db1'))
+        self.assertEqual(len(expected), len(self.images))
+
+        # Prefetching signatures in other processes, and filling the cache.
+        self.assertEqual(self._build(os.path.join(self.tempdir, 'db2'),
+                                     cachepath=self.cachepath, processes=2),
+                         expected)
+        cache = ImgSigCache(self.cachepath)
+        for path in self.images:
+            self.assertNotEqual(cache.get(cache.key(path)), None)
+
+        # Using the cache, without prefetching.
+        self.assertEqual(self._build(os.path.join(self.tempdir, 'db3'),
+                                     cachepath=self.cachepath, processes=0),
+                         expected)
+
+    def test_lazy_processes(self):
+        # The worker processes aren't started until an image is prefetched.
+        prefetcher = ImgSigPrefetcher(processes=2)
+        docs = []
+        for i in xrange(3):
+            doc = xappy.UnprocessedDocument()
+            doc.fields.append(xappy.Field('file', str(i)))
+            docs.append(doc)
+        self.assertEqual(list(prefetcher.lookahead(docs, ['image'])), docs)
+        self.assertEqual(prefetcher._pool, None)
+        prefetcher.close()
+
+        iconn = xappy.IndexerConnection(os.path.join(self.tempdir, 'db'))
+        iconn.add_field_action('image', xappy.FieldActions.IMGSEEK,
+                               terms=False)
+        iconn.set_image_signatures(cachepath=self.cachepath, processes=2)
+        doc = xappy.UnprocessedDocument()
+        doc.fields.append(xappy.Field('image', self.images[0]))
+        iconn.add(doc)
+        self.assertEqual(iconn._imgsigs._pool, None)
+        iconn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+from StringIO import StringIO
+from xappy import importer
+
+class TestReaders(TestCase):
+    def test_read_jsonl(self):
+        data = '{"id": "1", "a": "one"}\n\nnot json\n{"id": "2"}\n'
+        records = list(importer.read_jsonl(StringIO(data)))
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0], (24, {'id': '1', 'a': 'one'}))
+        self.assertTrue(isinstance(records[1][1], ValueError))
+        self.assertEqual(records[2], (len(data), {'id': '2'}))
+
+        # Reading can restart from an offset.
+        self.assertEqual(list(importer.read_jsonl(StringIO(data), 24)),
+                         records[1:])
+
+    def test_read_csv(self):
+        data = 'id,a\n1,"multi\nline"\n2,two\n'
+        records = list(importer.read_csv(StringIO(data)))
+        self.assertEqual(records, [
+            (21, {'id': '1', 'a': 'multi\nline'}),
+            (27, {'id': '2', 'a': 'two'}),
+        ])
+        self.assertEqual(list(importer.read_csv(StringIO(data), 21)),
+                         records[1:])
+
+class TestFieldMapping(TestCase):
+    def test_make_document(self):
+        mapping = importer.FieldMapping.from_json('''{
+            "id": "sku",
+            "fields": {"title": "name", "tag": "tags"},
+            "split": {"tags": "|"},
+            "groups": [{"colour": "colours", "weight": "weights"}]
+        }''')
+        doc = mapping.make_document({
+            'sku': 7, 'name': 'Chair', 'tags': 'wood|oak',
+            'colours': ['red', 'blue'], 'weights': [1, 2],
+        })
+        self.assertEqual(doc.id, '7')
+        fields = [(field.name, field.value) for field in doc.fields
+                  if isinstance(field, xappy.Field)]
+        fields.sort()
+        self.assertEqual(fields, [('tag', 'oak'), ('tag', 'wood'),
+                                  ('title', 'Chair')])
+        groups = [sorted((field.name, field.value) for field in group.fields)
+                  for group in doc.fields
+                  if isinstance(group, xappy.FieldGroup)]
+        self.assertEqual(groups, [[('colour', 'red'), ('weight', '1')],
+                                  [('colour', 'blue'), ('weight', '2')]])
+        self.assertRaises(ValueError, mapping.make_document, {'name': 'x'})
+        self.assertRaises(xappy.IndexerError,
+                          importer.FieldMapping.from_json, '{"bad": 1}')
+
+class TestImporter(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        self.iconn = xappy.IndexerConnection(self.indexpath)
+        self.mapping = importer.FieldMapping(id='id', fields={'a': 'a'},
+            actions={'a': [['INDEX_FREETEXT', {}], ['STORE_CONTENT', {}]]})
+        self.mapping.apply_actions(self.iconn)
+        self.errors = []
+
+    def post_test(self):
+        self.iconn.close()
+
+    def _import(self, data, **kwargs):
+        imp = importer.Importer(self.iconn, self.mapping, batch_size=2,
+                                processes=1,
+                                error_cb=lambda offset, message:
+                                    self.errors.append(offset))
+        return imp.import_file(StringIO(data), **kwargs)
+
+    def test_import(self):
+        data = ''.join('{"id": "%d", "a": "text %d"}\n' % (i, i)
+                       for i in xrange(5))
+        data += '{"a": "no id"}\n'
+        stats = self._import(data, name='test')
+        self.assertEqual(stats.records, 6)
+        self.assertEqual(stats.docs_written, 5)
+        self.assertEqual(stats.errors, 1)
+        self.assertEqual(self.errors, [len(data)])
+        self.assertEqual(stats.committed_offset, len(data))
+        self.assertEqual(self.iconn.get_doccount(), 5)
+        self.assertEqual(self.iconn.get_document('3').data['a'], ['text 3'])
+
+        sconn = xappy.SearchConnection(self.indexpath)
+        self.assertEqual(sconn.get_metadata('_xappy_import:test'),
+                         str(len(data)))
+        sconn.close()
+
+    def test_resume(self):
+        data = ''.join('{"id": "%d", "a": "text %d"}\n' % (i, i)
+                       for i in xrange(3))
+        self._import(data, name='test')
+        self.assertEqual(self.iconn.get_doccount(), 3)
+
+        # Only the new records are imported when the import is rerun.
+        data += '{"id": "3", "a": "text 3"}\n'
+        stats = self._import(data, name='test')
+        self.assertEqual(stats.start_offset, stats.committed_offset -
+                         len('{"id": "3", "a": "text 3"}\n'))
+        self.assertEqual(stats.records, 1)
+        self.assertEqual(self.iconn.get_doccount(), 4)
+
+        # Restarting reads the whole file again.
+        stats = self._import(data, name='test', restart=True)
+        self.assertEqual(stats.records, 4)
+        self.assertEqual(stats.errors, 4)
+
+if __name__ == '__main__':
+    main()
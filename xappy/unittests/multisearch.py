@@ -0,0 +1,150 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+
+class TestMultiSearch(TestCase):
+    def pre_test(self):
+        self.paths = []
+        for name, count in (('uk', 4), ('fr', 6)):
+            path = os.path.join(self.tempdir, name)
+            iconn = xappy.IndexerConnection(path)
+            iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+            iconn.add_field_action('text', xappy.FieldActions.STORE_CONTENT)
+            iconn.add_field_action('num', xappy.FieldActions.SORTABLE,
+                                   type='float')
+            for i in xrange(count):
+                doc = xappy.UnprocessedDocument()
+                doc.id = '%s%d' % (name, i)
+                doc.append('text', 'common ' + 'word ' * (i + 1) + name)
+                doc.append('num', i)
+                iconn.add(doc)
+            iconn.close()
+            self.paths.append(path)
+        self.sconn = xappy.MultiSearchConnection(self.paths)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def sources(self, results):
+        return [self.sconn.get_source(result)[0] for result in results]
+
+    def test_search(self):
+        self.assertEqual(self.sconn.get_index_count(), 2)
+        self.assertEqual(self.sconn.get_doccount(), 10)
+        results = self.sconn.search(self.sconn.query_parse('common'), 0, 10)
+        self.assertEqual(results.matches_estimated, 10)
+        self.assertEqual(sorted(result.id for result in results),
+                         ['fr0', 'fr1', 'fr2', 'fr3', 'fr4', 'fr5',
+                          'uk0', 'uk1', 'uk2', 'uk3'])
+        for result in results:
+            index, xapid = self.sconn.get_source(result)
+            self.assertEqual(result.id[:2], ('uk', 'fr')[index])
+            self.assertEqual(int(result.id[2:]) + 1, xapid)
+            self.assertEqual(result.data['text'][0][-2:], result.id[:2])
+
+        results = self.sconn.search(self.sconn.query_field('text', 'uk'), 0,
+                                    10, sortby='-num')
+        self.assertEqual([result.id for result in results],
+                         ['uk3', 'uk2', 'uk1', 'uk0'])
+        self.assertEqual(self.sconn.get_document('fr2').data['text'],
+                         ['common word word word fr'])
+
+    def test_weights(self):
+        query = self.sconn.query_parse('word')
+        unweighted = self.sconn.search(query, 0, 10)
+
+        self.sconn.set_index_weights([1, 0])
+        results = self.sconn.search(query, 0, 10)
+        self.assertEqual(self.sources(results), [0] * 4 + [1] * 6)
+        self.assertEqual([result.rank for result in results], range(10))
+        self.assertEqual(results[4].weight, 0)
+        self.assertEqual(results.matches_estimated, 10)
+
+        # Later pages are reordered in the same way.
+        results = self.sconn.search(query, 2, 6)
+        self.assertEqual(self.sources(results), [0, 0, 1, 1])
+        self.assertEqual(len(results), 4)
+
+        # Sorted searches aren't affected.
+        results = self.sconn.search(query, 0, 10, sortby='num')
+        self.assertEqual(sorted(result.id for result in results[:2]),
+                         ['fr0', 'uk0'])
+
+        # Equal weights leave the order unchanged.
+        self.sconn.set_index_weights([2, 2])
+        results = self.sconn.search(query, 0, 10)
+        self.assertEqual([result.id for result in results],
+                         [result.id for result in unweighted])
+
+        self.assertRaises(xappy.SearchError, self.sconn.set_index_weights,
+                          [1])
+
+    def test_out_of_line(self):
+        # The same ID in several indexes must read the blobs of the document
+        # from the index holding it.
+        paths = []
+        for name in ('a', 'b'):
+            path = os.path.join(self.tempdir, 'ool_' + name)
+            iconn = xappy.IndexerConnection(path)
+            iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+            iconn.add_field_action('body', xappy.FieldActions.STORE_CONTENT,
+                                   out_of_line=True)
+            doc = xappy.UnprocessedDocument('dup')
+            doc.append('text', 'common')
+            doc.append('body', 'Body from ' + name)
+            iconn.add(doc)
+            iconn.close()
+            paths.append(path)
+        sconn = xappy.MultiSearchConnection(paths)
+        results = sconn.search(sconn.query_parse('common'), 0, 10)
+        self.assertEqual(len(results), 2)
+        for result in results:
+            index, xapid = sconn.get_source(result)
+            self.assertEqual(result.id, 'dup')
+            self.assertEqual(result.data['body'],
+                             ['Body from ' + ('a', 'b')[index]])
+        sconn.close()
+
+    def test_incompatible(self):
+        path = os.path.join(self.tempdir, 'other')
+        iconn = xappy.IndexerConnection(path)
+        iconn.add_field_action('num', xappy.FieldActions.INDEX_EXACT)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        iconn.close()
+        self.assertRaises(xappy.SearchError, xappy.MultiSearchConnection,
+                          self.paths + [path])
+
+        # Fields which are only in some of the indexes are fine if added
+        # after the others.
+        path = os.path.join(self.tempdir, 'extra')
+        iconn = xappy.IndexerConnection(path)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        iconn.add_field_action('text', xappy.FieldActions.STORE_CONTENT)
+        iconn.add_field_action('num', xappy.FieldActions.SORTABLE,
+                               type='float')
+        iconn.add_field_action('extra', xappy.FieldActions.INDEX_EXACT)
+        iconn.close()
+        sconn = xappy.MultiSearchConnection(self.paths + [path])
+        self.assertEqual(sorted(sconn._field_actions.keys()),
+                         ['extra', 'num', 'text'])
+        sconn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+import xapian
+
+class TestMultivaluedSlots(TestCase):
+    def pre_test(self):
+        self.dbpath = os.path.join(self.tempdir, 'db')
+        self.iconn = xappy.IndexerConnection(self.dbpath)
+        self.iconn.add_field_action('location', xappy.FieldActions.GEOLOCATION)
+        self.iconn.add_field_action('tag', xappy.FieldActions.FACET)
+
+    def post_test(self):
+        self.iconn.close()
+
+    def _make_doc(self, count):
+        doc = xappy.UnprocessedDocument('1')
+        for i in xrange(count):
+            doc.append('location', '%d.5 %d.25' % (i % 80, i % 170))
+            doc.append('tag', 'tag%d' % i)
+        return doc
+
+    def test_locations(self):
+        pdoc = self.iconn.process(self._make_doc(200))
+        # Reading a value before the document is prepared gives all the
+        # values appended so far.
+        coords = xapian.LatLongCoords.unserialise(pdoc.get_value('location',
+                                                                 'loc'))
+        self.assertEqual(coords.size(), 200)
+
+        self.iconn.add(pdoc)
+        self.iconn.flush()
+        doc = self.iconn.get_document('1')
+        coords = xapian.LatLongCoords.unserialise(doc.get_value('location',
+                                                                'loc'))
+        self.assertEqual(coords.size(), 200)
+
+    def test_facets(self):
+        pdoc = self.iconn.process(self._make_doc(100))
+        expected = xapian.StringListSerialiser()
+        for i in xrange(100):
+            expected.append('tag%d' % i)
+        self.assertEqual(pdoc.prepare().get_value(
+            self.iconn._field_mappings.get_slot('tag', 'facet')),
+            expected.get())
+
+        # Setting a value replaces the values appended so far.
+        pdoc = self.iconn.process(self._make_doc(3))
+        pdoc.add_value('tag', 'replaced', 'facet')
+        self.assertEqual(pdoc.get_value('tag', 'facet'), 'replaced')
+
+if __name__ == '__main__':
+    main()
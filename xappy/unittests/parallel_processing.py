@@ -0,0 +1,160 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+import xapian
+
+class TestParallelProcessing(TestCase):
+    def pre_test(self):
+        self.serialpath = os.path.join(self.tempdir, 'serial')
+        self.parallelpath = os.path.join(self.tempdir, 'parallel')
+        self.serial = self.make_conn(self.serialpath)
+        self.parallel = self.make_conn(self.parallelpath)
+
+    def post_test(self):
+        self.serial.close()
+        self.parallel.close()
+
+    def make_conn(self, path):
+        iconn = xappy.IndexerConnection(path)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT,
+                               spell=True)
+        iconn.add_field_action('text', xappy.FieldActions.STORE_CONTENT)
+        iconn.add_field_action('cat', xappy.FieldActions.INDEX_EXACT)
+        iconn.add_field_action('cat', xappy.FieldActions.FACET)
+        iconn.add_field_action('num', xappy.FieldActions.SORTABLE,
+                               type='float')
+        return iconn
+
+    def make_docs(self, count, offset=0):
+        for i in xrange(count):
+            doc = xappy.UnprocessedDocument()
+            doc.append('text', 'Document number %d of the test' % (i + offset))
+            doc.append('cat', 'cat%d' % (i % 3))
+            doc.append('num', str(i))
+            yield doc
+
+    def get_state(self, path):
+        db = xapian.Database(path)
+        docs = []
+        for docid in xrange(1, db.get_lastdocid() + 1):
+            doc = db.get_document(docid)
+            terms = [(item.term, item.wdf, list(item.positer))
+                     for item in doc.termlist()]
+            values = [(item.num, item.value) for item in doc.values()]
+            docs.append((doc.get_data(), terms, values))
+        spellings = [(item.term, item.termfreq)
+                     for item in db.spellings()]
+        return docs, spellings
+
+    def test_add_many(self):
+        """Test that add_many() gives the same results as add().
+
+        """
+        for doc in self.make_docs(50):
+            self.serial.add(doc)
+        self.serial.flush()
+
+        ids = self.parallel.add_many(self.make_docs(50), processes=2)
+        self.parallel.flush()
+        self.assertEqual(ids, [hex(i)[2:] for i in xrange(50)])
+        self.assertEqual(self.get_state(self.serialpath),
+                         self.get_state(self.parallelpath))
+
+    def test_replace_many(self):
+        """Test replace_many() with a reusable pool.
+
+        """
+        def with_ids(docs):
+            for i, doc in enumerate(docs):
+                doc.id = str(i)
+                yield doc
+
+        pool = xappy.ProcessorPool(self.parallel, processes=2, chunksize=4,
+                                   max_pending=2)
+        try:
+            self.parallel.replace_many(with_ids(self.make_docs(20)), pool=pool)
+            self.parallel.replace_many(with_ids(self.make_docs(20, 100)),
+                                       pool=pool)
+        finally:
+            pool.close()
+        self.parallel.flush()
+
+        for doc in with_ids(self.make_docs(20, 100)):
+            self.serial.replace(doc)
+        self.serial.flush()
+        self.assertEqual(self.get_state(self.serialpath)[0],
+                         self.get_state(self.parallelpath)[0])
+
+        sconn = xappy.SearchConnection(self.parallelpath)
+        self.assertEqual(sconn.get_doccount(), 20)
+        self.assertEqual(sconn.get_document('3').data['text'],
+                         ['Document number 103 of the test'])
+        sconn.close()
+
+    def test_mixed_and_serial(self):
+        """Test mixing processed and unprocessed documents, and serial mode.
+
+        """
+        docs = list(self.make_docs(10))
+        docs[3] = self.parallel.process(docs[3])
+        docs[4] = self.parallel.process(docs[4])
+        docs[7] = self.parallel.process(docs[7])
+        self.parallel.add_many(docs, processes=2)
+        self.parallel.flush()
+        self.serial.add_many(self.make_docs(10), processes=1)
+        self.serial.flush()
+        self.assertEqual(self.get_state(self.serialpath)[0],
+                         self.get_state(self.parallelpath)[0])
+
+    def test_processed_backpressure(self):
+        """Test that a run of processed documents isn't all read ahead.
+
+        """
+        processed = [self.parallel.process(doc)
+                     for doc in self.make_docs(50)]
+        read = []
+        def docs():
+            for doc in processed:
+                read.append(doc)
+                yield doc
+
+        pool = xappy.ProcessorPool(self.parallel, processes=2, chunksize=4,
+                                   max_pending=2)
+        try:
+            results = pool.imap(docs())
+            self.assertTrue(results.next()[0] is processed[0])
+            self.assertTrue(len(read) <= 9)
+            self.assertEqual([doc for doc, spellings in results],
+                             processed[1:])
+        finally:
+            pool.close()
+
+    def test_config_changed(self):
+        """Test that a pool can't be used after the config has changed.
+
+        """
+        pool = xappy.ProcessorPool(self.parallel, processes=1)
+        self.parallel.add_field_action('other', xappy.FieldActions.INDEX_EXACT)
+        self.assertRaises(xappy.IndexerError, self.parallel.add_many,
+                          self.make_docs(1), pool=pool)
+        pool.close()
+
+if __name__ == '__main__':
+    main()
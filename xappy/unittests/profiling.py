@@ -0,0 +1,106 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+from StringIO import StringIO
+
+class TestIndexingProfile(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        self.iconn = xappy.IndexerConnection(self.indexpath)
+        self.iconn.add_field_action('a', xappy.FieldActions.INDEX_FREETEXT)
+        self.iconn.add_field_action('a', xappy.FieldActions.STORE_CONTENT)
+        self.iconn.add_field_action('b', xappy.FieldActions.SORTABLE,
+                                    type='float')
+
+    def post_test(self):
+        self.iconn.close()
+
+    def _add_docs(self, count):
+        for i in xrange(count):
+            doc = xappy.UnprocessedDocument()
+            doc.append('a', 'document number %d' % i)
+            doc.append('b', str(i))
+            self.iconn.add(doc)
+        doc = xappy.UnprocessedDocument('0')
+        doc.append('a', 'replacement')
+        self.iconn.replace(doc)
+
+    def _calls(self, profile):
+        return dict(((entry.field, entry.name), entry.calls)
+                    for entry in profile.get_report())
+
+    def test_disabled(self):
+        self.assertEqual(self.iconn.get_profile(), None)
+        self._add_docs(2)
+        self.iconn.flush()
+        self.assertEqual(self.iconn.get_profile(), None)
+
+    def test_profile(self):
+        self.iconn.set_profiling()
+        self._add_docs(3)
+        self.iconn.flush()
+        profile = self.iconn.get_profile()
+        calls = self._calls(profile)
+        self.assertEqual(calls[(None, 'process')], 4)
+        self.assertEqual(calls[(None, 'allocate_id')], 4)
+        self.assertEqual(calls[(None, 'prepare')], 4)
+        self.assertEqual(calls[(None, 'write')], 4)
+        self.assertEqual(calls[(None, 'flush')], 1)
+        self.assertEqual(calls[('a', 'INDEX_FREETEXT')], 4)
+        self.assertEqual(calls[('a', 'STORE_CONTENT')], 4)
+        self.assertEqual(calls[('b', 'SORT_AND_COLLAPSE')], 3)
+
+        report = profile.get_report()
+        for entry in report:
+            self.assertTrue(entry.wall_time >= 0)
+            self.assertTrue(entry.cpu_time >= 0)
+        # Stages are listed before actions.
+        fields = [entry.field for entry in report]
+        self.assertEqual(fields[:5], [None] * 5)
+        self.assertTrue(None not in fields[5:])
+        self.assertTrue('a:INDEX_FREETEXT' in str(profile))
+
+        out = StringIO()
+        profile.write_csv(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0],
+                         'Field,Stage/Action,Calls,Wall(seconds),CPU(seconds)')
+        self.assertEqual(len(lines), len(report) + 1)
+        self.assertTrue(lines[1].startswith(',%s,' % report[0].name))
+
+        # Re-enabling discards the timings; disabling stops recording.
+        self.iconn.set_profiling()
+        self.assertEqual(self.iconn.get_profile().get_report(), [])
+        self.iconn.set_profiling(False)
+        self._add_docs(1)
+        self.assertEqual(self.iconn.get_profile(), None)
+
+    def test_config_change(self):
+        # Actions added after profiling was enabled are also timed.
+        self.iconn.set_profiling()
+        self.iconn.add_field_action('c', xappy.FieldActions.INDEX_EXACT)
+        doc = xappy.UnprocessedDocument()
+        doc.append('c', 'exact')
+        self.iconn.add(doc)
+        calls = self._calls(self.iconn.get_profile())
+        self.assertEqual(calls[('c', 'INDEX_EXACT')], 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+from xappy.lru import LRUCache
+
+class TestLRUCache(TestCase):
+    def test_lru(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        # 'b' is now the least recently used item.
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+        cache.set('a', 4)
+        cache.set('d', 5)
+        self.assertEqual(cache.get('a'), 4)
+        self.assertFalse('c' in cache)
+        cache.remove('a')
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get_stats(), {'items': 1, 'max_items': 2,
+                                             'size': 0, 'max_size': None,
+                                             'hits': 3, 'misses': 1})
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertRaises(ValueError, LRUCache, 0)
+
+    def test_uncounted(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a', count=False), 1)
+        self.assertEqual(cache.get('c', count=False), None)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+        cache.note_hit()
+        cache.note_miss()
+        cache.note_miss()
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        # Uncounted lookups still mark the item as recently used.
+        cache.set('c', 3)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+
+    def test_set_max_items(self):
+        cache = LRUCache(3)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set_max_items(2)
+        self.assertEqual(len(cache), 2)
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache.get_stats()['max_items'], 2)
+        cache.set_max_items(5)
+        self.assertEqual(len(cache), 2)
+        self.assertRaises(ValueError, cache.set_max_items, 0)
+
+    def test_max_size(self):
+        cache = LRUCache(10, max_size=100)
+        cache.set('a', 1, 40)
+        cache.set('b', 2, 40)
+        cache.set('c', 3, 40)
+        self.assertFalse('a' in cache)
+        self.assertEqual(cache.size, 80)
+        # Replacing an item replaces its size.
+        cache.set('b', 4, 10)
+        self.assertEqual(cache.size, 50)
+        # Items bigger than the whole cache aren't stored.
+        cache.set('c', 5, 101)
+        self.assertFalse('c' in cache)
+        self.assertEqual(cache.size, 10)
+        cache.remove('b')
+        self.assertEqual(cache.size, 0)
+
+class TestQueryCache(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        self.iconn = xappy.IndexerConnection(self.indexpath)
+        self.iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        doc = xappy.UnprocessedDocument()
+        doc.append('text', 'a red car')
+        self.iconn.add(doc)
+        self.iconn.flush()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+    def post_test(self):
+        self.sconn.close()
+        self.iconn.close()
+
+    def test_disabled(self):
+        self.assertEqual(self.sconn.get_query_cache_stats(), None)
+        self.sconn.query_parse('red')
+        self.assertEqual(self.sconn.get_query_cache_stats(), None)
+
+    def test_cache(self):
+        self.sconn.set_query_cache(10)
+        q1 = self.sconn.query_parse('red car')
+        q2 = self.sconn.query_parse('red car')
+        self.assertEqual(str(q1), str(q2))
+        self.assertEqual(q2.evalable_repr(), q1.evalable_repr())
+        self.assertEqual(self.sconn.search(q2, 0, 10).matches_estimated, 1)
+        # Different parameters are cached separately.
+        self.sconn.query_parse('red car', default_op=self.sconn.OP_OR)
+        self.sconn.query_parse('red car', allow_wildcards=True)
+        self.assertEqual(self.sconn.get_query_cache_stats(),
+                         {'items': 3, 'max_items': 10, 'size': 0,
+                          'max_size': None, 'hits': 1, 'misses': 3})
+
+        # Synonyms are used once the connection has been reopened.
+        self.iconn.add_synonym('auto', 'car')
+        self.iconn.flush()
+        self.sconn.reopen()
+        self.assertEqual(self.sconn.get_query_cache_stats()['items'], 0)
+        results = self.sconn.search(self.sconn.query_parse('auto'), 0, 10)
+        self.assertEqual(results.matches_estimated, 1)
+
+        self.sconn.set_query_cache(1)
+        self.assertEqual(self.sconn.get_query_cache_stats()['items'], 1)
+        self.sconn.set_query_cache(0)
+        self.assertEqual(self.sconn.get_query_cache_stats(), None)
+
+if __name__ == '__main__':
+    main()
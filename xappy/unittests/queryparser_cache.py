@@ -0,0 +1,87 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+
+class TestQueryParserCache(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        self.iconn = xappy.IndexerConnection(self.indexpath)
+        self.iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT,
+                                    language='en')
+        self.iconn.add_field_action('tag', xappy.FieldActions.INDEX_EXACT)
+        doc = xappy.UnprocessedDocument()
+        doc.append('text', 'He runs quickly')
+        doc.append('tag', 'red')
+        self.iconn.add(doc)
+        self.iconn.flush()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+    def post_test(self):
+        self.sconn.close()
+        self.iconn.close()
+
+    def test_reuse(self):
+        qp = self.sconn._prepare_queryparser(None, None, self.sconn.OP_AND,
+                                             None, None)
+        self.assertTrue(self.sconn._prepare_queryparser(
+            None, None, self.sconn.OP_AND, None, None) is qp)
+        self.assertTrue(self.sconn._prepare_queryparser(
+            ['text'], None, self.sconn.OP_AND, None, None) is not qp)
+        self.assertTrue(self.sconn._prepare_queryparser(
+            None, None, self.sconn.OP_OR, None, None) is not qp)
+
+        # Stemming still works after the parser has been used (parsing turns
+        # stemming off for the unstemmed part of the query).
+        for i in xrange(2):
+            results = self.sconn.search(self.sconn.query_parse('running'),
+                                        0, 10)
+            self.assertEqual(len(results), 1)
+            results = self.sconn.search(
+                self.sconn.query_field('text', 'running'), 0, 10)
+            self.assertEqual(len(results), 1)
+
+    def test_reopen(self):
+        qp = self.sconn._prepare_queryparser(None, None, self.sconn.OP_AND,
+                                             None, None)
+
+        # Reopening without a configuration change keeps the parsers.
+        doc = xappy.UnprocessedDocument()
+        doc.append('text', 'Another document')
+        self.iconn.add(doc)
+        self.iconn.flush()
+        self.sconn.reopen()
+        self.assertTrue(self.sconn._prepare_queryparser(
+            None, None, self.sconn.OP_AND, None, None) is qp)
+
+        # A configuration change discards them.
+        self.iconn.add_field_action('colour', xappy.FieldActions.INDEX_EXACT)
+        doc = xappy.UnprocessedDocument()
+        doc.append('colour', 'blue')
+        self.iconn.add(doc)
+        self.iconn.flush()
+        self.sconn.reopen()
+        self.assertTrue(self.sconn._prepare_queryparser(
+            None, None, self.sconn.OP_AND, None, None) is not qp)
+        results = self.sconn.search(self.sconn.query_parse('colour:blue'),
+                                    0, 10)
+        self.assertEqual(len(results), 1)
+
+if __name__ == '__main__':
+    main()
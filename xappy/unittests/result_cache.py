@@ -0,0 +1,111 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+
+class TestResultCache(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        self.iconn = xappy.IndexerConnection(self.indexpath)
+        self.iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        self.iconn.add_field_action('text', xappy.FieldActions.STORE_CONTENT)
+        self.iconn.add_field_action('colour', xappy.FieldActions.FACET)
+        self.iconn.add_field_action('num', xappy.FieldActions.SORTABLE,
+                                    type='float')
+        for i in xrange(25):
+            doc = xappy.UnprocessedDocument()
+            doc.append('text', 'common ' + 'word ' * (i % 7))
+            doc.append('colour', ('red', 'green', 'blue')[i % 3])
+            doc.append('num', str(i))
+            self.iconn.add(doc)
+        self.iconn.flush()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+    def post_test(self):
+        self.sconn.close()
+        self.iconn.close()
+
+    def _summary(self, results):
+        return ([(r.id, r.rank, r.weight, r.percent, r.data['text'])
+                 for r in results],
+                results.startrank, results.endrank, results.more_matches)
+
+    def test_cached_results(self):
+        query = self.sconn.query_parse('common word')
+        uncached = [self._summary(self.sconn.search(query, start, start + 5))
+                    for start in (0, 5, 10, 20, 30)]
+        self.assertEqual(self.sconn.get_result_cache_stats(), None)
+
+        self.sconn.set_result_cache(window=10)
+        for i in xrange(2):
+            for start, expected in zip((0, 5, 10, 20, 30), uncached):
+                results = self.sconn.search(query, start, start + 5)
+                self.assertEqual(self._summary(results), expected)
+                self.assertEqual(results.matches_estimated, 25)
+        stats = self.sconn.get_result_cache_stats()
+        # The first pass fetches ranks 0-10, 10-20 and 20-30 (which is all
+        # the results, so covers rank 30 onwards too).
+        self.assertEqual((stats['hits'], stats['misses'], stats['items']),
+                         (7, 3, 1))
+        self.assertTrue(stats['size'] > 0)
+
+        # Other parameters are cached separately.
+        results = self.sconn.search(query, 0, 5, sortby='-num')
+        self.assertEqual([r.id for r in results],
+                         [r.id for r in self.sconn.search(query, 0, 5,
+                                                          sortby='-num')])
+        self.assertEqual(self.sconn.get_result_cache_stats()['items'], 2)
+
+    def test_facets(self):
+        self.sconn.set_result_cache()
+        query = self.sconn.query_parse('common')
+        results1 = self.sconn.search(query, 0, 10, getfacets=True)
+        results2 = self.sconn.search(query, 0, 10, getfacets=True)
+        self.assertEqual(results1.get_facets(), results2.get_facets())
+        self.assertEqual(results2.get_facets()['colour'],
+                         (('blue', 8), ('green', 8), ('red', 9)))
+        self.assertEqual(results1.get_suggested_facets(),
+                         results2.get_suggested_facets())
+        self.assertEqual(self.sconn.get_result_cache_stats()['hits'], 1)
+
+        # Relevant data uses the term weights from the cached search.
+        self.assertEqual(results1[0].relevant_data(),
+                         results2[0].relevant_data())
+
+    def test_reopen(self):
+        self.sconn.set_result_cache()
+        query = self.sconn.query_field('colour', 'red')
+        self.assertEqual(self.sconn.search(query, 0, 20).matches_estimated, 9)
+        doc = xappy.UnprocessedDocument()
+        doc.append('colour', 'red')
+        self.iconn.add(doc)
+        self.iconn.flush()
+
+        # Until the connection is reopened, the cached results are returned.
+        self.assertEqual(self.sconn.search(query, 0, 20).matches_estimated, 9)
+        self.sconn.reopen()
+        self.assertEqual(self.sconn.get_result_cache_stats()['items'], 0)
+        self.assertEqual(self.sconn.search(query, 0, 20).matches_estimated,
+                         10)
+
+        self.sconn.set_result_cache(0)
+        self.assertEqual(self.sconn.get_result_cache_stats(), None)
+
+if __name__ == '__main__':
+    main()
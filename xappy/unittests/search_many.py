@@ -0,0 +1,142 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+import threading
+
+class TestSearchMany(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        self.iconn = xappy.IndexerConnection(self.indexpath)
+        self.iconn.add_field_action('a', xappy.FieldActions.INDEX_FREETEXT)
+        self.iconn.add_field_action('a', xappy.FieldActions.STORE_CONTENT)
+        self.iconn.add_field_action('n', xappy.FieldActions.SORTABLE,
+                                    type='float')
+        self.add_docs(0, 10)
+        self.sconn = xappy.SearchConnection(self.indexpath)
+        self.pool = xappy.SearchConnectionPool(self.indexpath, max_size=2)
+
+    def post_test(self):
+        self.pool.close()
+        self.sconn.close()
+        self.iconn.close()
+
+    def add_docs(self, start, end):
+        for i in xrange(start, end):
+            doc = xappy.UnprocessedDocument()
+            doc.id = str(i)
+            doc.append('a', 'document %s' % ('even', 'odd')[i % 2])
+            doc.append('n', i)
+            self.iconn.add(doc)
+        self.iconn.flush()
+
+    def summarise(self, results):
+        return (results.matches_estimated,
+                [(hit.id, hit.data['a']) for hit in results])
+
+    def searches(self):
+        return [
+            ('document', 0, 5, {'sortby': '-n'}),
+            (self.sconn.query_field('a', 'even'), 0, 10),
+            ('odd', 2, 4, dict(sortby='n', checkatleast=-1)),
+            (self.sconn.query_none(), 0, 10),
+        ]
+
+    def test_search_many(self):
+        expected = []
+        for query, startrank, endrank, kwargs in [
+            (self.sconn.query_parse('document'), 0, 5, {'sortby': '-n'}),
+            (self.sconn.query_field('a', 'even'), 0, 10, {}),
+            (self.sconn.query_parse('odd'), 2, 4,
+             dict(sortby='n', checkatleast=-1)),
+            (self.sconn.query_none(), 0, 10, {}),
+            ]:
+            expected.append(self.summarise(self.sconn.search(
+                query, startrank, endrank, **kwargs)))
+        self.assertEqual(expected[0][1][0], ('9', ['document odd']))
+
+        results = self.sconn.search_many(self.searches())
+        self.assertEqual(map(self.summarise, results), expected)
+
+        results = self.sconn.search_many(self.searches(), pool=self.pool)
+        self.assertEqual(map(self.summarise, results), expected)
+        # Only two searches could use the pool, since it holds two
+        # connections.
+        self.assertEqual(self.pool.get_stats()['checkouts'], 2)
+
+    def test_reopen(self):
+        self.add_docs(10, 12)
+        results = self.sconn.search_many(self.searches(), pool=self.pool,
+                                         reopen=False)
+        self.assertEqual(results[0].matches_estimated, 10)
+        results = self.sconn.search_many(self.searches(), pool=self.pool)
+        self.assertEqual([result.matches_estimated for result in results],
+                         [12, 6, 6, 0])
+
+    def test_detached(self):
+        # The results of pooled searches don't use the pooled connections, so
+        # can be read while other threads use them.
+        results = self.sconn.search_many(self.searches(), pool=self.pool)
+        self.assertEqual(self.pool.get_stats()['checkouts'], 2)
+        expected = map(self.summarise, results)
+
+        def search():
+            for i in xrange(20):
+                conn = self.pool.checkout()
+                try:
+                    for hit in conn.search(conn.query_parse('document'), 0,
+                                           10):
+                        hit.data
+                finally:
+                    self.pool.checkin(conn)
+        threads = [threading.Thread(target=search) for i in xrange(2)]
+        for thread in threads:
+            thread.start()
+        for i in xrange(20):
+            self.assertEqual(map(self.summarise, results), expected)
+        for thread in threads:
+            thread.join()
+
+        # Anything which needs a connection uses the one the searches were
+        # made with.
+        self.assertTrue(results[2]._conn is self.sconn)
+        self.assertTrue(results[2][0]._conn is self.sconn)
+        self.assertTrue('<b>odd</b>' in results[2][0].summarise('a'))
+
+        # They can still be read once the pooled connections are closed.
+        self.pool.close()
+        self.assertEqual(map(self.summarise, results), expected)
+        self.assertEqual(results[2][0].id, '5')
+
+    def test_errors(self):
+        self.assertRaises(xappy.SearchError, self.sconn.search_many,
+                          [('document', 0)])
+        self.assertRaises(xappy.SearchError, self.sconn.search_many,
+                          [(None, 0, 10)])
+        self.assertRaises(xappy.SearchError, self.sconn.search_many,
+                          [('document', 0, 10, {'sortby': 'n'}),
+                           ('document', 0, 10, {'sort': 'n'})])
+        self.assertRaises(xappy.SearchError, self.sconn.search_many,
+                          [('document', 0, 10),
+                           ('document', 0, 10, {'sortby': 'a'})],
+                          pool=self.pool)
+        self.assertEqual(self.pool.get_stats()['checked_out'], 0)
+
+if __name__ == '__main__':
+    main()
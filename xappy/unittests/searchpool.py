@@ -0,0 +1,140 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+import time
+from xappy.searchpool import SearchConnectionPool
+
+class TestSearchConnectionPool(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        self.iconn = xappy.IndexerConnection(self.indexpath)
+        self.iconn.add_field_action('a', xappy.FieldActions.INDEX_FREETEXT)
+        self.iconn.add_field_action('a', xappy.FieldActions.STORE_CONTENT)
+        self.add_docs(5)
+        self.pool = xappy.SearchConnectionPool(self.indexpath, max_size=2,
+                                               min_size=1, check_interval=0)
+
+    def post_test(self):
+        self.pool.close()
+        self.iconn.close()
+
+    def add_docs(self, count):
+        for i in xrange(count):
+            doc = xappy.UnprocessedDocument()
+            doc.append('a', 'document')
+            self.iconn.add(doc)
+        self.iconn.flush()
+
+    def count_matches(self):
+        conn = self.pool.checkout()
+        try:
+            return conn.search(conn.query_parse('document'), 0, 10,
+                               checkatleast=-1).matches_estimated
+        finally:
+            self.pool.checkin(conn)
+
+    def test_checkout(self):
+        self.assertEqual(self.pool.get_stats()['idle'], 1)
+        conn1 = self.pool.checkout()
+        conn2 = self.pool.checkout()
+        self.assertNotEqual(conn1, conn2)
+        self.assertEqual(self.pool.get_stats()['checked_out'], 2)
+
+        # The pool is full, so checkout has to wait.
+        self.assertRaises(xappy.SearchError, self.pool.checkout, timeout=0.01)
+
+        self.pool.checkin(conn1)
+        self.assertTrue(self.pool.checkout() is conn1)
+        self.pool.checkin(conn1)
+        self.pool.checkin(conn2, discard=True)
+        self.assertRaises(xappy.SearchError, self.pool.checkin, conn2)
+
+        stats = self.pool.get_stats()
+        self.assertEqual((stats['size'], stats['idle'], stats['opened'],
+                          stats['waits'], stats['discarded']),
+                         (1, 1, 2, 1, 1))
+
+    def test_reopen(self):
+        self.assertEqual(self.count_matches(), 5)
+        self.add_docs(3)
+        self.assertEqual(self.count_matches(), 8)
+
+        # Connections are reopened by maintain(), even if they're not due
+        # to be checked.
+        pool = SearchConnectionPool(self.indexpath, check_interval=1000)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        self.add_docs(2)
+        self.assertEqual(conn.get_doccount(), 8)
+        pool.maintain()
+        self.assertEqual(conn.get_doccount(), 10)
+        pool.close()
+
+    def test_idle(self):
+        pool = SearchConnectionPool(self.indexpath, max_size=3, min_size=1,
+                                    max_idle=0)
+        conns = [pool.checkout() for i in xrange(3)]
+        for conn in conns:
+            pool.checkin(conn)
+        self.assertEqual(pool.get_stats()['idle'], 3)
+        pool.maintain()
+        self.assertEqual(pool.get_stats()['idle'], 1)
+        self.assertEqual(pool.get_stats()['evicted'], 2)
+        pool.warm(2)
+        self.assertEqual(pool.get_stats()['idle'], 2)
+        pool.close()
+        self.assertRaises(xappy.SearchError, pool.checkout)
+
+    def test_bad_params(self):
+        """Test that a pool which failed to initialise can be closed.
+
+        """
+        self.assertRaises(xappy.SearchError, SearchConnectionPool,
+                          self.indexpath, max_size=0)
+        # This is what happens when such a pool is garbage collected.
+        pool = SearchConnectionPool.__new__(SearchConnectionPool)
+        pool.close()
+
+    def test_maintenance_errors(self):
+        """Test that the maintenance thread survives unexpected errors.
+
+        """
+        failures = []
+        def factory(indexpath):
+            if failures:
+                failures.pop()
+                raise ValueError("Failing to open %r" % indexpath)
+            return xappy.SearchConnection(indexpath)
+        pool = SearchConnectionPool(self.indexpath, factory=factory,
+                                    maintenance_interval=0.01)
+        conn = pool.checkout()
+        failures.extend([True, True])
+        pool.checkin(conn, discard=True)
+        # The maintenance thread reopens a connection once it stops failing.
+        for i in xrange(500):
+            if pool.get_stats()['idle'] == 1:
+                break
+            time.sleep(0.01)
+        self.assertEqual(failures, [])
+        self.assertEqual(pool.get_stats()['idle'], 1)
+        pool.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+from xappy.searchserver import SearchServer, SearchClient
+
+class TestSearchServer(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        iconn = xappy.IndexerConnection(self.indexpath)
+        iconn.add_field_action('a', xappy.FieldActions.INDEX_FREETEXT,
+                               spell=True)
+        iconn.add_field_action('a', xappy.FieldActions.STORE_CONTENT)
+        iconn.add_field_action('n', xappy.FieldActions.SORTABLE, type='float')
+        iconn.add_field_action('f', xappy.FieldActions.FACET)
+        for i in xrange(10):
+            doc = xappy.UnprocessedDocument()
+            doc.id = str(i)
+            doc.append('a', 'document %d' % i)
+            doc.append('n', i)
+            doc.append('f', 'facet%d' % (i % 2))
+            iconn.add(doc)
+        iconn.close()
+        self.server = SearchServer(self.indexpath, processes=2)
+        self.server.start()
+        self.client = SearchClient(port=self.server.address[1], timeout=30)
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+    def post_test(self):
+        self.sconn.close()
+        self.server.stop()
+
+    def test_search(self):
+        self.assertEqual(self.server.address[0], '127.0.0.1')
+        self.assertEqual(self.client.get_doccount(), 10)
+
+        results = self.client.search('document', 2, 5, sortby='-n')
+        expected = self.sconn.search(self.sconn.query_parse('document'), 2, 5,
+                                     sortby='-n')
+        self.assertEqual(len(results), 3)
+        self.assertEqual([(hit.id, hit.rank, hit.data) for hit in results],
+                         [(hit.id, hit.rank, hit.data) for hit in expected])
+        self.assertEqual((results.startrank, results.endrank,
+                          results.matches_estimated, results.more_matches),
+                         (2, 5, 10, True))
+        self.assertEqual(results[0].data, {'a': ['document 7']})
+
+        results = self.client.search('document', 0, 0, getfacets=True,
+                                     checkatleast=-1, maxfacets=2)
+        self.assertEqual(dict((field, list(values)) for field, values
+                              in results.get_facets().iteritems()),
+                         {'f': [('facet0', 5), ('facet1', 5)]})
+        self.assertEqual(results.get_suggested_facets(),
+                         [('f', (('facet0', 5), ('facet1', 5)))])
+
+        self.assertEqual(self.client.get_document('3'),
+                         ('3', {'a': ['document 3']}))
+        self.assertEqual(self.client.spell_correct('documant'), 'document')
+
+    def test_errors(self):
+        self.assertRaises(KeyError, self.client.get_document, 'missing')
+        self.assertRaises(xappy.SearchError, self.client.search, 'document',
+                          0, 10, sortby='a')
+        self.assertRaises(xappy.SearchError, self.client.search, 'document',
+                          0, 10, unknown=1)
+
+        # Serialised queries are only accepted if the server allows them.
+        query = self.sconn.query_field('a', 'document')
+        self.assertRaises(xappy.SearchError, self.client.search, query, 0, 10)
+        server = SearchServer(self.indexpath, processes=1,
+                              allow_evalable=True)
+        server.start()
+        try:
+            client = SearchClient(port=server.address[1])
+            self.assertEqual(len(client.search(query, 0, 10)), 10)
+        finally:
+            server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+import xapian
+
+class TestSharding(TestCase):
+    def pre_test(self):
+        self.dbpath = os.path.join(self.tempdir, 'db')
+        self.iconn = xappy.ShardedIndexerConnection(self.dbpath, shards=3)
+        self.iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        self.iconn.add_field_action('text', xappy.FieldActions.STORE_CONTENT)
+        self.iconn.add_field_action('cat', xappy.FieldActions.FACET)
+
+    def post_test(self):
+        self.iconn.close()
+
+    def add_docs(self, count):
+        ids = []
+        for i in xrange(count):
+            doc = xappy.UnprocessedDocument()
+            doc.append('text', 'Document %d' % i)
+            doc.append('cat', 'cat%d' % (i % 2))
+            ids.append(self.iconn.add(doc))
+        return ids
+
+    def test_add_and_search(self):
+        """Test adding documents, and searching across the shards.
+
+        """
+        ids = self.add_docs(30)
+        self.assertEqual(ids, ['%x' % i for i in xrange(30)])
+        self.iconn.flush()
+        self.assertEqual(self.iconn.get_doccount(), 30)
+        self.assertEqual(self.iconn.get_document('1a').data['text'],
+                         ['Document 26'])
+
+        sconn = xappy.ShardedSearchConnection(self.dbpath)
+        self.assertEqual(sconn.get_shard_count(), 3)
+        self.assertEqual(sconn.get_doccount(), 30)
+        self.assertEqual(sorted(sconn.iterids()), sorted(ids))
+        self.assertEqual(sconn.get_document('1a').data['text'],
+                         ['Document 26'])
+
+        # Every shard should have some documents.
+        for shard in xrange(3):
+            db = xapian.Database(os.path.join(self.dbpath, 'shard%d' % shard))
+            self.assertTrue(db.get_doccount() > 0)
+
+        results = sconn.search(sconn.query_parse('document'), 0, 100,
+                               getfacets=True)
+        self.assertEqual(len(results), 30)
+        self.assertEqual(results.get_facets()['cat'],
+                         (('cat0', 15), ('cat1', 15)))
+        for result in results:
+            shard, xapid = xappy.sharding.split_xapid(result._doc.get_docid(), 3)
+            self.assertEqual(shard, xappy.sharding.shard_for_id(result.id, 3))
+        sconn.close()
+
+    def test_out_of_line(self):
+        """Test reading fields stored out-of-line in each shard.
+
+        """
+        self.iconn.add_field_action('body', xappy.FieldActions.STORE_CONTENT,
+                                    out_of_line=True)
+        for i in xrange(12):
+            doc = xappy.UnprocessedDocument()
+            doc.append('text', 'Document %d' % i)
+            doc.append('body', 'Body %d' % i)
+            self.iconn.add(doc)
+        self.iconn.flush()
+
+        sconn = xappy.ShardedSearchConnection(self.dbpath)
+        results = sconn.search(sconn.query_parse('document'), 0, 100,
+                               fields=['text', 'body'])
+        self.assertEqual(len(results), 12)
+        shards = set()
+        for result in results:
+            shards.add(xappy.sharding.split_xapid(result._doc.get_docid(),
+                                                  3)[0])
+            self.assertEqual(result.data['body'],
+                             ['Body' + result.data['text'][0][8:]])
+        self.assertEqual(shards, set([0, 1, 2]))
+        for doc in sconn.iter_documents(fields=['text', 'body']):
+            self.assertEqual(doc.data['body'],
+                             ['Body' + doc.data['text'][0][8:]])
+        self.assertEqual(sconn.get_document('b').get_data('body'),
+                         ['Body 11'])
+        sconn.close()
+
+    def test_replace_and_delete(self):
+        """Test replacing and deleting documents.
+
+        """
+        self.add_docs(10)
+        doc = xappy.UnprocessedDocument('3')
+        doc.append('text', 'Replaced')
+        self.iconn.replace(doc)
+        self.iconn.delete('4')
+        self.iconn.flush()
+        sconn = xappy.ShardedSearchConnection(self.dbpath)
+        self.assertEqual(sconn.get_doccount(), 9)
+        self.assertEqual(sconn.get_document('3').data['text'], ['Replaced'])
+        self.assertRaises(KeyError, sconn.get_document, '4')
+        sconn.close()
+
+    def test_errors(self):
+        """Test that errors from the shard processes are reported.
+
+        """
+        self.add_docs(5)
+        doc = xappy.UnprocessedDocument('2')
+        doc.append('text', 'Duplicate')
+        self.iconn.add(doc)
+        self.assertRaises(xappy.DuplicatedIdError, self.iconn.flush)
+        # The error is only reported once.
+        self.iconn.flush()
+
+        # Errors which aren't xappy errors leave the shards in step with the
+        # connection.
+        self.assertRaises(AttributeError, self.iconn._call_all,
+                          'no_such_method')
+        self.assertEqual(sum(self.iconn._call_all('get_doccount')), 5)
+        self.assertEqual(self.iconn.get_doccount(), 5)
+
+        self.assertRaises(xappy.IndexerError, self.iconn.delete, xapid=1)
+        self.assertRaises(xappy.IndexerError,
+                          xappy.ShardedIndexerConnection,
+                          os.path.join(self.tempdir, 'db2'))
+
+    def test_reopen(self):
+        """Test reopening a sharded index, and ID allocation.
+
+        """
+        self.add_docs(5)
+        self.iconn.close()
+        self.assertRaises(xappy.IndexerError,
+                          xappy.ShardedIndexerConnection, self.dbpath,
+                          shards=2)
+        self.iconn = xappy.ShardedIndexerConnection(self.dbpath)
+        self.assertEqual(sorted(self.iconn.get_fields_with_actions()),
+                         ['cat', 'text'])
+        ids = self.add_docs(5)
+        self.assertEqual(ids[0], '%x' % 1000)
+        self.iconn.flush()
+        self.assertEqual(self.iconn.get_doccount(), 10)
+
+if __name__ == '__main__':
+    main()
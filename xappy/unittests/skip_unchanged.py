@@ -0,0 +1,98 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+
+class TestSkipUnchanged(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        self.iconn = xappy.IndexerConnection(self.indexpath)
+        self.iconn.add_field_action('a', xappy.FieldActions.INDEX_FREETEXT)
+        self.iconn.add_field_action('a', xappy.FieldActions.STORE_CONTENT)
+        self.iconn.set_skip_unchanged()
+
+    def post_test(self):
+        self.iconn.close()
+
+    def _doc(self, id, text):
+        doc = xappy.UnprocessedDocument(id)
+        doc.fields.append(xappy.Field('a', text))
+        return doc
+
+    def test_skip_unchanged(self):
+        for i in xrange(5):
+            self.iconn.add(self._doc(str(i), 'text %d' % i))
+        self.iconn.flush()
+        stats = self.iconn.get_indexing_stats()
+        self.assertEqual(stats.docs_written, 5)
+
+        # Resend the same documents, with one changed.
+        docs = [self._doc(str(i), 'text %d' % i) for i in xrange(5)]
+        docs[2] = self._doc('2', 'changed text')
+        for doc in docs:
+            self.iconn.replace(doc)
+        self.assertEqual(stats.docs_written, 6)
+        self.assertEqual(stats.docs_skipped, 4)
+        self.iconn.flush()
+
+        self.assertEqual(self.iconn.get_doccount(), 5)
+        self.assertEqual(self.iconn.get_document('2').data['a'],
+                         ['changed text'])
+
+        # Replacing a document with the version read from the database is
+        # also skipped.
+        self.iconn.replace(self.iconn.get_document('3'))
+        self.assertEqual(stats.docs_skipped, 5)
+
+        # New documents are written.
+        self.iconn.replace(self._doc('5', 'new'))
+        self.assertEqual(stats.docs_written, 7)
+        self.assertEqual(self.iconn.get_doccount(), 6)
+
+    def test_replace_many(self):
+        self.iconn.add_many([self._doc(str(i), 'text %d' % i)
+                             for i in xrange(10)], processes=1)
+        self.iconn.replace_many([self._doc(str(i), 'text %d' % (i % 5))
+                                 for i in xrange(10)], processes=1)
+        stats = self.iconn.get_indexing_stats()
+        self.assertEqual(stats.docs_skipped, 5)
+        self.assertEqual(stats.docs_written, 15)
+        self.iconn.flush()
+
+        sconn = xappy.SearchConnection(self.indexpath)
+        self.assertEqual(sconn.get_document('7').data['a'], ['text 2'])
+        sconn.close()
+
+    def test_disabled(self):
+        self.iconn.set_skip_unchanged(False)
+        self.iconn.add(self._doc('1', 'text'))
+        self.iconn.replace(self._doc('1', 'text'))
+        stats = self.iconn.get_indexing_stats()
+        self.assertEqual(stats.docs_written, 2)
+        self.assertEqual(stats.docs_skipped, 0)
+
+        # Documents written without a stored hash are written when replaced.
+        self.iconn.set_skip_unchanged()
+        self.iconn.replace(self._doc('1', 'text'))
+        self.assertEqual(stats.docs_written, 3)
+        self.iconn.replace(self._doc('1', 'text'))
+        self.assertEqual(stats.docs_skipped, 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+import cPickle
+import xapian
+from xappy.datastructures import ProcessedDocument
+
+class TestStoredData(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        self.iconn = xappy.IndexerConnection(self.indexpath)
+        self.iconn.add_field_action('title', xappy.FieldActions.STORE_CONTENT)
+        self.iconn.add_field_action('body', xappy.FieldActions.STORE_CONTENT)
+        self.iconn.add_field_action('body', xappy.FieldActions.INDEX_FREETEXT)
+        self.iconn.add_field_action('tag', xappy.FieldActions.STORE_CONTENT)
+
+    def post_test(self):
+        self.iconn.close()
+
+    def test_roundtrip(self):
+        doc = xappy.UnprocessedDocument('1')
+        doc.append('title', 'A title')
+        doc.append('body', 'Some body text ' * 100)
+        doc.append('tag', u'caf\xe9')
+        doc.extend([xappy.FieldGroup([('tag', 'red'), ('title', 'Other')])])
+        self.iconn.add(doc)
+        self.iconn.flush()
+
+        pdoc = self.iconn.get_document('1')
+        self.assertTrue(pdoc.prepare().get_data().startswith('\x00XD'))
+        self.assertEqual(pdoc.get_data('title'), ['A title', 'Other'])
+        self.assertEqual(pdoc._get_layout()._decoded.keys(), ['title'])
+        self.assertRaises(KeyError, pdoc.get_data, 'missing')
+        self.assertEqual(pdoc.data, {
+            'title': ['A title', 'Other'],
+            'body': ['Some body text ' * 100],
+            'tag': [u'caf\xe9', 'red'],
+        })
+        self.assertEqual(pdoc._get_groups(), [[('tag', 1), ('title', 1)]])
+
+        # Changing just the data keeps the groups.
+        pdoc.data['title'][0] = 'New title'
+        self.iconn.replace(pdoc)
+        self.iconn.flush()
+        pdoc = self.iconn.get_document('1')
+        self.assertEqual(pdoc.get_data('title'), ['New title', 'Other'])
+        self.assertEqual(pdoc.grouped_data[1],
+                         [{'tag': ['red'], 'title': ['Other']}])
+
+    def test_old_format(self):
+        xapdoc = xapian.Document()
+        xapdoc.set_data(cPickle.dumps(({'title': ['Old']},
+                                       {'title': {('XAold', 0): 1}},
+                                       [[('title', 0)]]), 2))
+        xapdoc.add_term('Qold')
+        self.iconn._index.add_document(xapdoc)
+        self.iconn.flush()
+
+        pdoc = self.iconn.get_document('old')
+        self.assertEqual(pdoc.get_data('title'), ['Old'])
+        self.assertEqual(pdoc.data, {'title': ['Old']})
+        self.assertEqual(pdoc._get_assocs(), {'title': {('XAold', 0): 1}})
+
+        # Documents are converted to the new format when they're rewritten.
+        pdoc.data['title'].append('New')
+        xapdoc = pdoc.prepare()
+        self.assertTrue(xapdoc.get_data().startswith('\x00XD'))
+        pdoc = ProcessedDocument(self.iconn._field_mappings, xapdoc)
+        self.assertEqual(pdoc.data, {'title': ['Old', 'New']})
+        self.assertEqual(pdoc._get_assocs(), {'title': {('XAold', 0): 1}})
+        self.assertEqual(pdoc._get_groups(), [[('title', 0)]])
+
+if __name__ == '__main__':
+    main()
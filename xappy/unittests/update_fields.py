@@ -0,0 +1,107 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from xappytest import *
+
+class TestUpdateFields(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        self.iconn = xappy.IndexerConnection(self.indexpath)
+        self.iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        self.iconn.add_field_action('text', xappy.FieldActions.STORE_CONTENT)
+        self.iconn.add_field_action('title', xappy.FieldActions.INDEX_FREETEXT,
+                                    language='en', search_by_default=False)
+        self.iconn.add_field_action('title', xappy.FieldActions.STORE_CONTENT)
+        self.iconn.add_field_action('price', xappy.FieldActions.SORTABLE,
+                                    type='float')
+        self.iconn.add_field_action('price', xappy.FieldActions.STORE_CONTENT)
+        self.iconn.add_field_action('tag', xappy.FieldActions.INDEX_EXACT)
+        self.iconn.add_field_action('tag', xappy.FieldActions.STORE_CONTENT)
+
+        for i in xrange(3):
+            doc = xappy.UnprocessedDocument(str(i))
+            doc.append('text', 'some text about item %d' % i)
+            doc.append('title', 'Item number %d' % i)
+            doc.append('price', str(i * 10))
+            doc.append((('tag', 'Red'), ('price', str(i * 10 + 1))))
+            self.iconn.add(doc)
+        self.iconn.flush()
+
+    def post_test(self):
+        self.iconn.close()
+
+    def _search(self, sconn, query, sortby=None):
+        return [result.id for result in sconn.search(query, 0, 10,
+                                                     sortby=sortby)]
+
+    def test_update_fields(self):
+        self.iconn.update_fields('1', {'price': '100',
+                                       'title': 'Renamed things',
+                                       'tag': ['Blue', 'green']})
+        self.iconn.flush()
+
+        doc = self.iconn.get_document('1')
+        self.assertEqual(doc.data, {
+            'text': ['some text about item 1'],
+            'title': ['Renamed things'],
+            'price': ['100'],
+            'tag': ['Blue', 'green'],
+        })
+        self.assertEqual(doc.grouped_data[1], [])
+
+        sconn = xappy.SearchConnection(self.indexpath)
+        self.assertEqual(self._search(sconn, sconn.query_field('title',
+                                                               'number')),
+                         ['0', '2'])
+        self.assertEqual(self._search(sconn, sconn.query_field('title',
+                                                               'thing')),
+                         ['1'])
+        self.assertEqual(self._search(sconn, sconn.query_field('tag', 'Red')),
+                         ['0', '2'])
+        self.assertEqual(self._search(sconn, sconn.query_field('tag',
+                                                               'green')),
+                         ['1'])
+        self.assertEqual(self._search(sconn, sconn.query_range('price', 50,
+                                                               None)),
+                         ['1'])
+        self.assertEqual(self._search(sconn, sconn.query_all(), '-price'),
+                         ['1', '2', '0'])
+
+        # The other fields are unchanged.
+        self.assertEqual(self._search(sconn, sconn.query_parse('item')),
+                         ['0', '1', '2'])
+        sconn.close()
+
+    def test_remove_field(self):
+        self.iconn.update_fields('2', {'tag': []})
+        self.iconn.flush()
+        doc = self.iconn.get_document('2')
+        self.assertEqual(sorted(doc.data.keys()), ['price', 'text', 'title'])
+        self.assertEqual(doc.grouped_data[1], [{'price': ['21']}])
+
+    def test_errors(self):
+        self.assertRaises(xappy.IndexerError, self.iconn.update_fields, '1',
+                          {'text': 'new text'})
+        self.assertRaises(xappy.IndexerError, self.iconn.update_fields, '1',
+                          {'unknown': 'value'})
+        self.assertRaises(xappy.IndexerError, self.iconn.update_fields, '10',
+                          {'price': '1'})
+
+if __name__ == '__main__':
+    main()
@@ -50,6 +50,9 @@ class ExternalWeightConstant(xappy.ExternalWeightSource):
     def get_weight(self, doc):
         return self.value
 
+    def __repr__(self):
+        return 'ExternalWeightConstant(%r)' % self.value
+
 class TestWeightExternal(TestCase):
     def pre_test(self):
         self.indexpath = os.path.join(self.tempdir, 'foo')
@@ -107,5 +110,26 @@ class TestWeightExternal(TestCase):
         r = self.sconn.search(q, 0, 10)
         self.assertEqual([int(i.id) for i in r], [3])
 
+    def test_not_portable(self):
+        """Check that queries using external weights aren't portable.
+
+        Their serialised form can't be used to rebuild them, even when the
+        weight source has a readable repr, so they mustn't be used as cache
+        keys or sent to another connection.
+
+        """
+        query = self.sconn.query_field("exact", "3")
+        self.assertNotEqual(query._get_portable_repr(), None)
+        ext = self.sconn.query_external_weight(ExternalWeightConstant(1.7))
+        self.assertEqual(ext._get_portable_repr(), None)
+        self.assertEqual(query.adjust(ext)._get_portable_repr(), None)
+        self.assertEqual((ext | query)._get_portable_repr(), None)
+        self.assertEqual(self.add_external_value(query)._get_portable_repr(),
+                         None)
+
+        # Only the flag matters, not what the serialised form looks like.
+        query = self.sconn.query_field("name", "an object at 0x1234")
+        self.assertNotEqual(query._get_portable_repr(), None)
+
 if __name__ == '__main__':
     main()